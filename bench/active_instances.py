@@ -0,0 +1,36 @@
+"""Time taken to find the active instances.
+
+Starts N instances (default 20000) and ends every other one, then
+times listing the active ones with all_active().
+
+    N=20000 python bench/active_instances.py
+"""
+
+import os
+import secrets
+import time
+
+from werkzeug.datastructures import MultiDict
+
+import common
+import expert as e
+from expert.experiment import State
+
+n = int(os.environ.get('N', '20000'))
+reps = 100
+
+cls = common.start()
+cls.start('new')
+with e.app.test_request_context('/survey?PROLIFIC_PID=x'):
+    insts = [cls.new_inst('127.0.0.1', MultiDict({'PROLIFIC_PID': f'P{i}'}),
+                          secrets.token_urlsafe(16)) for i in range(n)]
+for inst in insts[::2]:
+    inst.end(State.TERMINATED)
+
+start = time.perf_counter()
+for _ in range(reps):
+    active = list(cls.all_active())
+secs = (time.perf_counter() - start)/reps
+assert len(active) == n - len(insts[::2])
+print(f'{n} instances, {len(active)} active: all_active {1000*secs:.2f} ms')
+common.finish()
@@ -0,0 +1,135 @@
+"""Setup shared by the benchmark scripts in this folder.
+
+Each script builds a small scratch bundle in a temporary folder,
+starts a server (without listening) with the bundle loaded, and
+times something. Run them from the EXPERt directory, e.g.:
+
+    python bench/task_memory.py
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from pathlib import Path
+from typing import Any, Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import expert as e
+from expert import server
+
+_src = {
+    '__init__.py': '''
+import expert
+from expert.tasks import Task, Consent
+from . import params
+
+
+class Bench(expert.Experiment):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.task = Task(self, 'welcome')
+        self.task.then(Consent, 'consent')
+
+    def create_tasks(self):
+        cursor = self.task
+        for stim in self.profile.stims:
+            cursor = cursor.then(
+                'rating', {'stim': stim, 'questions': params.quests})
+        cursor.then('thankyou')
+''',
+    'params.py': '''
+n_profiles = {n_profiles}
+quests = [['radio', 'q1', 'a', 'b'], ['text', 'q2']]
+''',
+    'cond.py': '''
+conds = {'A': 'A', 'B': 'B'}
+''',
+    'profile.py': '''
+import random
+import expert as e
+from expert import profile
+
+
+class Profile(profile.Profile):
+
+    def __init__(self, condition):
+        super().__init__(condition)
+        self.stims = [f's{i}' for i in range(5)]
+        random.shuffle(self.stims)
+
+    @classmethod
+    def load(cls, cond_str, subjid):
+        inst = super().load(cond_str, subjid)
+        with open(e.experclass.profiles_path / cond_str / subjid) as f:
+            inst.stims = [line.rstrip() for line in f]
+        return inst
+
+    def save(self):
+        path = e.experclass.profiles_path / str(self.cond) / self.subjid
+        with open(path, 'w') as f:
+            for s in self.stims:
+                print(s, file=f)
+'''
+}
+
+
+def make_bundle(root: Path, n_profiles: int,
+                cfg: Optional[dict[str, Any]] = None,
+                src: Optional[dict[str, str]] = None) -> Path:
+    bundle = root / 'bench'
+    (bundle / 'src').mkdir(parents=True)
+    (bundle / 'templates').mkdir()
+    for name, text in {**_src, **(src or {})}.items():
+        if name == 'params.py':
+            text = text.format(n_profiles=n_profiles)
+        (bundle / 'src' / name).write_text(text)
+    for tplt in ('welcome', 'consent', 'rating', 'thankyou'):
+        (bundle / 'templates' / f'task_{tplt}.html.jinja').write_text(
+            f'<p>{tplt}</p>\n')
+    (bundle / 'cfg.json').write_text(json.dumps(
+        {'prolific_completion_url': 'http://localhost', **(cfg or {})}))
+    return bundle
+
+
+_root = Path(tempfile.mkdtemp(prefix='expert-bench-'))
+
+
+def start(n_profiles: int = 20, cfg: Optional[dict[str, Any]] = None,
+          srv_cfg: Optional[dict[str, Any]] = None,
+          src: Optional[dict[str, str]] = None):
+    """Start a server with a scratch bundle of n_profiles profiles
+    loaded, returning the experiment class.
+
+    cfg and srv_cfg are merged into the bundle and server configs,
+    and src replaces or adds bundle source files.
+    """
+    root = _root
+    cfg_path = root / 'cfg.json'
+    cfg_path.write_text(json.dumps({
+        'logfile': str(root / 'debug.log'),
+        'event_log_dir': '',
+        **(srv_cfg or {})
+    }))
+    args = argparse.Namespace(
+        config=str(cfg_path), listen=None, exper_path=None, tool=False,
+        dummy=None, resume=None, replicate=None, conditions=None)
+    e.srv = server.Server(args)
+    e.srv.load_bundle(make_bundle(root, n_profiles, cfg, src),
+                      tool_mode=False)
+    assert e.experclass
+    return e.experclass
+
+
+def finish():
+    # (older trees have no write queue)
+    if hasattr(e.srv, 'writer'):
+        e.srv.writer.flush()
+    shutil.rmtree(_root, ignore_errors=True)
+    # (skip the server's shutdown handlers)
+    os._exit(0)
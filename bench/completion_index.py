@@ -0,0 +1,59 @@
+"""Time taken to start, resume and replicate a run with many results.
+
+Makes P profiles (default 50000) and times starting a new run with
+them, then makes that run's results, with N profiles per condition
+(default 5000) completed and another 2000 per condition timed out,
+and times starting a run that resumes it and one that replicates it.
+
+    P=50000 N=5000 python bench/completion_index.py
+"""
+
+import os
+import time
+
+import common
+
+try:
+    from expert import manifest
+except ImportError:
+    # (trees from before the run manifest)
+    manifest = None
+
+n_profiles = int(os.environ.get('P', '50000'))
+n = int(os.environ.get('N', '5000'))
+n_timed_out = 2000
+
+cls = common.start(n_profiles)
+start = time.perf_counter()
+cls.start('new')
+print(f'start: {1000*(time.perf_counter() - start):.0f} ms'
+      f' ({len(cls.profiles)} available)')
+run = cls.run
+run_path = cls.runs_path / run
+for cond in ('A', 'B'):
+    (run_path / cond).mkdir(exist_ok=True)
+    names = sorted(os.listdir(cls.profiles_path / cond))
+    for name in names[:n]:
+        (run_path / cond / name).write_text('x')
+    for name in names[n:n + n_timed_out]:
+        (run_path / cond / (name + '-timeout')).write_text('x')
+
+if manifest:
+    start = time.perf_counter()
+    counts = manifest.scan(run_path)['counts']
+    print(f'rescan: {1000*(time.perf_counter() - start):.0f} ms {counts}')
+# NB: Runs are named by their start time, to the second, so the
+# replicating run would otherwise clash with the one it replicates
+time.sleep(1.1)
+start = time.perf_counter()
+cls.start('res', run)
+res_secs = time.perf_counter() - start
+res_avail = len(cls.profiles)
+start = time.perf_counter()
+cls.start('rep', run)
+rep_secs = time.perf_counter() - start
+rep_avail = len(cls.profiles)
+print(f'{2*n} completed: resume {1000*res_secs:.0f} ms'
+      f' ({res_avail} available),'
+      f' replicate {1000*rep_secs:.0f} ms ({rep_avail} available)')
+common.finish()
@@ -0,0 +1,38 @@
+"""Time taken and data sent when a dashboard connects.
+
+Starts N instances (default 10000), each of which adds an event to
+the dashboard, then times the dboard_init call and reports the size
+of its result as JSON.
+
+    N=10000 python bench/dboard_init.py
+"""
+
+import json
+import os
+import secrets
+import time
+
+from werkzeug.datastructures import MultiDict
+
+import common
+import expert as e
+
+n = int(os.environ.get('N', '10000'))
+reps = 20
+
+cls = common.start()
+cls.start('new')
+with e.app.test_request_context('/survey?PROLIFIC_PID=x'):
+    for i in range(n):
+        cls.new_inst('127.0.0.1', MultiDict({'PROLIFIC_PID': f'P{i}'}),
+                     secrets.token_urlsafe(16))
+
+api = e.srv.dboard._api
+start = time.perf_counter()
+for _ in range(reps):
+    data = api.dboard_init()
+secs = (time.perf_counter() - start)/reps
+size = len(json.dumps(data))
+print(f'{n} instance events: dboard_init {1000*secs:.1f} ms,'
+      f' {size/1000:.0f} KB')
+common.finish()
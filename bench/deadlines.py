@@ -0,0 +1,51 @@
+"""Time taken to keep track of instance timeouts.
+
+Starts N instances (default 10000), none of them due to time out,
+and times a monitor wake-up with nothing due (in trees from before
+the deadline heap, a check of every active instance instead), and
+setting an instance's timeout deadline.
+
+    N=10000 python bench/deadlines.py
+"""
+
+import os
+import secrets
+import time
+
+from werkzeug.datastructures import MultiDict
+
+import common
+import expert as e
+
+n = int(os.environ.get('N', '10000'))
+reps = 1000
+
+cls = common.start()
+cls.start('new')
+with e.app.test_request_context('/survey?PROLIFIC_PID=x'):
+    insts = [cls.new_inst('127.0.0.1', MultiDict({'PROLIFIC_PID': f'P{i}'}),
+                          secrets.token_urlsafe(16)) for i in range(n)]
+
+if hasattr(cls, 'deadlines'):
+    start = time.perf_counter()
+    for _ in range(reps):
+        cls.deadlines.next_time()
+        cls.deadlines.pop_due(time.monotonic())
+    wake_secs = (time.perf_counter() - start)/reps
+    later = time.monotonic() + 3600
+    start = time.perf_counter()
+    for inst in insts:
+        cls.deadlines.set(inst.sid, 'timeout', later)
+    set_secs = (time.perf_counter() - start)/n
+    print(f'{n} instances: wake-up {1e6*wake_secs:.1f} us,'
+          f' set a deadline {1e6*set_secs:.1f} us')
+else:
+    reps = 10
+    start = time.perf_counter()
+    for _ in range(reps):
+        for inst in cls.all_active():
+            if not inst.check_for_timeout():
+                inst.check_lease()
+    tick_secs = (time.perf_counter() - start)/reps
+    print(f'{n} instances: check all {1e6*tick_secs:.1f} us')
+common.finish()
@@ -0,0 +1,43 @@
+"""Time taken to persist dashboard events and read them back.
+
+Appends N events (default 20000) to an event log kept on disk, then
+times reopening the log, reading its newest page of 200 events (all
+of which are on disk after reopening), and reading the page before
+that one (from the cached segment).
+
+    N=20000 python bench/event_log.py
+"""
+
+import os
+import time
+
+import common
+import expert as e
+from expert import eventlog
+
+n = int(os.environ.get('N', '20000'))
+page_size = 200
+
+cls = common.start()
+path = cls.dir_path.parent / 'events'
+log = eventlog.EventLog(10000, path, 5000, 50)
+start = time.perf_counter()
+for _ in range(n):
+    log.append(eventlog.Event('bundle_load', 'bench'))
+append_secs = (time.perf_counter() - start)/n
+e.srv.writer.flush()
+
+start = time.perf_counter()
+log = eventlog.EventLog(10000, path, 5000, 50)
+reopen_secs = time.perf_counter() - start
+start = time.perf_counter()
+page, _ = log.page(None, page_size)
+disk_secs = time.perf_counter() - start
+start = time.perf_counter()
+log.page(page[0].seq, page_size)
+cached_secs = time.perf_counter() - start
+print(f'{n} events: append {1e6*append_secs:.1f} us/event,'
+      f' reopen {1000*reopen_secs:.1f} ms,'
+      f' page from disk {1000*disk_secs:.1f} ms,'
+      f' cached page {1000*cached_secs:.2f} ms')
+common.finish()
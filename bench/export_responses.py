@@ -0,0 +1,47 @@
+"""Time and memory taken to export a run's responses.
+
+Writes N response files (default 20000), each with a SID row and
+20 responses, in CSV, then exports the run to /dev/null, once
+timed and once with tracemalloc reporting the peak.
+
+    N=20000 python bench/export_responses.py
+"""
+
+import csv
+import os
+import secrets
+import time
+import tracemalloc
+
+import common
+
+n = int(os.environ.get('N', '20000'))
+
+cls = common.start()
+run = 'bench'
+run_path = cls.runs_path / run
+for cond in ('A', 'B'):
+    (run_path / cond).mkdir(parents=True)
+for i in range(n):
+    with open(run_path / 'AB'[i % 2] / f'p{i:05}', 'w', newline='') as f:
+        w = csv.writer(f, lineterminator='\n')
+        w.writerow(['time', 'task', 'resp', 'x'])
+        w.writerow(['t', 'SID', secrets.token_urlsafe(16), ''])
+        for k in range(20):
+            w.writerow(['t', 'rating', k, 'v'])
+
+
+def export():
+    with open(os.devnull, 'w', newline='') as f:
+        cls.dump_responses(cls.collect_responses(run), f)
+
+
+start = time.perf_counter()
+export()
+secs = time.perf_counter() - start
+tracemalloc.start()
+export()
+peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+print(f'{n} subjects: {secs:.1f} s, {peak/1e6:.1f} MB peak')
+common.finish()
@@ -0,0 +1,37 @@
+"""Time taken by the dashboard to list runs.
+
+Makes R runs (default 40), each with F response files (default 1000)
+split between the two conditions, lists them once (which lets the
+manifests get written, where there are any), and then times listing
+them again.
+
+    R=40 F=1000 python bench/get_runs.py
+"""
+
+import os
+import time
+
+import common
+import expert as e
+
+n_runs = int(os.environ.get('R', '40'))
+n_files = int(os.environ.get('F', '1000'))
+
+cls = common.start()
+for r in range(n_runs):
+    for i in range(n_files):
+        cond_path = cls.runs_path / f'bench{r:02}' / 'AB'[i % 2]
+        cond_path.mkdir(parents=True, exist_ok=True)
+        (cond_path / f'p{i}').write_text('x')
+
+api = e.srv.dboard._api
+api.get_runs()
+# (older trees have no write queue)
+if hasattr(e.srv, 'writer'):
+    e.srv.writer.flush()
+start = time.perf_counter()
+runs = api.get_runs()
+secs = time.perf_counter() - start
+assert sum(run['num_complete'] for run in runs) == n_runs*n_files
+print(f'{n_runs} runs x {n_files} files: get_runs {1000*secs:.1f} ms')
+common.finish()
@@ -0,0 +1,62 @@
+"""Time and memory taken to build task chains, with and without
+the lazy_tasks option.
+
+For each setting, builds N chains (default 20) of 1000 tasks from
+TaskDescs with then_all(), one per instance, and reports the mean
+time and memory traced per chain.
+
+    N=20 python bench/lazy_tasks.py
+"""
+
+import gc
+import os
+import secrets
+import time
+import tracemalloc
+
+from werkzeug.datastructures import MultiDict
+
+import common
+import expert as e
+from expert.tasks import Task, TaskDesc
+
+n = int(os.environ.get('N', '20'))
+num_tasks = 1000
+
+
+class RatingTask(Task):
+
+    template = 'rating'
+
+    def __init__(self, inst, sound, orth):
+        super().__init__(inst, variables={'sound': sound, 'orth': orth})
+        self.resp_extra = {'sound': sound}
+
+
+cls = common.start()
+cls.start('new')
+descs = [TaskDesc([RatingTask, f'snd{i}.wav', f'orth{i}'])
+         for i in range(num_tasks)]
+
+with e.app.test_request_context('/survey?PROLIFIC_PID=x'):
+    for lazy in (False, True):
+        cls.cfg['lazy_tasks'] = lazy
+        insts = [cls('127.0.0.1', MultiDict({'PROLIFIC_PID': f'P{i}'}),
+                     secrets.token_urlsafe(16)) for i in range(n)]
+        gc.collect()
+        tracemalloc.start()
+        for inst in insts:
+            inst.task.then_all(descs)
+        gc.collect()
+        mem = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        # (timed separately, as tracing slows things down)
+        insts = [cls('127.0.0.1', MultiDict({'PROLIFIC_PID': f'P{i}'}),
+                     secrets.token_urlsafe(16)) for i in range(n)]
+        start = time.perf_counter()
+        for inst in insts:
+            inst.task.then_all(descs)
+        secs = time.perf_counter() - start
+        print(f'{"lazy" if lazy else "eager"}: {1000*secs/n:.1f} ms,'
+              f' {mem/n/1024:.0f} KiB per chain of {num_tasks}')
+common.finish()
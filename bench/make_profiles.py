@@ -0,0 +1,47 @@
+"""Time taken to create profiles.
+
+Makes P profiles (default 100000), each holding a shuffled list of
+200 stimuli and saved to its own file by the bundle, with
+profile_workers set to WORKERS (default 1), and reports the time
+taken (along with starting the server).
+
+    P=100000 WORKERS=4 python bench/make_profiles.py
+"""
+
+import os
+import time
+
+import common
+
+n_profiles = int(os.environ.get('P', '100000'))
+workers = int(os.environ.get('WORKERS', '1'))
+
+profile_src = '''
+import random
+import expert as e
+from expert import profile
+
+
+class Profile(profile.Profile):
+
+    def __init__(self, condition):
+        super().__init__(condition)
+        self.stims = [f's{i}' for i in range(200)]
+        random.shuffle(self.stims)
+
+    def save(self):
+        path = e.experclass.profiles_path / str(self.cond) / self.subjid
+        with open(path, 'w') as f:
+            for s in self.stims:
+                print(s, file=f)
+'''
+
+start = time.perf_counter()
+cls = common.start(n_profiles, cfg={'profile_workers': workers},
+                   src={'profile.py': profile_src})
+secs = time.perf_counter() - start
+assert sum(len(os.listdir(cls.profiles_path / cond))
+           for cond in ('A', 'B')) == n_profiles
+print(f'{n_profiles} profiles, {workers} worker(s) of {os.cpu_count()}'
+      f' CPU(s): {secs:.1f} s')
+common.finish()
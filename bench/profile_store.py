@@ -0,0 +1,65 @@
+"""Time and space taken by profiles in a given profile format.
+
+Makes P profiles (default 100000), each holding a shuffled list of
+200 stimuli, in profile format FORMAT (default 'files'), with
+profile_workers set to WORKERS (default 1). Reports the time taken
+to create them (along with starting the server), to load 2000 of
+them, and to zip them all for download, and their size on disk.
+
+    P=100000 FORMAT=packed python bench/profile_store.py
+"""
+
+import io
+import os
+import subprocess
+import time
+import zipfile
+
+import common
+
+n_profiles = int(os.environ.get('P', '100000'))
+fmt = os.environ.get('FORMAT', 'files')
+workers = int(os.environ.get('WORKERS', '1'))
+
+profile_src = '''
+import random
+from expert import profile
+
+
+class Profile(profile.Profile):
+
+    def __init__(self, condition):
+        super().__init__(condition)
+        self.stims = [f's{i}' for i in range(200)]
+        random.shuffle(self.stims)
+
+    def save_data(self):
+        return '\\n'.join(self.stims).encode()
+
+    def load_data(self, data):
+        self.stims = str(data, 'utf-8').split('\\n')
+'''
+
+start = time.perf_counter()
+cls = common.start(
+    n_profiles, cfg={'profile_format': fmt, 'profile_workers': workers},
+    src={'profile.py': profile_src})
+create_secs = time.perf_counter() - start
+cls.start('new')
+start = time.perf_counter()
+profs = [cls.profiles.claim() for _ in range(2000)]
+load_secs = time.perf_counter() - start
+assert all(len(prof.stims) == 200 for prof in profs)
+buf = io.BytesIO()
+start = time.perf_counter()
+with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_DEFLATED,
+                     compresslevel=1) as zf:
+    for _ in cls.profile_store.zip_profiles(zf, 'profiles'):
+        pass
+zip_secs = time.perf_counter() - start
+disk = subprocess.run(['du', '-sh', str(cls.profiles_path)],
+                      capture_output=True, text=True).stdout.split()[0]
+print(f'{fmt}, {n_profiles} profiles: create {create_secs:.1f} s,'
+      f' load 2000 {1000*load_secs:.0f} ms, zip {zip_secs:.1f} s,'
+      f' disk {disk}')
+common.finish()
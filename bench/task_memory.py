@@ -0,0 +1,57 @@
+"""Memory taken by instances' task chains.
+
+Creates N instances (default 5000), each with a chain of 63 tasks:
+a questionnaire, 60 trials whose stimulus strings are made fresh
+for each participant (as if read from their profile), and a final
+task, with the question lists shared. Reports the memory traced
+per instance.
+
+    N=5000 python bench/task_memory.py
+"""
+
+import gc
+import os
+import secrets
+import time
+import tracemalloc
+
+from werkzeug.datastructures import MultiDict
+
+import common
+import expert as e
+
+cls = common.start()
+cls.start('new')
+
+quests = [['radio', f'q{i}', 'a', 'b', 'c'] for i in range(10)]
+n = int(os.environ.get('N', '5000'))
+num_trials = 60
+
+
+def build(inst):
+    cursor = inst.task.next_tasks[0]
+    cursor = cursor.then('qnaire', {'questions': quests})
+    for j in range(num_trials):
+        stim = ''.join(['stim', str(j)])
+        cursor = cursor.then('rating', {'stim': stim, 'questions': quests})
+    cursor.then('thankyou', {'code': 'X'})
+
+
+insts = []
+with e.app.test_request_context('/survey?PROLIFIC_PID=x'):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(n):
+        inst = cls('127.0.0.1', MultiDict({'PROLIFIC_PID': f'P{i}'}),
+                   secrets.token_urlsafe(16))
+        build(inst)
+        insts.append(inst)
+    secs = time.perf_counter() - start
+    gc.collect()
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+print(f'{n} instances: {mem/2**20:.1f} MiB,'
+      f' {mem/n/1024:.1f} KiB per instance, {secs:.2f} s')
+common.finish()
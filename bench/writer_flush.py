@@ -0,0 +1,50 @@
+"""Time taken to flush the write queue, and whether other green
+threads keep running meanwhile.
+
+Times flushing an empty queue, then flushes a queue holding one
+write that takes half a second, while a green thread ticks every
+50 ms, and counts the ticks that got in during the flush.
+
+    python bench/writer_flush.py
+"""
+
+import time
+
+import common
+import expert as e
+from expert import writer
+
+reps = 1000
+
+
+class Slow(writer.WriteOp):
+
+    def apply(self, batch):
+        time.sleep(0.5)
+
+
+cls = common.start()
+start = time.perf_counter()
+for _ in range(reps):
+    e.srv.writer.flush()
+empty_secs = (time.perf_counter() - start)/reps
+
+ticks = []
+
+
+def ticker():
+    for _ in range(20):
+        ticks.append(time.perf_counter())
+        e.srv.socketio.sleep(0.05)
+
+
+e.srv.socketio.start_background_task(ticker)
+e.srv.socketio.sleep(0)
+e.srv.writer.submit(Slow(cls.dir_path / 'slow'))
+start = time.perf_counter()
+e.srv.writer.flush()
+end = time.perf_counter()
+during = sum(1 for t in ticks if start < t < end)
+print(f'empty flush {1e6*empty_secs:.0f} us;'
+      f' {1000*(end - start):.0f} ms flush, {during} ticks during it')
+common.finish()
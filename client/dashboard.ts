@@ -16,13 +16,59 @@ export interface Inst {
     task: number;
     time: string;
     elapsed: string;
+    // only for active instances, which the client times itself
+    elapsed_secs?: number;
 }
 
 export interface Event {
     tag: string;
+    // only for events from the server
+    seq?: number;
+    // row number of 'inst' events
+    row?: number;
     data: Inst | string | number;
 }
 
+// which events to list; see eventlog.py
+export interface EventFilters {
+    tag?: string[];
+    state?: string;
+    cond?: string;
+    profile?: string;
+    sid?: string;
+    // seconds since the epoch
+    since?: number;
+}
+
+// state: counts and approximate size of the instances in that state
+type MemoryUsage = {[state: string]: {
+    in_memory: number;
+    spilled: number;
+    bytes: number;
+}};
+
+// cond: profiles free, claimed and completed
+type PoolDepths = {[cond: string]: {
+    free: number;
+    claimed: number;
+    completed: number;
+}};
+
+// command: call count and latencies (in ms)
+type Latencies = {[cmd: string]: {
+    count: number;
+    errors: number;
+    p50: number;
+    p95: number;
+    p99: number;
+    max: number;
+}};
+
+const statusPollMs = 15000;
+// number of the slowest participant API commands shown
+const slowestCmdsShown = 4;
+const elapsedTickMs = 1000;
+
 interface RunInfo {
     run: string | null;
     mode: string | null;
@@ -54,6 +100,7 @@ export class Dashboard extends Controller {
     vars: {[name: string]: any} | null;
     instList: InstList;
     private uploader = new Uploader(this);
+    private _statusTimer: number | null = null;
 
     constructor() {
         super();
@@ -63,6 +110,7 @@ export class Dashboard extends Controller {
             'new-run': async () => await this.newRun(), 
             'reload': async () => await this.reloadBundle(), 
             'profiles': async () => await this.rebuildProfiles(), 
+            'compact': async () => await this.compactResponses(), 
             'download': async () => {
                 const ok = await this.runsDlg.show(
                     'Download Results', 'Download');
@@ -111,31 +159,37 @@ export class Dashboard extends Controller {
     _initSocket(ns: string) {
         super._initSocket(ns);
         this._socket.on('new_instance',
-                        (inst: Inst) => this.instList.addInst(inst));
-        this._socket.on('update_instance', (index: number, inst: Inst) => {
-            //console.log('got update_instance', index, inst);
-            this.instList.setRow(index, inst);
-            if (inst.state === 'COMPLETE') {
-                this.completed++;
+                        (item: Event) => this.instList.addItem(item));
+        // NB: only the fields that have changed are sent
+        this._socket.on('update_instances',
+                        (changes: [number, Partial<Inst>][]) => {
+            let completed = 0;
+            for (const [seq, fields] of changes) {
+                this.instList.setRow(seq, fields);
+                if (fields.state === 'COMPLETE') {
+                    completed++;
+                }
+            }
+            if (completed) {
+                this.completed += completed;
                 this.updateRunInfo();
             }
         });
-        this._socket.on('update_active_instances', (insts: [number, Inst][]) => {
-            for (const [index, inst] of insts) {
-                this.instList.setRow(index, inst);
-            }
+        this._socket.on('profiles_progress', (made: number, total: number) => {
+            elt('pool-info')!.textContent =
+                `creating profiles: ${made}/${total}`;
         });
         this._socket.on('run_complete', () => {
-            this.instList.addSeparator('end', this.run);
+            this.instList.addItem({tag: 'run_complete', data: this.run!});
             this.run = null;
             this.completed = 0;
             this.updateRunInfo();
         });
         this._socket.on('page_load_error', (tback: string) => {
-            this.instList.addSeparator('error', tback);
+            this.instList.addItem({tag: 'page_load_error', data: tback});
         });
         this._socket.on('api_error', (tback: string) => {
-            this.instList.addSeparator('error', tback);
+            this.instList.addItem({tag: 'api_error', data: tback});
         });
     }
 
@@ -151,6 +205,18 @@ export class Dashboard extends Controller {
         this.confirmDlg = await new ConfirmDialog(this).init();
         this.msgDlg = await new MessageDialog(this).init();
         this.instList = new InstList(this);
+        window.setInterval(() => this.instList.tickElapsed(), elapsedTickMs);
+        elt('load-earlier-btn')!.addEventListener(
+            'click', async () => await this.loadEarlierEvents());
+        elt('filter-btn')!.addEventListener(
+            'click', async () => await this.filterEvents(this.readFilters()));
+        elt('filter-clear-btn')!.addEventListener('click', async () => {
+            for (const input of elt('inst-filters')!.querySelectorAll(
+                'input, select')) {
+                (input as HTMLInputElement).value = '';
+            }
+            await this.filterEvents({});
+        });
 
         for (const [name, info] of Object.entries(this.toolbarBtns)) {
             info.element.addEventListener('click', async () => {
@@ -191,8 +257,9 @@ export class Dashboard extends Controller {
         const data: {
             vars: {[name: string]: any}, 
             list_items: Event[], 
+            more_items: boolean,
             run_info: RunInfo
-        } = await this.api('dboard_init');
+        } = await this.api('dboard_init', [this.instList.filters]);
         if (this.vars &&
             this.vars['exp_version'] !== data.vars['exp_version']) {
             await this.errorOverlay.makeVisible();
@@ -200,11 +267,15 @@ export class Dashboard extends Controller {
         this.vars = data.vars;
         this.bundle = this.vars['exp_app_name'];
         this._onBundleUpdate();
-        this.instList.clear();
-        this.instList.update(data.list_items);
+        this.instList.update(data.list_items, data.more_items);
         this.run = data.run_info.run;
         this.completed = this.vars['exp_completed_profiles'];
         this.updateRunInfo();
+        await this.updateStatus();
+        if (this._statusTimer === null) {
+            this._statusTimer = window.setInterval(
+                () => this.updateStatus(), statusPollMs);
+        }
         console.log(
             `initializing; bundle: ${this.vars['exp_app_name']};` +
             ` run: ${this.run}`);
@@ -218,6 +289,12 @@ export class Dashboard extends Controller {
         this.toolbarBtns['load'].element.disabled = true;
         this.toolbarBtns['download-log'].element.disabled = true;
         this._onBundleUpdate();
+        if (this._statusTimer !== null) {
+            window.clearInterval(this._statusTimer);
+            this._statusTimer = null;
+        }
+        elt('pool-info')!.textContent = '';
+        elt('mem-info')!.textContent = '';
     }
 
     async api(cmd: string, params: any[] = [], showTraceback=true) {
@@ -249,11 +326,15 @@ export class Dashboard extends Controller {
             btns.forEach(name => {
                 this.toolbarBtns[name].element.disabled = false;
             });
+            // only tool mode sessions last long enough to need it
+            this.toolbarBtns['compact'].element.disabled =
+                !this.vars!['exp_tool_mode'];
         } else {
             elt('bundle-name')!.textContent = '<None>';
             btns.forEach(name => {
                 this.toolbarBtns[name].element.disabled = true;
             });
+            this.toolbarBtns['compact'].element.disabled = true;
         }
     }
 
@@ -272,11 +353,12 @@ export class Dashboard extends Controller {
                 if (tback) {
                     await this.tracebackDlg.show(tback);
                     if (this.bundle) {
-                        this.instList.addSeparator('unload', this.bundle);
+                        this.instList.addItem(
+                            {tag: 'bundle_unload', data: this.bundle!});
                     }
                 } else {
-                    this.instList.addSeparator(
-                        'load', this.bundlesDlg.bundle);
+                    this.instList.addItem(
+                        {tag: 'bundle_load', data: this.bundlesDlg.bundle!});
                 }
                 this.vars = vars;
                 this.bundle = vars['exp_app_name'];
@@ -296,7 +378,7 @@ export class Dashboard extends Controller {
                 this.run = info.run;
                 this.completed = 0;
                 this.updateRunInfo();
-                this.instList.addSeparator('start', this.run);
+                this.instList.addItem({tag: 'new_run', data: this.run!});
             } else {
                 await this.tracebackDlg.show(err);
             }
@@ -305,7 +387,7 @@ export class Dashboard extends Controller {
 
     async stopRun() {
         await this.api('stop_run');
-        this.instList.addSeparator('stop', this.run);
+        this.instList.addItem({tag: 'run_stop', data: this.run!});
         this.run = null;
         this.completed = 0;
         this.updateRunInfo();
@@ -321,10 +403,12 @@ export class Dashboard extends Controller {
             }
             const {vars, err} = await this.api('reload_bundle', [toolMode]);
             if (!err) {
-                this.instList.addSeparator('reload', this.bundle);
+                this.instList.addItem(
+                    {tag: 'bundle_reload', data: this.bundle!});
             } else {
                 await this.tracebackDlg.show(err);
-                this.instList.addSeparator('unload', this.bundle);
+                this.instList.addItem(
+                    {tag: 'bundle_unload', data: this.bundle!});
                 this.bundle = null;
                 this._onBundleUpdate();
             }
@@ -338,7 +422,7 @@ export class Dashboard extends Controller {
     async unloadBundle() {
         // unload_bundle never returns an error
         this.vars = (await this.api('unload_bundle')).vars;
-        this.instList.addSeparator('unload', this.bundle);
+        this.instList.addItem({tag: 'bundle_unload', data: this.bundle!});
         this.bundle = null;
         this._onBundleUpdate();
     }
@@ -352,10 +436,12 @@ export class Dashboard extends Controller {
             }
             const {vars, err} = await this.api('rebuild_profiles');
             if (!err) {
-                this.instList.addSeparator('profiles');
+                this.instList.addItem({tag: 'profiles_rebuild', data: ''});
+                await this.updatePoolInfo();
             } else {
                 await this.tracebackDlg.show(err);
-                this.instList.addSeparator('unload', this.bundle);
+                this.instList.addItem(
+                    {tag: 'bundle_unload', data: this.bundle!});
                 this.bundle = null;
                 this._onBundleUpdate();
             }
@@ -366,6 +452,11 @@ export class Dashboard extends Controller {
         }
     }
 
+    async compactResponses() {
+        // write out the journaled responses of all active sessions
+        await this.api('compact_responses');
+    }
+
     download(what: string, run: string | null = null) {
         const anchor = document.createElement('a');
         anchor.href = `${this.vars!['exp_dashboard_path']}/download/${what}`;
@@ -379,6 +470,40 @@ export class Dashboard extends Controller {
         document.body.removeChild(anchor);
     }
 
+    readFilters(): EventFilters {
+        const value = (name: string) =>
+            (elt(`filter-${name}`) as HTMLInputElement).value.trim();
+        const filters: EventFilters = {};
+        if (value('tag')) {
+            filters.tag = value('tag').split(',');
+        }
+        for (const name of ['state', 'cond', 'profile', 'sid'] as const) {
+            if (value(name)) {
+                filters[name] = value(name);
+            }
+        }
+        // NB: the input is in local time
+        if (value('since')) {
+            filters.since = Date.parse(value('since'))/1000;
+        }
+        return filters;
+    }
+
+    async filterEvents(filters: EventFilters) {
+        const {items, more} = await this.api('get_events', [null, filters]);
+        this.instList.filters = filters;
+        this.instList.update(items, more);
+    }
+
+    async loadEarlierEvents() {
+        const btn = elt('load-earlier-btn') as HTMLButtonElement;
+        btn.disabled = true;
+        const {items, more} = await this.api(
+            'get_events', [this.instList.oldestSeq, this.instList.filters]);
+        this.instList.prepend(items, more);
+        btn.disabled = false;
+    }
+
     updateRunInfo() {
         const runInfo = elt('run-info')!;
         if (this.run) {
@@ -393,6 +518,60 @@ export class Dashboard extends Controller {
         //}
     }
 
+    async updateStatus() {
+        await this.updatePoolInfo();
+        await this.updateMemInfo();
+        await this.updateLatencyInfo();
+    }
+
+    async updatePoolInfo() {
+        const poolInfo = elt('pool-info')!;
+        const depths: PoolDepths | null =
+            await this.api('profile_pool', [], false);
+        if (!depths || !Object.keys(depths).length) {
+            poolInfo.textContent = '<None>';
+            return;
+        }
+        poolInfo.textContent = Object.entries(depths).map(([cond, d]) =>
+            `${cond} ${d.free} free/${d.claimed} out/${d.completed} done`
+        ).join(', ');
+    }
+
+    async updateMemInfo() {
+        const memInfo = elt('mem-info')!;
+        const usage: MemoryUsage | null =
+            await this.api('memory_usage', [], false);
+        if (!usage) {
+            memInfo.textContent = '<None>';
+            return;
+        }
+        const parts = [];
+        for (const [state, u] of Object.entries(usage)) {
+            if (!u.in_memory && !u.spilled) {
+                continue;
+            }
+            let part = `${state} ${u.in_memory}`;
+            if (u.spilled) {
+                part += ` (+${u.spilled} on disk)`;
+            }
+            parts.push(`${part}: ${(u.bytes/1024).toFixed(1)} KiB`);
+        }
+        memInfo.textContent = parts.length ? parts.join(', ') : '<None>';
+    }
+
+    async updateLatencyInfo() {
+        const apiInfo = elt('api-info')!;
+        const {participant}: {participant: Latencies} =
+            await this.api('api_latency', [], false);
+        const ms = (t: number) => t < 10 ? t.toFixed(1) : t.toFixed(0);
+        const slowest = Object.entries(participant)
+            .sort(([, a], [, b]) => b.p95 - a.p95)
+            .slice(0, slowestCmdsShown);
+        apiInfo.textContent = slowest.length ? slowest.map(([cmd, l]) =>
+            `${cmd} x${l.count} ${ms(l.p50)}/${ms(l.p95)}/${ms(l.p99)} ms`
+        ).join(', ') : '<None>';
+    }
+
 }
 
 /*let dboard;
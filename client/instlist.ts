@@ -1,14 +1,19 @@
-
 import { View, type Controller, elt } from '@fizz/expert-client';
-import { type Dashboard, type Event, type Inst } from './dashboard';
+import {
+    type Dashboard, type Event, type EventFilters, type Inst
+} from './dashboard';
 
 export class InstList extends View {
     cols: string[];
     cellClasses: string[];
-    numRows: number;
     numCols: number;
+    filters: EventFilters = {};
+    // seq of the earliest event shown, for fetching the ones before it
+    oldestSeq: number | null = null;
     private _eventSeps: { [evt: string]: string };
     private _sepText: { [sepType: string]: (...args: any[]) => string };
+    // event seq: start time (ms) and elapsed time cell of an active instance
+    private _timing = new Map<number, {start: number, div: HTMLDivElement}>();
 
     constructor(ctrlr: Controller) {
         super(elt('inst-data')!, ctrlr);
@@ -18,7 +23,6 @@ export class InstList extends View {
             'dboard-num', 'dboard-id', 'dboard-clientip',
             'dboard-profile', 'dboard-state', 'dboard-task',
             'dboard-started', 'dboard-elapsed'];
-        this.numRows = 0;
         this.numCols = this.cellClasses.length;
         //this.errors = [];
         this._eventSeps = {
@@ -40,6 +44,7 @@ export class InstList extends View {
             reload: bundle => `Bundle '${bundle}' reloaded`,
             profiles: () => 'Profiles rebuilt',
             unload: bundle => `Bundle '${bundle}' unloaded`,
+            unknown: () => 'UNKNOWN EVENT',
             error: (tback, div) => {
                 //this.errors.push(tback);
                 //div.dataset.error = this.errors.length - 1;
@@ -50,21 +55,23 @@ export class InstList extends View {
         };
     }
 
-    newRow(): HTMLDivElement[] {
+    newRow(seq: number, row: number,
+           parent: ParentNode = this.node): HTMLDivElement[] {
         const divs: HTMLDivElement[] = [];
         for (let i = 0; i < this.numCols; i++) {
             divs.push(document.createElement('div'));
-            this.node.append(divs[i]);
+            parent.append(divs[i]);
             divs[i].classList.add(this.cellClasses[i], 'dboard-item');
         }
-        divs[0].textContent = `${this.numRows + 1}`;
-        divs[1].dataset.index = `${this.numRows++}`;
-        return divs;
+        divs[0].textContent = `${row + 1}`;
+        divs[1].dataset.seq = `${seq}`;
+        // NB: the row number isn't one of the fields
+        return divs.slice(1);
     }
 
-    getRow(index: number): HTMLDivElement[] {
+    getRow(seq: number): HTMLDivElement[] {
         const indexDiv: HTMLDivElement | null = this.node.querySelector(
-            `div[data-index="${index}"]`);
+            `div[data-seq="${seq}"]`);
         if (indexDiv) {
             const divs = [indexDiv];
             for (let i=2; i<this.numCols; i++) {
@@ -75,58 +82,132 @@ export class InstList extends View {
         return [];
     }
 
-    setRow(index: number, fields: Inst) { // , start=0, end=null) {
-        const vals = this.cols.map(name => (fields as {[idx: string]: any})[name]);
-        // NB: if end is set, it must be non-negative
-        //if (end === null) {
-        //    end = this.numCols - 1;
-        //}
-        const divs = this.getRow(index);
-        //for (let i=start; i<end; i++) {
-        //    divs[i].innerHTML = vals[i - start];
-        //}
+    setRow(seq: number, fields: Partial<Inst>) {
+        const divs = this.getRow(seq);
+        // the row may not be loaded, or may be filtered out
+        if (divs.length) {
+            this._setCells(seq, divs, fields);
+        }
+    }
+
+    private _setCells(seq: number, divs: HTMLDivElement[],
+                      fields: Partial<Inst>) {
         for (const [k, v] of Object.entries(fields)) {
             const i = this.cols.indexOf(k);
-            divs[i].textContent = v;
+            if (i >= 0) {
+                divs[i].textContent = v;
+            }
+        }
+        if (fields.elapsed_secs !== undefined) {
+            this._timing.set(seq, {
+                start: Date.now() - fields.elapsed_secs*1000,
+                div: divs[this.cols.indexOf('elapsed')]
+            });
+        } else if (fields.state && fields.state !== 'ACTIVE') {
+            this._timing.delete(seq);
         }
     }
 
-    addInst(inst: Inst) {
-        this.newRow();
-        this.setRow(this.numRows - 1, inst);
+    tickElapsed() {
+        const now = Date.now();
+        for (const {start, div} of this._timing.values()) {
+            const secs = Math.floor((now - start)/1000);
+            const mins = String(Math.floor(secs/60)).padStart(2, '0');
+            div.textContent = `${mins}:${String(secs % 60).padStart(2, '0')}`;
+        }
+    }
+
+    /**
+    Add a new event at the end of the list, unless it is filtered out.
+    */
+    addItem(item: Event) {
+        if (this.matches(item)) {
+            this._addItem(item, this.node);
+        }
+    }
+
+    private _addItem(item: Event, parent: ParentNode) {
+        if (item.tag === 'inst') {
+            const divs = this.newRow(item.seq!, item.row!, parent);
+            this._setCells(item.seq!, divs, item.data as Inst);
+        } else {
+            this.addSeparator(
+                this._eventSeps[item.tag] ?? 'unknown', item.data, parent);
+        }
     }
 
-    addSeparator(sepType: string, data?: any) {
+    addSeparator(sepType: string, data?: any, parent: ParentNode = this.node) {
         const div = document.createElement('div');
         div.textContent = this._sepText[sepType](data, div);
         div.className = `dboard-${sepType}-sep`;
-        this.node.append(div);
+        parent.append(div);
+    }
+
+    /**
+    Whether an event passes the filters (as the server checks them).
+    */
+    matches(item: Event) {
+        const f = this.filters;
+        // NB: new events are never older than the since filter
+        if (f.tag && !f.tag.includes(item.tag)) {
+            return false;
+        }
+        if (!(f.state || f.cond || f.profile || f.sid)) {
+            return true;
+        }
+        if (item.tag !== 'inst') {
+            return false;
+        }
+        const inst = item.data as Inst;
+        const profile = inst.profile.split(' ')[0];
+        const [cond, subjid] = profile.split('/');
+        // NB: only the start of the SID gets sent
+        return (!f.state || inst.state === f.state) &&
+            (!f.cond || cond === f.cond) &&
+            (!f.profile || f.profile === profile || f.profile === subjid) &&
+            (!f.sid || inst.sid.startsWith(f.sid.slice(0, inst.sid.length)));
     }
 
     clear() {
         this.node.replaceChildren();
-        this.numRows = 0;
+        this.oldestSeq = null;
+        this._timing.clear();
         //this.errors = [];
     }
 
-    update(items: Event[]) {
+    /**
+    Replace the list with a page of events.
+    */
+    update(items: Event[], more: boolean) {
         //console.log('items', items);
-        for (let i = 0; i < items.length; i++) {
-            const item = items[i];
-            if (item.tag === 'inst') {
-                //if (i === this.numRows) {
-                    this.newRow();
-                //}
-                this.setRow(this.numRows - 1, item.data as Inst);
-            } else {
-                const sepType = this._eventSeps[item.tag];
-                if (sepType) {
-                    this.addSeparator(sepType, item.data);
-                } else {
-                    this.addSeparator('unknown', 'UNKNOWN EVENT');
-                }
-            }
+        this.clear();
+        for (const item of items) {
+            this._addItem(item, this.node);
+        }
+        this._setOldest(items, more);
+    }
+
+    /**
+    Add a page of earlier events at the start of the list.
+    */
+    prepend(items: Event[], more: boolean) {
+        const frag = document.createDocumentFragment();
+        for (const item of items) {
+            this._addItem(item, frag);
+        }
+        // keep the rows in view where they are
+        const scroller = this.node.parentElement!;
+        const height = scroller.scrollHeight;
+        this.node.prepend(frag);
+        scroller.scrollTop += scroller.scrollHeight - height;
+        this._setOldest(items, more);
+    }
+
+    private _setOldest(items: Event[], more: boolean) {
+        if (items.length) {
+            this.oldestSeq = items[0].seq!;
         }
+        elt('load-earlier-btn')!.hidden = !more;
     }
 
 }
@@ -6,8 +6,6 @@ window.scrollTo(0, 0);
 
 const vars = document.getElementById('exp-vars')!.dataset as {[name: string]: string};
 
-const sid = vars.exp_sid;
-
 let task: Task;
 if ('task_script' in vars) {
     let jspath: string, taskScript = vars.task_script!;
@@ -31,5 +29,7 @@ if ('task_script' in vars) {
         }
     }(vars);
 }
-await task!.init(sid);
+// NB: all participants share a namespace; the server
+// tells them apart by their session
+await task!.init(vars.exp_api_ns!);
 await task!.reset();
@@ -0,0 +1,54 @@
+import argparse
+import sys
+import json
+
+from pathlib import Path
+
+from expert import rundb
+
+
+def bundle_cfg(bundle_path: Path):
+    with open(Path(__file__).parent / 'cfg.json') as f:
+        cfg = json.load(f)
+    bundle_cfg_path = bundle_path / 'cfg.json'
+    if bundle_cfg_path.is_file():
+        with open(bundle_cfg_path) as f:
+            cfg.update(json.load(f))
+    return cfg
+
+
+def convert(bundle_path: Path, fmt: str, runs: list[str]):
+    runs_path = bundle_path / bundle_cfg(bundle_path)['runs_dir']
+    if not runs_path.is_dir():
+        sys.exit(f'{runs_path} not found')
+    if not runs:
+        runs = sorted(p.name for p in runs_path.iterdir()
+                      if p.is_dir() and p.stem[0] != '.')
+    db = rundb.RunDB(runs_path / rundb.db_name)
+    for run in runs:
+        run_path = runs_path / run
+        if not run_path.is_dir():
+            sys.exit(f'{run_path} not found')
+        print(f'importing run \'{run}\'')
+        db.import_run(run_path, fmt)
+    db.close()
+
+
+def parse_args():
+    allargs = [
+        ['bundle_path', {'help': 'path to experiment bundle folder'}],
+        ['format', {'choices': ['csv', 'json'],
+                    'help': 'output format the runs were saved in'}],
+        ['runs', {'nargs': '*',
+                  'help': 'runs to import (default: all)'}]
+    ]
+    parser = argparse.ArgumentParser(
+        description='import saved runs into the sqlite output format')
+    for arg in allargs:
+        parser.add_argument(arg[0], **arg[1])
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    convert(Path(args.bundle_path).resolve(), args.format, args.runs)
@@ -13,6 +13,16 @@ from . import params
 from .trialtasks import RatingTask
 
 
+def read_stims(path):
+    """Read a stimulus list as a list of (sound, orthography) pairs."""
+    stims = []
+    with open(path) as f:
+        for line in f:
+            sound, orth = line.rstrip().split('  ')  # 2 spaces
+            stims.append((sound, orth))
+    return stims
+
+
 # Your experiment class must be a subclass of expert.experiment.Experiment,
 # but can have any name
 
@@ -66,12 +76,22 @@ class Amelio(Experiment):
                timeout_secs=-1)
          .then('thankyou', {'turk_code': self.turk_code}))
 
+    @classmethod
+    def _declare_assets(cls):
+        # Stimulus lists are read once when the bundle is loaded,
+        # and shared by all participants and profiles
+        distractors = read_stims(cls.dir_path / 'stims-D.txt')
+        # 'D' stims are the distractors, shared by conds A and B
+        for group in ['A', 'B']:
+            stims = read_stims(cls.dir_path / f'stims-{group}.txt')
+            cls.assets.add(f'stim_sounds-{group}',
+                           {orth: sound for sound, orth in stims + distractors})
+        cls.assets.add('training_sounds',
+                       read_stims(cls.dir_path / 'stims-training.txt'))
+
     def training_tasks(self):
-        sounds = []
-        with open(self.dir_path / 'stims-training.txt') as f:
-            for line in f:
-                sound, orth = line.rstrip().split('  ')  # 2 spaces
-                sounds.append((sound, orth))
+        # NB: Assets are frozen, so shuffle a copy
+        sounds = list(self.assets['training_sounds'])
         random.shuffle(sounds)
         tasks = [TaskDesc([RatingTask, sound, orth])
                  for sound, orth in sounds]
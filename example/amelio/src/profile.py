@@ -9,36 +9,34 @@
 
 import random
 
+import expert as e
 from expert import profile
 
 
 class Profile(profile.Profile):
 
-    def __init__(self, expercls, condition):
-        super().__init__(expercls, condition)
+    def __init__(self, condition):
+        super().__init__(condition)
         self.load_stim_sounds()
         self.stims = list(self.stim_sounds.keys())
         random.shuffle(self.stims)
 
     @classmethod
-    def load(cls, expercls, cond_str, subjid):
-        inst = super().load(expercls, cond_str, subjid)
-        with open(expercls.profiles_path / cond_str / subjid) as f:
+    def load(cls, cond_str, subjid):
+        inst = super().load(cond_str, subjid)
+        with open(e.experclass.profiles_path / cond_str / subjid) as f:
             inst.stims = [line.rstrip() for line in f]
             inst.load_stim_sounds()
         return inst
 
     def load_stim_sounds(self):
-        self.stim_sounds = {}
-        # 'D' stims are the distractors, shared by conds A and B
-        for fname in [self.cond.group.name, 'D']:
-            with open(self.expercls.dir_path / f'stims-{fname}.txt') as f:
-                for line in f:
-                    sound, orth = line.rstrip().split('  ')  # 2 spaces
-                    self.stim_sounds[orth] = sound
+        # Shared by all profiles in the condition (see
+        # Amelio._declare_assets()), so nothing is read here
+        self.stim_sounds = e.experclass.assets[
+            f'stim_sounds-{self.cond.group.name}']
 
     def save(self):
-        fname = self.expercls.profiles_path / str(self.cond) / self.subjid
+        fname = e.experclass.profiles_path / str(self.cond) / self.subjid
         with open(fname, 'w') as f:
             for s in self.stims:
                 print(s, file=f)
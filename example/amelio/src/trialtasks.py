@@ -15,9 +15,13 @@ class RatingTask(TrialTask):
 
     def __init__(
             self, inst, sound, orth, show_prompt=False, timeout_secs=None):
-        super().__init__(inst, timeout_secs=timeout_secs)
-        self.variables['sound'] = sound
-        self.variables['orth'] = orth
-        self.variables['show_prompt'] = show_prompt
+        # NB: Variables passed in here are shared by every participant
+        # who sees the same trial; setting them on the task afterwards
+        # gives the task a copy of its own
+        super().__init__(
+            inst,
+            variables={'sound': sound, 'orth': orth,
+                       'show_prompt': show_prompt},
+            timeout_secs=timeout_secs)
         # save the sound and orthography in the participant response
         self.resp_extra = f'{sound}:{orth}'
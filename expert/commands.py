@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import inspect
+import math
+import time
+
+from typing import Any, Callable, ClassVar, Optional, TypedDict, Union
+
+# The commands of an API that can be called over socket.io are its
+# methods marked with @command, which declares the shape of each
+# argument: a type, a tuple of types (any of which will do), or Any.
+# None stands for type(None). The table of commands is built once,
+# when the API class is defined, and each call is timed, so that
+# slow commands show up on the dashboard.
+
+Shape = Union[type, tuple[Optional[type], ...], None, Any]
+
+# Latencies are counted in buckets whose bounds grow geometrically,
+# four to a doubling, from 50 us up to about 200 s
+bucket_base = 50e-6
+buckets_per_doubling = 4
+num_buckets = 88
+
+
+class CommandError(Exception):
+    pass
+
+
+class UnknownCommandError(CommandError):
+    def __init__(self, cmd: str):
+        super().__init__(f'unknown command \'{cmd}\'')
+
+
+class BadArgumentsError(CommandError):
+    def __init__(self, cmd: str, msg: str):
+        super().__init__(f'{cmd}: {msg}')
+
+
+def command(*shapes: Shape):
+    """Mark an API method as callable, with the given argument shapes."""
+    def deco(func: Callable):
+        func.command_shapes = shapes  # type: ignore
+        return func
+    return deco
+
+
+def _type_name(shape: Shape):
+    if shape is None:
+        return 'null'
+    if isinstance(shape, tuple):
+        return ' or '.join(_type_name(s) for s in shape)
+    return getattr(shape, '__name__', str(shape))
+
+
+def _fits(value: Any, shape: Shape):
+    if shape is Any:
+        return True
+    if isinstance(shape, tuple):
+        return any(_fits(value, s) for s in shape)
+    if shape is None:
+        return value is None
+    # NB: JSON numbers may come through as either
+    if shape is float:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if shape is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, shape)
+
+
+class Command:
+
+    name: str
+    shapes: tuple[Shape, ...]
+    # arguments that must be given (the rest have defaults)
+    min_args: int
+
+    def __init__(self, name: str, func: Callable, shapes: tuple[Shape, ...]):
+        self.name = name
+        self.shapes = shapes
+        params = list(inspect.signature(func).parameters.values())[1:]
+        if len(params) != len(shapes):
+            raise TypeError(
+                f'command \'{name}\' has {len(params)} parameters' +
+                f' but {len(shapes)} shapes')
+        self.min_args = sum(
+            1 for p in params if p.default is inspect.Parameter.empty)
+
+    def check(self, args: tuple[Any, ...]):
+        if not self.min_args <= len(args) <= len(self.shapes):
+            expected = str(self.min_args) \
+                if self.min_args == len(self.shapes) \
+                else f'{self.min_args}-{len(self.shapes)}'
+            raise BadArgumentsError(
+                self.name, f'expected {expected} argument' +
+                ('' if expected == '1' else 's') + f', got {len(args)}')
+        for i, (arg, shape) in enumerate(zip(args, self.shapes)):
+            if not _fits(arg, shape):
+                raise BadArgumentsError(
+                    self.name, f'argument {i + 1} should be' +
+                    f' {_type_name(shape)}, not {type(arg).__name__}')
+
+
+class LatencySummary(TypedDict):
+    count: int
+    errors: int
+    # milliseconds
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+
+class Latencies:
+    """A histogram of the times taken by calls to a command."""
+
+    count: int
+    errors: int
+    max: float
+    _buckets: list[int]
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.max = 0
+        self._buckets = [0]*num_buckets
+
+    def record(self, secs: float, failed: bool = False):
+        i = 0 if secs <= bucket_base else \
+            math.ceil(buckets_per_doubling*math.log2(secs/bucket_base))
+        self._buckets[min(i, num_buckets - 1)] += 1
+        self.count += 1
+        if failed:
+            self.errors += 1
+        self.max = max(self.max, secs)
+
+    def percentile(self, pct: float) -> float:
+        """The upper bound (in seconds) of the bucket holding
+        the given percentile."""
+        if not self.count:
+            return 0
+        rank = math.ceil(self.count*pct/100)
+        seen = 0
+        for i, n in enumerate(self._buckets):
+            seen += n
+            if seen >= rank:
+                break
+        # (the last bucket has no upper bound)
+        return min(bucket_base*2**(i/buckets_per_doubling), self.max)
+
+    def summary(self) -> LatencySummary:
+        return {
+            'count': self.count, 'errors': self.errors,
+            'p50': self.percentile(50)*1000, 'p95': self.percentile(95)*1000,
+            'p99': self.percentile(99)*1000, 'max': self.max*1000
+        }
+
+
+class CommandTable:
+    """Base class of APIs called over socket.io."""
+
+    commands: ClassVar[dict[str, Command]] = {}
+    latencies: ClassVar[dict[str, Latencies]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        commands: dict[str, Command] = {}
+        for klass in reversed(cls.__mro__):
+            for name, attr in vars(klass).items():
+                shapes = getattr(attr, 'command_shapes', None)
+                if shapes is None and name in commands and callable(attr):
+                    # an unmarked override takes the shapes of
+                    # the command it overrides
+                    shapes = commands[name].shapes
+                if shapes is not None:
+                    # (raises TypeError if the override's
+                    # parameters don't fit the shapes)
+                    commands[name] = Command(name, attr, shapes)
+                elif name in commands:
+                    del commands[name]
+        cls.commands = commands
+        cls.latencies = {name: Latencies() for name in commands}
+
+    def call(self, cmd: str, args: tuple[Any, ...]) -> Any:
+        entry = self.commands.get(cmd)
+        if entry is None:
+            raise UnknownCommandError(cmd)
+        entry.check(args)
+        failed = True
+        start = time.perf_counter()
+        try:
+            val = getattr(self, cmd)(*args)
+            failed = False
+            return val
+        finally:
+            self.latencies[cmd].record(time.perf_counter() - start, failed)
+
+    @classmethod
+    def latency_summary(cls) -> dict[str, LatencySummary]:
+        """Latencies of the commands that have been called."""
+        return {name: lat.summary() for name, lat in cls.latencies.items()
+                if lat.count}
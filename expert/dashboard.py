@@ -2,21 +2,25 @@
 from __future__ import annotations
 
 import secrets
+import io
 import json
 import zipfile
 import shutil
 import importlib
-import time
 import traceback
 import weakref
 
 from pathlib import Path
-from typing import Any, Optional, TypedDict, cast
+from typing import Any, Callable, Iterator, Optional, TypedDict, cast
 
 from flask import send_file, request, make_response
 
 import expert as e
-from . import templates, experiment, view
+from . import (
+    templates, experiment, view, dlcache, manifest, eventlog, commands
+)
+from .commands import command
+from .eventlog import Event
 
 
 # def authn_check(fn):
@@ -27,31 +31,6 @@ from . import templates, experiment, view
 #             return e.ERR('authentication failed')
 
 
-class Event:
-
-    time: float
-    tag: str
-    data: Any
-
-    def __init__(self, tag: str, data: Any = None, ts: Optional[float] = None):
-        self.tag = tag
-        self.data = data
-        self.time = ts or time.monotonic()
-
-    def to_client(self):
-        d: dict[str, Any] = {'tag': self.tag}
-        if self.tag == 'inst':
-            d['data'] = e.srv.dboard.inst_full_status(self.data()) \
-                if self.data() else {
-                        'sid': '---', 'ip': '---',
-                        'profile': '---', 'state': '---',
-                        'task': '---', 'time': '---', 'elapsed': '---'
-                }
-        else:
-            d['data'] = self.data
-        return d
-
-
 class RunRec(TypedDict):
     id: str
     num_complete: int
@@ -67,6 +46,35 @@ class BundleFileChunk(TypedDict):
     data: bytes
 
 
+class ZipBuffer(io.RawIOBase):
+    """Unseekable output stream for a ZIP file being sent
+    as it is built."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self.size += len(b)
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return data
+
+
+# adds entries to a ZIP file, yielding whenever output may be ready
+ZipFiller = Callable[[zipfile.ZipFile], Iterator[None]]
+
+zip_chunk_size = 64*1024
+
+
 class APIBadArgumentError(Exception):
     def __init__(self, cmd: str, value: Any):
         super().__init__(f'{cmd}: bad argument value \'{value}\'')
@@ -82,53 +90,68 @@ class DashboardError(Exception):
         super().__init__(msg)
 
 
-class API:
+class API(commands.CommandTable):
 
     _dboard: 'Dashboard'
 
     def __init__(self, dboard: 'Dashboard'):
         self._dboard = dboard
 
-    def dboard_init(self):
-        list_items = [item.to_client()
-                      for item in self._dboard._events]
+    @command((dict, None))
+    def dboard_init(self, filters: Optional[eventlog.Filters] = None):
+        page = self.get_events(None, filters)
         return {
             'vars': self._dboard.all_vars(),
-            'list_items': list_items,
+            'list_items': page['items'],
+            'more_items': page['more'],
             'run_info': self._dboard._run_info()
         }
 
+    @command((int, None), (dict, None))
+    def get_events(self, before: Optional[int],
+                   filters: Optional[eventlog.Filters] = None):
+        """Get a page of events from before the given one."""
+        if filters:
+            unknown = [k for k in filters if k not in eventlog.filter_keys]
+            if unknown:
+                raise APIBadArgumentError('get_events', ', '.join(unknown))
+        events, more = self._dboard._events.page(
+            before, self._dboard.events_page_size, filters)
+        return {'items': [ev.to_client() for ev in events], 'more': more}
+
+    @command()
     def get_bundles(self) -> list[str]:
         return sorted(bundle.name for bundle in e.srv.bundles_path.iterdir()
                       if bundle.is_dir() and bundle.stem[0] != '.')
 
+    @command()
     def get_runs(self):
-        runs: list[RunRec] = []
+        # NB: Results and their manifest updates may still be queued
+        e.srv.writer.flush()
+        if e.experclass.rundb:
+            runs: list[RunRec] = e.experclass.rundb.runs()
+            return sorted(runs, key=lambda r: r['id'], reverse=True)
+        runs = []
         for run in e.experclass.runs_path.iterdir():
             if not run.is_dir() or run.stem[0] == '.':
                 continue
+            run_manifest = manifest.read(run)
+            num_complete = num_incomplete = 0
+            for counts in run_manifest['counts'].values():
+                for state, n in counts.items():
+                    if state == 'COMPLETE':
+                        num_complete += n
+                    else:
+                        num_incomplete += n
             runs.append({
                 'id': run.name,
-                'num_complete': 0,
-                'num_incomplete': 0,
-                'has_pii': False
+                'num_complete': num_complete,
+                'num_incomplete': num_incomplete,
+                'has_pii': run_manifest['has_pii']
             })
-            for cond in run.iterdir():
-                if cond.name == 'id-mapping' or \
-                   not cond.is_dir() or cond.stem[0] == '.':
-                    continue
-                for resp in cond.iterdir():
-                    if not resp.is_file() or resp.stem[0] == '.':
-                        continue
-                    if any(resp.name.endswith(sfx)
-                           for sfx in experiment.resp_file_suffixes.values()):
-                        runs[-1]['num_incomplete'] += 1
-                    else:
-                        runs[-1]['num_complete'] += 1
-            if (run / 'id-mapping').is_dir():
-                runs[-1]['has_pii'] = True
         return sorted(runs, key=lambda r: r['id'], reverse=True)
 
+    @command()
     def start_new_run(self):
         assert e.experclass
         try:
@@ -141,26 +164,67 @@ class API:
         templates.variables['exp_app_is_running'] = True
         return {'info': self._dboard._run_info()}
 
+    @command()
     def stop_run(self):
         self._dboard._events.append(Event('run_stop', e.experclass.run))
         self._dboard.stop_run()
 
+    @command()
+    def compact_responses(self):
+        # Only instances in tool mode are long-lived enough
+        # to be worth compacting before they end
+        if e.tool_mode and e.experclass:
+            e.log.info('compacting response journals')
+            e.experclass.compact_all()
+
     # @socketio.on('delete_results')
     # def sio_delete_results(runs):
     #     for run in runs:
     #         app.logger.info(f'deleting results for run {run}')
     #         shutil.rmtree(experclass.runs_path / run)
 
+    @command(str)
     def delete_id_mapping(self, run: str):
         if '..' in run:
             e.log.error(f'attempt to delete run \'{run}\'')
             raise APIBadArgumentError('delete_id_mapping', run)
         e.log.info(f'deleting id mapping for run \'{run}\'')
+        if e.experclass.rundb:
+            e.experclass.rundb.delete_pii(run)
+            return
         shutil.rmtree(e.experclass.runs_path / run / 'id-mapping')
 
+    @command()
+    def memory_usage(self):
+        if not e.experclass:
+            return None
+        return e.experclass.memory_usage()
+
+    @command()
+    def instance_counts(self):
+        if not e.experclass:
+            return None
+        return e.experclass.instances.snapshot()
+
+    @command()
+    def profile_pool(self):
+        if not e.experclass:
+            return None
+        return e.experclass.profiles.depths()
+
+    @command()
+    def api_latency(self):
+        """Call counts and latencies (in ms) of each API's commands."""
+        return {
+            'participant': e.experclass.api_class.latency_summary()
+                if e.experclass else {},
+            'dashboard': self.latency_summary()
+        }
+
     #def terminate_inst(self, sid):
     #    pass
 
+    @command(str, bool)
     def load_bundle(self, name: str, tool_mode: bool):
         if '..' in name:
             e.log.error(f'attempt to load bundle \'{name}\'')
@@ -181,6 +245,7 @@ class API:
         self._dboard.update_vars()
         return {'vars': self._dboard.all_vars()}
 
+    @command(bool)
     def reload_bundle(self, tool_mode: bool):
         e.log.info('*** reloading bundle ***')
         e.log.info(f'reloading in tool mode: {tool_mode}')
@@ -200,12 +265,14 @@ class API:
         # so it might be useful.
         return {'vars': self._dboard.all_vars()}
 
+    @command()
     def unload_bundle(self):
         e.log.info('*** unloading bundle ***')
         self._dboard._events.append(Event('bundle_unload', e.bundle_name))
         e.srv.unload_bundle()
         return {'vars': self._dboard.all_vars()}
 
+    @command()
     def rebuild_profiles(self):
         e.log.info('rebuilding profiles')
         try:
@@ -224,15 +291,18 @@ class API:
         self._dboard._events.append(Event('profiles_rebuild'))
         return {'vars': self._dboard.all_vars()}
 
+    @command(str, dict)
     def load_template(self, tplt: str, tplt_vars={}):
         return templates.render(tplt, tplt_vars)
     
+    @command(dict)
     def upload_bundle_chunk(self, chunk: BundleFileChunk):
         if '..' in chunk['name']:
             raise APIError('upload_bundle_chunk', 'filenames cannot contain ".."')
         self._dboard.store_bundle_file_chunk(chunk)
         #e.log.info(f'got chunk \'{chunk["name"]}-{chunk["idx"]}\'')
 
+    @command()
     def save_bundle_chunks(self):
         self._dboard.save_bundle_chunks()
 
@@ -242,11 +312,19 @@ class Dashboard(view.View):
     _path: str
     code: str
     _url: str
-    _events: list[Event]
+    _events: eventlog.EventLog
+    events_page_size: int
+    # instances with changes not sent yet
+    _dirty: dict[str, e.Experiment]
+    _flush_pending: bool
+    _update_window: float
     _bundle_file_chunks: dict[str, list[Optional[BundleFileChunk]]]
+    _dl_cache: dlcache.DownloadCache
 
     def __init__(self, srv):
         super().__init__(template='dashboard')
+        self._dl_cache = dlcache.DownloadCache(
+            srv.cfg['dl_cache_ttl_secs'], srv.cfg['dl_cache_max_mib']*1024*1024)
 
         cfg_code = srv.cfg.get('dashboard_code')
         self.code = cfg_code or secrets.token_urlsafe(16)
@@ -284,11 +362,21 @@ class Dashboard(view.View):
         self.variables['exp_favicon'] = srv.cfg['dashboard_favicon']
         self.variables['exp_upload_chunk_size_kib'] = srv.cfg['upload_chunk_size_kib']
         self.variables['exp_simultaneous_chunk_uploads'] = srv.cfg['simultaneous_chunk_uploads']
-        # XXX what about resuming?
-        self.variables['exp_completed_profiles'] = 0
         self.update_vars()
 
-        self._events = []
+        events_dir = srv.cfg['event_log_dir']
+        events_path = None
+        if events_dir:
+            events_path = Path(events_dir) if events_dir.startswith('/') \
+                else e.expert_path / events_dir
+        self._events = eventlog.EventLog(
+            srv.cfg['dboard_max_events'], events_path,
+            srv.cfg['event_log_segment_size'],
+            srv.cfg['event_log_max_segments'])
+        self.events_page_size = srv.cfg['dboard_events_page_size']
+        self._dirty = {}
+        self._flush_pending = False
+        self._update_window = srv.cfg['dboard_update_window_ms']/1000
         self._bundle_file_chunks = {}
 
     def update_vars(self):
@@ -299,6 +387,10 @@ class Dashboard(view.View):
     def all_vars(self):
         all_vars = templates.variables.copy()
         all_vars.update(self.variables)
+        # NB: Includes the profiles completed before a resume
+        all_vars['exp_completed_profiles'] = \
+            e.experclass.instances.count(experiment.State.COMPLETE) \
+            if e.experclass else 0
         return all_vars
 
     def _add_routes(self):
@@ -322,15 +414,17 @@ class Dashboard(view.View):
             #    return e.srv.not_found(), 404
             dl_name = f'exp_{e.bundle_name}_{subpath}_results'
             e.log.info(f'download request for {dl_name}.zip')
-            self._zip_results(subpath, dl_name)
-            return self._download(dl_name + '.zip')
+            return self._send_zip(
+                dl_name, lambda zf: self._zip_results(zf, subpath, dl_name),
+                self._run_sources(subpath))
 
         @e.app.route(f'{self._path}/download/profiles')
         def dashboard_dl_profiles():
             dl_name = f'exp_{e.bundle_name}_profiles'
             e.log.info(f'download request for {dl_name}.zip')
-            self._zip_profiles(dl_name)
-            return self._download(dl_name + '.zip')
+            return self._send_zip(
+                dl_name, lambda zf: self._zip_profiles(zf, dl_name),
+                [e.experclass.profiles_path])
 
         @e.app.route(f'{self._path}/download/id_mapping/<path:subpath>')
         def dashboard_dl_id_map(subpath):
@@ -338,8 +432,9 @@ class Dashboard(view.View):
             #    return e.srv.not_found(), 404
             dl_name = f'exp_{e.bundle_name}_{subpath}_id_map'
             e.log.info(f'download request for {dl_name}.zip')
-            self._zip_id_mapping(subpath, dl_name)
-            return self._download(dl_name + '.zip')
+            return self._send_zip(
+                dl_name, lambda zf: self._zip_id_mapping(zf, subpath, dl_name),
+                self._run_sources(subpath, 'id-mapping'))
 
         @e.app.route(f'{self._path}/download/log')
         def dashboard_dl_log():
@@ -351,8 +446,11 @@ class Dashboard(view.View):
         @srv.socketio.on('call_api', namespace=f'/{self.code}')
         def sio_call(cmd: str, *args):
             try:
-                f = getattr(self._api, cmd)
-                val = f(*args)
+                val = self._api.call(cmd, args)
+            except (commands.CommandError, APIBadArgumentError,
+                    APIError) as exc:
+                e.log.warning(f'dashboard API error: {exc}')
+                return {'err': str(exc)}
             except:
                 err = traceback.format_exc()
                 e.log.error(f'dashboard API \'{cmd}\' error: {err}')
@@ -436,72 +534,93 @@ class Dashboard(view.View):
         if active:
             for inst in active:
                 inst.terminate()
+        self.flush_updates()
+        # wait for the terminated instances' responses to be written
+        e.srv.writer.flush()
         e.experclass.stop()
         templates.variables['exp_app_is_running'] = False
 
-    def _zip_results(self, run_id: str, zip_name: str):
-        e.log.info('building zip file')
-        # run_path = expert.experclass.runs_path / run_id
+    def _zip_level(self):
+        """Compression level for downloads; 0 means store only."""
+        level = request.args.get('level', type=int)
+        if level is None or not 0 <= level <= 9:
+            level = e.srv.cfg['dl_compress_level']
+        return level
+
+    def _run_sources(self, run_id: str, subdir: Optional[str] = None):
+        """Paths a download of run data is built from."""
+        if e.experclass.rundb:
+            # NB: Any write to the database changes these, so all
+            # cached downloads of sqlite runs are invalidated at once
+            db_path = e.experclass.rundb.path
+            return [db_path, db_path.with_name(db_path.name + '-wal')]
+        run_path = e.experclass.runs_path / run_id
+        return [run_path / subdir if subdir else run_path]
+
+    def _send_zip(self, zip_name: str, fill: ZipFiller, sources: list[Path]):
+        """Send a ZIP file built from the files under sources.
+
+        The file is cached, and only rebuilt if those files change;
+        when it is built, it is streamed to the client while it is
+        being compressed.
+        """
+        level = self._zip_level()
+        # make sure any queued writes are on disk before fingerprinting
+        e.srv.writer.flush()
+        key = [str(level), e.experclass.results_format(),
+               dlcache.fingerprint(sources)]
+        return self._dl_cache.serve(
+            e.experclass.dls_path, zip_name, key,
+            lambda: self._zip_chunks(zip_name, fill, level))
+
+    def _zip_chunks(self, zip_name: str, fill: ZipFiller, level: int):
+        e.log.info(f'building {zip_name}.zip (level {level})')
+        buf = ZipBuffer()
+        try:
+            with zipfile.ZipFile(
+                    buf, 'w',
+                    compression=zipfile.ZIP_DEFLATED if level \
+                        else zipfile.ZIP_STORED,
+                    compresslevel=level or None) as zf:
+                for _ in fill(zf):
+                    if buf.size >= zip_chunk_size:
+                        yield buf.drain()
+        except:
+            # the client ends up with a truncated file
+            e.log.error(
+                f'error building {zip_name}.zip: {traceback.format_exc()}')
+            raise
+        yield buf.drain()
+
+    def _zip_results(self, zf: zipfile.ZipFile, run_id: str, zip_name: str):
         root = Path(zip_name).stem
         resps = e.experclass.collect_responses(run_id)
-        resps_ext = e.experclass.cfg['output_format']
-        resps_name = root + '.' + resps_ext
-        resps_path = e.experclass.dls_path / resps_name
-        e.experclass.write_responses(resps, resps_path)
-        with zipfile.ZipFile(e.experclass.dls_path / f'{zip_name}.zip', 'w',
-                             compression=zipfile.ZIP_DEFLATED,
-                             compresslevel=9) as zf:
-            zf.write(resps_path, resps_name)
-            # for cond in run_path.iterdir():
-            #     if cond.name == 'id-mapping' or not cond.is_dir():
-            #         continue
-            #     for respath in cond.iterdir():
-            #         if respath.stem[0] == '.':
-            #             continue
-            #         zf.write(
-            #             str(respath),
-            #             root + '/' + str(respath.relative_to(run_path)))
-
-    def _zip_profiles(self, zip_name: str):
-        e.log.info('building zip file')
-        with zipfile.ZipFile(e.experclass.dls_path / f'{zip_name}.zip', 'w',
-                             compression=zipfile.ZIP_DEFLATED,
-                             compresslevel=9) as zf:
-            for cond in e.experclass.profiles_path.iterdir():
-                if cond.stem[0] == '.' or not cond.is_dir():
-                    continue
-                for prof in cond.iterdir():
-                    if prof.stem[0] == '.' or not prof.is_file():
-                        continue
-                    zf.write(prof, f'{zip_name}/{cond.name}/{prof.name}')
-
-    def _zip_id_mapping(self, run_id: str, zip_name: str):
-        e.log.info('building zip file')
+        resps_name = root + '.' + e.experclass.results_format()
+        # NB: The size isn't known in advance, so allow for it
+        # to exceed the 2 GiB limit of plain ZIP entries
+        with zf.open(resps_name, 'w', force_zip64=True) as bf:
+            f = io.TextIOWrapper(bf, encoding='utf-8', newline='')
+            yield from e.experclass.stream_responses(resps, f)
+            f.flush()
+            f.detach()
+
+    def _zip_profiles(self, zf: zipfile.ZipFile, zip_name: str):
+        yield from e.experclass.profile_store.zip_profiles(zf, zip_name)
+
+    def _zip_id_mapping(self, zf: zipfile.ZipFile, run_id: str, zip_name: str):
         id_map_path = e.experclass.runs_path / run_id / 'id-mapping'
         root = Path(zip_name).stem
-        with zipfile.ZipFile(e.experclass.dls_path / f'{zip_name}.zip', 'w',
-                             compression=zipfile.ZIP_DEFLATED,
-                             compresslevel=9) as zf:
-            for fpath in id_map_path.iterdir():
-                if fpath.stem[0] == '.' or not fpath.is_file():
-                    continue
-                zf.write(str(fpath), root + '/' + fpath.name)
-
-    def _download(self, dl_name: str):
-        #if not dl_path.is_file():
-        return send_file(
-            e.experclass.dls_path / dl_name,
-            as_attachment=True, download_name=dl_name)
-
-    def _inst_index(self, inst: e.Experiment):
-        i = None
-        num_other = 0
-        for i, ev in enumerate(self._events):
-            if ev.tag != 'inst':
-                num_other += 1
-            # NB: deref weakref
-            elif ev.data() == inst:
-                return i - num_other
+        if e.experclass.rundb:
+            e.srv.writer.flush()
+            for sid, items in e.experclass.rundb.pii(run_id).items():
+                zf.writestr(root + '/' + sid, json.dumps(items, indent=2))
+                yield
+            return
+        for fpath in id_map_path.iterdir():
+            if fpath.stem[0] == '.' or not fpath.is_file():
+                continue
+            zf.write(str(fpath), root + '/' + fpath.name)
+            yield
 
     def inst_full_status(self, inst: e.Experiment):
         status = inst.status()
@@ -511,30 +630,82 @@ class Dashboard(view.View):
             'time': f'{mo}/{d}/{y} {h}:{mi}:{s}',
             'state': inst.state.name
         })
+        if inst.state == experiment.State.ACTIVE:
+            # the client keeps the elapsed time up to date from here
+            status['elapsed_secs'] = inst._elapsed_time()
         return status
 
+    def _row_fields(self, inst: e.Experiment):
+        """The fields of an instance's row the server keeps track of."""
+        fields = inst.status()
+        fields['state'] = inst.state.name
+        if inst.state == experiment.State.ACTIVE:
+            del fields['elapsed']
+        return fields
+
     def inst_created(self, inst: e.Experiment):
-        self._events.append(Event('inst', weakref.ref(inst), inst.start_time))
-        e.srv.socketio.emit('new_instance', self.inst_full_status(inst),
+        ev = Event('inst', weakref.ref(inst))
+        ev.sid = inst.sid
+        self._events.append(ev)
+        ev.sent = self._row_fields(inst)
+        e.srv.socketio.emit('new_instance', ev.to_client(),
                             namespace=f'/{self.code}')
 
     def inst_updated(self, inst: e.Experiment):
-        i = self._inst_index(inst)
-        status = inst.status()
-        status['state'] = inst.state.name
-        if inst.state == experiment.State.COMPLETE:
-            self.variables['exp_completed_profiles'] += 1
-        # NB: tuple for multiple args
-        e.srv.socketio.emit(
-            'update_instance', (i, status), namespace=f'/{self.code}')
-
-    def monitor_updated(self, insts):
-        e.srv.socketio.emit(
-            'update_active_instances',
-            [[self._inst_index(inst), inst.status()] for inst in insts],
-            namespace=f'/{self.code}')
+        """Queue an instance's changes to be sent to the client.
+
+        Changes are sent together, once per update window,
+        and only the fields that have changed are sent.
+        """
+        self._dirty[inst.sid] = inst
+        if self._update_window <= 0:
+            self.flush_updates()
+        elif not self._flush_pending:
+            self._flush_pending = True
+            e.srv.socketio.start_background_task(self._flush_later)
+
+    def _flush_later(self):
+        e.srv.socketio.sleep(self._update_window)
+        self._flush_pending = False
+        self.flush_updates()
+
+    def flush_updates(self):
+        # [[event seq, changed fields], ...]
+        changes: list[list[Any]] = []
+        for sid, inst in self._dirty.items():
+            ev = self._events.inst_event(sid)
+            # (it may have dropped out of the log)
+            if ev is None or ev.sent is None:
+                continue
+            fields = self._row_fields(inst)
+            delta = {k: v for k, v in fields.items() if ev.sent.get(k) != v}
+            if delta:
+                ev.sent.update(delta)
+                changes.append([ev.seq, delta])
+                # (task changes are too frequent to be worth keeping)
+                if 'state' in delta or 'profile' in delta:
+                    self._events.inst_updated(ev, delta)
+        self._dirty.clear()
+        if changes:
+            e.srv.socketio.emit(
+                'update_instances', changes, namespace=f'/{self.code}')
+
+    def inst_spilled(self, inst: e.Experiment):
+        if (ev := self._events.inst_event(inst.sid)):
+            ev.frozen = self.inst_full_status(inst)
+
+    def inst_rehydrated(self, inst: e.Experiment):
+        if (ev := self._events.inst_event(inst.sid)):
+            ev.data = weakref.ref(inst)
+            ev.frozen = None
+
+    def profiles_progress(self, made: int, total: int):
+        e.srv.socketio.emit('profiles_progress', (made, total),
+                            namespace=f'/{self.code}')
 
     def run_complete(self, run: str):
+        # the last instance to complete goes before the separator
+        self.flush_updates()
         self._events.append(Event('run_complete', run))
         e.srv.socketio.emit('run_complete',
                             namespace=f'/{self.code}')
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import heapq
+import time
+
+from typing import Any, Optional
+
+import expert as e
+
+# Deadlines are kept in a heap ordered by time. Rather than being
+# removed from the heap when they change, entries are invalidated:
+# each (sid, kind) key has a generation number, which is bumped
+# whenever its deadline is set, and entries with an old generation
+# are skipped when they reach the top.
+
+# (time, generation, sid, kind)
+Entry = tuple[float, int, str, str]
+
+
+class Deadlines:
+    """Times at which instances need attention, e.g., to time out."""
+
+    _heap: list[Entry]
+    # (sid, kind): generation of the live entry
+    _gens: dict[tuple[str, str], int]
+    _next_gen: int
+    # set to wake up wait() early
+    _wakeup: Any
+    _waiting_until: Optional[float]
+
+    def __init__(self):
+        self._heap = []
+        self._gens = {}
+        self._next_gen = 0
+        self._wakeup = None
+        self._waiting_until = None
+
+    def clear(self):
+        self._heap.clear()
+        self._gens.clear()
+
+    def set(self, sid: str, kind: str, when: Optional[float]):
+        """Set (or, if when is None, cancel) the deadline of a kind
+        for an instance, replacing any earlier one."""
+        key = (sid, kind)
+        if when is None:
+            self._gens.pop(key, None)
+            return
+        self._next_gen += 1
+        self._gens[key] = self._next_gen
+        heapq.heappush(self._heap, (when, self._next_gen, sid, kind))
+        # NB: Stale entries are only dropped as they come due, so they
+        # pile up if deadlines keep getting pushed back
+        if len(self._heap) > 2*len(self._gens) + 64:
+            self._heap = [ent for ent in self._heap if self._is_live(ent)]
+            heapq.heapify(self._heap)
+        if self._waiting_until is not None and when < self._waiting_until:
+            self._wakeup.set()
+
+    def discard(self, sid: str, kinds: tuple[str, ...] = ('timeout', 'lease')):
+        for kind in kinds:
+            self._gens.pop((sid, kind), None)
+
+    def _is_live(self, ent: Entry):
+        return self._gens.get((ent[2], ent[3])) == ent[1]
+
+    def next_time(self) -> Optional[float]:
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> list[tuple[str, str]]:
+        """Remove the deadlines that have passed, returning
+        their (sid, kind) keys."""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            ent = heapq.heappop(self._heap)
+            if self._is_live(ent):
+                del self._gens[(ent[2], ent[3])]
+                due.append((ent[2], ent[3]))
+        return due
+
+    def wait(self, until: float):
+        """Sleep until the given time, or until an earlier
+        deadline is set."""
+        if self._wakeup is None:
+            self._wakeup = e.srv.socketio.server.eio.create_event()
+        self._waiting_until = until
+        self._wakeup.wait(max(until - time.monotonic(), 0))
+        self._waiting_until = None
+        self._wakeup.clear()
+
+    def __len__(self):
+        return len(self._gens)
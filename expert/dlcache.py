@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from flask import Response, request, send_file
+
+import expert as e
+
+# Built download artifacts are kept in a bundle's dls folder,
+# named <download name>.<etag>.zip. The etag is a hash of whatever
+# determines the artifact's contents (including a fingerprint of
+# the files it was built from), so a changed run simply produces
+# a new artifact, and the old one ages out.
+
+
+def fingerprint(paths: list[Path]) -> str:
+    """Summarize the state of the files under the given paths
+    as their count plus the newest modification time."""
+    count = 0
+    newest = 0
+    def scan(path: str):
+        nonlocal count, newest
+        with os.scandir(path) as it:
+            for entry in it:
+                st = entry.stat()
+                newest = max(newest, st.st_mtime_ns)
+                if entry.is_dir():
+                    scan(entry.path)
+                else:
+                    count += 1
+    for path in paths:
+        if path.is_dir():
+            newest = max(newest, path.stat().st_mtime_ns)
+            scan(str(path))
+        elif path.is_file():
+            count += 1
+            newest = max(newest, path.stat().st_mtime_ns)
+    return f'{count}-{newest}'
+
+
+class DownloadCache:
+    """Download artifacts built once and served until they go stale.
+
+    Concurrent requests for an artifact that is still being built
+    wait for that build rather than starting their own.
+    """
+
+    ttl_secs: float
+    max_bytes: int
+    # artifact path: green event set when its build finishes
+    _building: dict[Path, Any]
+
+    def __init__(self, ttl_secs: float, max_bytes: int):
+        self.ttl_secs = ttl_secs
+        self.max_bytes = max_bytes
+        self._building = {}
+
+    def serve(self, dls_path: Path, name: str, key: list[str],
+              build: Callable[[], Iterator[bytes]]):
+        etag = hashlib.sha1('\0'.join([name] + key).encode()).hexdigest()[:20]
+        if etag in request.if_none_match:
+            resp = Response(status=304)
+            resp.set_etag(etag)
+            return resp
+        path = dls_path / f'{name}.{etag}.zip'
+        while (done := self._building.get(path)):
+            e.log.info(f'waiting for {path.name} to be built')
+            done.wait()
+        if path.is_file():
+            e.log.info(f'serving cached {path.name}')
+            # mark it as recently used
+            os.utime(path)
+            return send_file(path, as_attachment=True,
+                             download_name=f'{name}.zip', etag=etag)
+        # NB: If the build fails, waiting requests try again themselves
+        self._evict(dls_path)
+        done = self._building[path] = e.srv.socketio.server.eio.create_event()
+        tmp_path = path.with_name(f'.{path.name}.tmp')
+        # NB: The build doesn't need the request context
+        resp = Response(self._tee(build(), path, tmp_path),
+                        mimetype='application/zip')
+        resp.headers['Content-Disposition'] = f'attachment; filename={name}.zip'
+        resp.set_etag(etag)
+        # called even if the client goes away mid-download
+        resp.call_on_close(lambda: self._finish(path, tmp_path, done))
+        return resp
+
+    def _tee(self, chunks: Iterator[bytes], path: Path, tmp_path: Path):
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp_path, path)
+
+    def _finish(self, path: Path, tmp_path: Path, done: Any):
+        tmp_path.unlink(missing_ok=True)
+        del self._building[path]
+        done.set()
+
+    def _evict(self, dls_path: Path):
+        """Remove artifacts unused for longer than the TTL, then the
+        least recently used ones until the size limit is met."""
+        now = time.time()
+        artifacts: list[tuple[float, int, Path]] = []
+        for path in dls_path.glob('*.zip'):
+            if path in self._building:
+                continue
+            st = path.stat()
+            if now - st.st_mtime > self.ttl_secs:
+                e.log.info(f'removing expired download {path.name}')
+                path.unlink(missing_ok=True)
+            else:
+                artifacts.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in artifacts)
+        for _, size, path in sorted(artifacts):
+            if total <= self.max_bytes:
+                break
+            e.log.info(f'removing download {path.name} to free space')
+            path.unlink(missing_ok=True)
+            total -= size
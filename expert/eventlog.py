@@ -0,0 +1,418 @@
+from __future__ import annotations
+
+import bisect
+import itertools
+import json
+import time
+
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Iterator, Optional, TypedDict, Union
+
+import expert as e
+from . import writer
+
+# Events are kept in memory in a ring buffer of the newest ones.
+# If the log has a path, every event is also appended to a segment
+# file on disk, <first seq>.jsonl, with a JSON record per line.
+# A new segment is started once the current one holds segment_size
+# events, and the oldest segments are deleted once there are more
+# than max_segments. When a segment is finished, a small index,
+# <first seq>.idx, is written next to it, giving its range of
+# sequence numbers and times, and how many events of each tag
+# it holds. Changes to an instance's state or profile are appended
+# to <first seq>.upd.jsonl, for the segment holding the instance's
+# event, and applied when the segment is read.
+# On startup, only the indexes are read; segments are read
+# (a few at a time) as pages of older events are requested.
+# Writes go through the server's write queue.
+
+# Filters that only 'inst' events can match
+inst_filter_keys = ('state', 'cond', 'profile', 'sid')
+# 'since' is a time (in seconds since the epoch)
+filter_keys = ('tag', 'since') + inst_filter_keys
+
+# name: value; the tag filter may also be a list of tags
+Filters = dict[str, Union[str, float, list[str]]]
+
+seg_suffix = '.jsonl'
+upd_suffix = '.upd.jsonl'
+idx_suffix = '.idx'
+# segments kept in memory after being read
+seg_cache_size = 4
+
+
+class SegmentIndex(TypedDict):
+    first: int
+    last: int
+    # 'inst' events up to the end of the segment
+    num_insts: int
+    start_time: float
+    end_time: float
+    tags: dict[str, int]
+
+
+def _gone():
+    # stands in for the weakref of an 'inst' event read from disk
+    return None
+
+
+class Event:
+
+    time: float
+    tag: str
+    data: Any
+    # position in the log, assigned when added to it
+    seq: int = -1
+    # for 'inst' events, the instance's SID, its row number
+    # in the dashboard's list, the row fields last sent to the
+    # dashboard, and its status as of when it was spilled to disk
+    # (or when it was last saved, if read from disk)
+    sid: Optional[str] = None
+    row: Optional[int] = None
+    sent: Optional[dict[str, Any]] = None
+    frozen: Optional[dict[str, Any]] = None
+
+    def __init__(self, tag: str, data: Any = None, ts: Optional[float] = None):
+        self.tag = tag
+        self.data = data
+        self.time = ts or time.time()
+
+    def inst_summary(self) -> tuple[str, str]:
+        """The state and profile of an 'inst' event's instance."""
+        # NB: deref weakref
+        inst = self.data()
+        if inst:
+            return inst.state.name, str(inst.profile) if inst.profile else ''
+        frozen = self.frozen or {}
+        # (drop any ' (lapsed)')
+        return (frozen.get('state', ''),
+                frozen.get('profile', '').split(' ')[0])
+
+    def to_client(self):
+        d: dict[str, Any] = {'tag': self.tag, 'seq': self.seq}
+        if self.tag == 'inst':
+            d['row'] = self.row
+            d['data'] = e.srv.dboard.inst_full_status(self.data()) \
+                if self.data() else self.frozen or {
+                        'sid': '---', 'ip': '---',
+                        'profile': '---', 'state': '---',
+                        'task': '---', 'time': '---', 'elapsed': '---'
+                }
+        else:
+            d['data'] = self.data
+        return d
+
+    def to_record(self) -> dict[str, Any]:
+        rec: dict[str, Any] = {
+            'seq': self.seq, 'time': self.time, 'tag': self.tag}
+        if self.tag == 'inst':
+            status = dict(self.to_client()['data'])
+            # (it won't be active by the time anyone reads this)
+            status.pop('elapsed_secs', None)
+            rec.update({'sid': self.sid, 'row': self.row, 'status': status})
+        else:
+            rec['data'] = self.data
+        return rec
+
+    @classmethod
+    def from_record(cls, rec: dict[str, Any]):
+        if rec['tag'] == 'inst':
+            ev = cls('inst', _gone, rec['time'])
+            ev.sid = rec['sid']
+            ev.row = rec['row']
+            ev.frozen = rec['status']
+        else:
+            ev = cls(rec['tag'], rec['data'], rec['time'])
+        ev.seq = rec['seq']
+        return ev
+
+
+def _str_or_none(value: Any) -> Optional[str]:
+    return str(value) if value else None
+
+
+class _Filter:
+
+    # tags an event may have to match, if restricted
+    tags: Optional[list[str]]
+    since: Optional[float]
+    state: Optional[str]
+    cond: Optional[str]
+    profile: Optional[str]
+    sid: Optional[str]
+    inst_only: bool
+
+    def __init__(self, filters: Filters):
+        tags = filters.get('tag')
+        self.tags = [tags] if isinstance(tags, str) else tags or None
+        since = filters.get('since')
+        self.since = float(since) if since else None
+        self.state, self.cond, self.profile, self.sid = (
+            _str_or_none(filters.get(key)) for key in inst_filter_keys)
+        self.inst_only = bool(
+            self.state or self.cond or self.profile or self.sid)
+        if self.inst_only:
+            self.tags = ['inst'] if not self.tags or 'inst' in self.tags \
+                else []
+
+    def __call__(self, ev: Event):
+        if self.tags is not None and ev.tag not in self.tags:
+            return False
+        if not self.inst_only:
+            return True
+        assert ev.sid is not None
+        if self.sid and not ev.sid.startswith(self.sid):
+            return False
+        ev_state, ev_profile = ev.inst_summary()
+        ev_cond, _, subjid = ev_profile.partition('/')
+        return (not self.state or ev_state == self.state) and \
+            (not self.cond or ev_cond == self.cond) and \
+            (not self.profile or self.profile in (ev_profile, subjid))
+
+    def may_match(self, seg: SegmentIndex):
+        """Whether a segment may hold matching events."""
+        return self.tags is None or \
+            any(seg['tags'].get(tag) for tag in self.tags)
+
+
+class EventLog:
+    """The dashboard's events, numbered in the order they happened.
+
+    The newest events are kept in memory, and all of them,
+    if the log has a path, on disk. The dashboard gets them a page
+    at a time, from the newest events back, optionally filtered.
+    """
+
+    _events: deque[Event]
+    _next_seq: int
+    # sid: the latest 'inst' event for the SID still in memory
+    # (or whose instance is still active)
+    _inst_events: dict[str, Event]
+    # 'inst' events so far, including any dropped
+    num_insts: int
+    path: Optional[Path]
+    segment_size: int
+    max_segments: int
+    # indexes of the segments on disk, oldest first;
+    # the last is the one being written, if _open is set
+    _segments: list[SegmentIndex]
+    _open: Optional[SegmentIndex]
+    # first seq of segment: its events
+    _cache: OrderedDict[int, list[Event]]
+
+    def __init__(self, max_events: int, path: Optional[Path] = None,
+                 segment_size: int = 5000, max_segments: int = 50):
+        self._events = deque(maxlen=max_events)
+        self._next_seq = 0
+        self._inst_events = {}
+        self.num_insts = 0
+        self.path = path
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self._segments = []
+        self._open = None
+        self._cache = OrderedDict()
+        if path:
+            self._load_indexes()
+
+    def _seg_path(self, first: int, suffix: str = seg_suffix):
+        assert self.path is not None
+        return self.path / f'{first:010}{suffix}'
+
+    def _load_indexes(self):
+        assert self.path is not None
+        self.path.mkdir(parents=True, exist_ok=True)
+        firsts = sorted(int(p.name[:-len(seg_suffix)])
+                        for p in self.path.glob('*' + seg_suffix)
+                        if not p.name.endswith(upd_suffix))
+        for first in firsts:
+            idx_path = self._seg_path(first, idx_suffix)
+            if idx_path.is_file():
+                with open(idx_path) as f:
+                    self._segments.append(json.load(f))
+            # the segment being written when the server stopped
+            elif (seg := self._index_segment(first)):
+                self._segments.append(seg)
+                # NB: This happens as the server is being set up,
+                # before anything else is being written
+                with open(idx_path, 'w') as f:
+                    json.dump(seg, f)
+        if self._segments:
+            self._next_seq = self._segments[-1]['last'] + 1
+            self.num_insts = self._segments[-1]['num_insts']
+            e.log.info(f'found {len(self._segments)} event log segments;' +
+                       f' continuing from event {self._next_seq}')
+
+    def _index_segment(self, first: int) -> Optional[SegmentIndex]:
+        events = self._read_records(first)
+        if not events:
+            return None
+        tags: dict[str, int] = {}
+        num_insts = self._segments[-1]['num_insts'] if self._segments else 0
+        for ev in events:
+            tags[ev.tag] = tags.get(ev.tag, 0) + 1
+            if ev.row is not None:
+                num_insts = ev.row + 1
+        return {
+            'first': first, 'last': events[-1].seq, 'num_insts': num_insts,
+            'start_time': events[0].time, 'end_time': events[-1].time,
+            'tags': tags
+        }
+
+    def _read_records(self, first: int) -> list[Event]:
+        events: list[Event] = []
+        with open(self._seg_path(first)) as f:
+            for line in f:
+                try:
+                    events.append(Event.from_record(json.loads(line)))
+                except json.JSONDecodeError:
+                    # a partially-written final line, if the
+                    # server died in the middle of an append
+                    break
+        return events
+
+    def _read_segment(self, seg: SegmentIndex) -> list[Event]:
+        first = seg['first']
+        events = self._cache.get(first)
+        if events is not None:
+            self._cache.move_to_end(first)
+            return events
+        # anything queued for the segment must be on disk
+        e.srv.writer.flush()
+        events = self._read_records(first)
+        upd_path = self._seg_path(first, upd_suffix)
+        if upd_path.is_file():
+            with open(upd_path) as f:
+                for line in f:
+                    try:
+                        upd = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    i = upd['seq'] - first
+                    # (the event itself may have been cut off)
+                    if i < len(events) and events[i].frozen is not None:
+                        events[i].frozen.update(upd['fields'])
+        # (the open segment is still changing)
+        if seg is not self._open:
+            self._cache[first] = events
+            if len(self._cache) > seg_cache_size:
+                self._cache.popitem(last=False)
+        return events
+
+    def append(self, ev: Event) -> Event:
+        ev.seq = self._next_seq
+        self._next_seq += 1
+        if len(self._events) == self._events.maxlen:
+            old = self._events[0]
+            # NB: An active instance's event stays findable,
+            # so its changes still get saved, until its ending is sent
+            if old.sid is not None and \
+               self._inst_events.get(old.sid) is old and \
+               (old.sent or {}).get('state') != 'ACTIVE':
+                del self._inst_events[old.sid]
+        if ev.tag == 'inst':
+            assert ev.sid is not None
+            ev.row = self.num_insts
+            self.num_insts += 1
+            self._inst_events[ev.sid] = ev
+        self._events.append(ev)
+        if self.path:
+            self._save(ev)
+        return ev
+
+    def _save(self, ev: Event):
+        seg = self._open
+        if seg is None or seg['last'] - seg['first'] + 1 >= self.segment_size:
+            if seg is not None:
+                e.srv.writer.submit(writer.Replace(
+                    self._seg_path(seg['first'], idx_suffix), json.dumps(seg)))
+            seg = self._open = {
+                'first': ev.seq, 'last': ev.seq, 'num_insts': 0,
+                'start_time': ev.time, 'end_time': ev.time, 'tags': {}
+            }
+            self._segments.append(seg)
+            self._expire()
+        seg['last'] = ev.seq
+        seg['end_time'] = ev.time
+        seg['num_insts'] = self.num_insts
+        seg['tags'][ev.tag] = seg['tags'].get(ev.tag, 0) + 1
+        e.srv.writer.submit(writer.Append(
+            self._seg_path(seg['first']), json.dumps(ev.to_record()) + '\n'))
+
+    def _expire(self):
+        while len(self._segments) > self.max_segments:
+            first = self._segments.pop(0)['first']
+            self._cache.pop(first, None)
+            for suffix in (seg_suffix, upd_suffix, idx_suffix):
+                e.srv.writer.submit(
+                    writer.Delete(self._seg_path(first, suffix)))
+
+    def inst_updated(self, ev: Event, fields: dict[str, Any]):
+        """Record changes to an 'inst' event's status."""
+        assert ev.sid is not None
+        if fields.get('state', 'ACTIVE') != 'ACTIVE' and \
+           self._events and ev.seq < self._events[0].seq:
+            self._inst_events.pop(ev.sid, None)
+        if not self.path:
+            return
+        i = bisect.bisect_right(
+            [seg['first'] for seg in self._segments], ev.seq) - 1
+        # (its segment may have been deleted)
+        if i < 0:
+            return
+        first = self._segments[i]['first']
+        self._cache.pop(first, None)
+        e.srv.writer.submit(writer.Append(
+            self._seg_path(first, upd_suffix),
+            json.dumps({'seq': ev.seq, 'fields': fields}) + '\n'))
+
+    def inst_event(self, sid: str) -> Optional[Event]:
+        return self._inst_events.get(sid)
+
+    def _history(self, before: Optional[int],
+                 filt: Optional[_Filter]) -> Iterator[Event]:
+        """Iterate back through the events from before the one
+        numbered before (or from the newest)."""
+        if before is None:
+            before = self._next_seq
+        # NB: Events are numbered consecutively, so the ones
+        # to skip are counted from the newest
+        yield from itertools.islice(
+            reversed(self._events), max(self._next_seq - before, 0), None)
+        if self._events:
+            before = min(before, self._events[0].seq)
+        # then from disk, for events no longer in memory
+        for seg in reversed(self._segments):
+            if seg['first'] >= before:
+                continue
+            if filt and filt.since and seg['end_time'] < filt.since:
+                return
+            if filt and not filt.may_match(seg):
+                continue
+            events = self._read_segment(seg)
+            yield from reversed(events[:before - seg['first']])
+
+    def page(self, before: Optional[int] = None, limit: int = 100,
+             filters: Optional[Filters] = None) -> tuple[list[Event], bool]:
+        """Get up to limit events from before the one numbered before
+        (or the newest events), oldest first, and whether there
+        are more matching events before them."""
+        filt = _Filter(filters) if filters else None
+        found: list[Event] = []
+        for ev in self._history(before, filt):
+            if filt:
+                if filt.since and ev.time < filt.since:
+                    break
+                if not filt(ev):
+                    continue
+            if len(found) == limit:
+                return found[::-1], True
+            found.append(ev)
+        return found[::-1], False
+
+    def __len__(self):
+        return len(self._events)
+
+    def __iter__(self) -> Iterator[Event]:
+        return iter(self._events)
@@ -8,28 +8,43 @@ from flask import request
 
 import expert as e
 from .experiment import State, TaskResponse, API, BaseExper
+from .deadlines import Deadlines
+from .commands import command
 from . import tasks
 
 
 def _monitor():
     e.log.info('starting monitor task')
+    interval = e.srv.cfg['monitor_check_interval']
+    next_check = time.monotonic() + interval
     while True:
-        e.srv.socketio.sleep(e.srv.cfg['monitor_check_interval'])
-        if e.experclass:
-            insts = []
-            for inst in e.experclass.all_active():
-                if not (isinstance(inst, Exper) and inst.check_for_timeout()):
-                    insts.append(inst)
-            # Exper.end() sends separate updates if any inst has timed out
-            e.srv.dboard.monitor_updated(insts)
-        else:
+        # Timeouts and leases are handled as they come due;
+        # ended instances are spilled every check interval
+        next_deadline = Exper.deadlines.next_time()
+        Exper.deadlines.wait(next_check if next_deadline is None
+                             else min(next_deadline, next_check))
+        if not e.experclass:
             e.log.info('monitor task shutting down')
             Exper.monitor_task = None
             break
+        now = time.monotonic()
+        for sid, kind in Exper.deadlines.pop_due(now):
+            inst = e.experclass.instances.get(sid)
+            if not isinstance(inst, Exper) or inst.state != State.ACTIVE:
+                continue
+            if kind == 'timeout':
+                # Exper.end() sends an update if the inst has timed out
+                inst.check_for_timeout()
+            else:
+                inst.check_lease()
+        if now >= next_check:
+            next_check = now + interval
+            e.experclass.spill_ended()
 
 
 class ExperAPI(API):
 
+    @command()
     def return_survey(self):
         self._inst.return_survey()
 
@@ -38,11 +53,14 @@ class Exper(BaseExper):
 
     api_class: ClassVar[Type[API]] = ExperAPI
     monitor_task: ClassVar[Any] = None
+    deadlines: ClassVar[Deadlines] = Deadlines()
 
     # Will be True when all profiles have completed the experiment.
     complete: ClassVar[bool] = False
 
     global_timeout_time: Optional[float]
+    # when the profile goes back to the pool unless renewed
+    lease_expiry_time: Optional[float]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -72,6 +90,8 @@ class Exper(BaseExper):
         self.inact_timeout_time = \
             self.start_time + self.cfg['inact_timeout_secs']
         self.global_timeout_time = None
+        self.lease_expiry_time = None
+        self.deadlines.set(self.sid, 'timeout', self.inact_timeout_time)
 
     @classmethod
     def _setup(cls, is_reloading):
@@ -99,6 +119,11 @@ class Exper(BaseExper):
     #     cls.record.save()
     #     cls.running = True
 
+    @classmethod
+    def clear_instances(cls):
+        super().clear_instances()
+        cls.deadlines.clear()
+
     @classmethod
     def dummy_run(cls, inst_count: int):
         ip = '127.0.0.1'
@@ -109,8 +134,7 @@ class Exper(BaseExper):
 
     @classmethod
     def check_for_run_complete(cls):
-        if not cls.profiles and \
-           not any(i.state == State.ACTIVE for i in cls.instances.values()):
+        if not cls.profiles and not cls.instances.count(State.ACTIVE):
             e.log.info('--- run complete ---')
             cls.running = False
             e.srv.dboard.run_complete(cls.run)
@@ -145,43 +169,82 @@ class Exper(BaseExper):
                 self.global_timeout_time = None
         self.inact_timeout_time = \
             now + self.cfg['inact_timeout_secs']
+        self.deadlines.set(self.sid, 'timeout', self._timeout_time())
+
+    def _timeout_time(self):
+        if self.global_timeout_time:
+            return min(self.inact_timeout_time, self.global_timeout_time)
+        return self.inact_timeout_time
 
     def check_for_timeout(self):
         if self.state != State.ACTIVE:
             return False
-        if self.global_timeout_time:
-            tout_time = min(self.inact_timeout_time,
-                            self.global_timeout_time)
-        else:
-            tout_time = self.inact_timeout_time
+        tout_time = self._timeout_time()
         if tout_time and time.monotonic() >= tout_time:
             e.log.info(f'sid {self.sid[:4]} timed out')
             self.task.replace_next_task(tasks.TimedOut(self))
             self.end(State.TIMED_OUT)
-            if self.profile:
-                self.profiles.insert(0, self.profile)
             return True
         return False
 
+    def end(self, state: State):
+        self.deadlines.discard(self.sid)
+        super().end(state)
+
     def return_survey(self):
         e.log.info(f'sid {self.sid[:4]} returned their survey')
         self.task = tasks.ReturnedSurvey(self)
         self.end(State.RETURNED)
-        if self.profile:
-            self.profiles.insert(0, self.profile)
 
     def assign_profile(self):
         # It's possible to time out on the consent page,
         # and we don't want to assign a profile if that happens
         if self.state == State.ACTIVE:
             super().assign_profile()
+            self._renew_lease()
+
+    def _renew_lease(self):
+        if self.cfg['profile_lease_secs']:
+            self.lease_expiry_time = \
+                time.monotonic() + self.cfg['profile_lease_secs']
+            self.deadlines.set(self.sid, 'lease', self.lease_expiry_time)
+
+    def check_lease(self):
+        if self.profile and not self.lease_lapsed and \
+           self.lease_expiry_time and \
+           time.monotonic() >= self.lease_expiry_time:
+            e.log.info(f'sid {self.sid[:4]} lease on profile' +
+                       f' {self.profile} lapsed')
+            self.lease_lapsed = True
+            self.profiles.release(self.profile)
+            e.srv.dboard.inst_updated(self)
+
+    def _will_call_api(self):
+        if self.state != State.ACTIVE or not self.profile:
+            return True
+        if self.lease_lapsed:
+            if self.profiles.reclaim(self.profile):
+                e.log.info(f'sid {self.sid[:4]} reclaimed profile' +
+                           f' {self.profile}')
+                self.lease_lapsed = False
+                e.srv.dboard.inst_updated(self)
+            else:
+                # The profile has gone to someone else in the meantime
+                e.log.info(f'sid {self.sid[:4]} lost profile' +
+                           f' {self.profile}')
+                self.task = tasks.TimedOut(self)
+                self.end(State.TIMED_OUT)
+                self._update_vars()
+                return False
+        self._renew_lease()
+        return True
 
     def next_task(self, resp):
         self._store_resp(resp)
         e.log.info(
             f'sid {self.sid[:4]} completed "{self.task.template_name}"' +
             f' ({self.task.id})')
-        self.task = self.task.next_task(resp)
+        self.task = tasks.reached(self.task.next_task(resp))
         self.task_cursor = self.task.id
         if isinstance(self.task, tasks.NonConsent):
             self.end(State.CONSENT_DECLINED)
@@ -1,28 +1,39 @@
 
 from __future__ import annotations
 
+import os
 import random
 import sys
 import traceback
 import time
 import importlib
 import importlib.util
+import multiprocessing
 import csv
+import io
 import json
+import pickle
 import secrets
 
 from pathlib import Path
 from enum import Enum
-from functools import reduce
-from typing import ClassVar, Optional, Any, Type, Union, cast, Literal
+from collections import OrderedDict
+from concurrent import futures
+from functools import reduce, partial
+from typing import (
+    ClassVar, Optional, Any, Type, Union, cast, Literal, IO,
+    Callable, Iterator
+)
 
 from flask import session
 from werkzeug.datastructures import MultiDict
 
 import expert as e
 from . import (
-    tasks, timestamp, profile, templates
+    tasks, timestamp, profile, profilestore, templates, journal, writer, rundb,
+    manifest, sizeof, commands
 )
+from .commands import command
 
 import strictyaml
 
@@ -44,6 +55,11 @@ resp_file_suffixes = {
     State.RETURNED: '-returned'
 }
 
+# subdirectories of a run directory that don't hold condition results
+special_run_dirs = ['id-mapping', 'journal']
+
+output_formats = ['csv', 'json', 'sqlite']
+
 
 class TaskResponse:
     response: Any
@@ -69,6 +85,114 @@ class TaskResponse:
         self.extra = extra
 
 
+# yields the responses of a single subject
+ResponseSource = Callable[[], Iterator[TaskResponse]]
+
+
+class ResponseSet:
+    """The responses of a run, in export order.
+
+    The extra field names and SID prefix length are known up front,
+    so the responses can be written as they are read.
+    """
+
+    extras: list[str]
+    sid_len: int
+    _sources: list[ResponseSource]
+
+    def __init__(self, sids: list[str], extras: list[str],
+                 sources: list[ResponseSource]):
+        self.extras = extras
+        self.sid_len = min_unique_prefix(sids)
+        self._sources = sources
+
+    def __iter__(self):
+        for source in self._sources:
+            yield from source()
+
+
+def min_unique_prefix(sids: list[str], min_len: int = 4):
+    """Length of the shortest prefix that distinguishes all the SIDs,
+    or 0 if there are none."""
+    if not sids:
+        return 0
+    sids = sorted(set(sids))
+    uniq_len = min_len
+    # only adjacent SIDs in sorted order need comparing
+    for a, b in zip(sids, sids[1:]):
+        common = len(os.path.commonprefix([a, b]))
+        uniq_len = max(uniq_len, common + 1)
+    return uniq_len
+
+
+def _first_json_item(path: Path) -> dict[str, Any]:
+    """Parse only the first item of a file holding a JSON list."""
+    decoder = json.JSONDecoder()
+    buf = ''
+    with open(path) as f:
+        while chunk := f.read(4096):
+            buf += chunk
+            start = buf.find('{')
+            if start < 0:
+                continue
+            try:
+                return decoder.raw_decode(buf, start)[0]
+            except json.JSONDecodeError:
+                continue
+    raise json.JSONDecodeError('no items', buf, 0)
+
+
+class _SpillPickler(pickle.Pickler):
+    """Pickles the state of an ended instance.
+
+    The instance itself and its tasks are stored as references,
+    and only the tasks the participant can still reach are kept;
+    the rest of the task tree is dropped.
+    """
+
+    def __init__(self, f: IO[bytes], inst: BaseExper,
+                 kept: list[tasks.TaskNode]):
+        super().__init__(f, pickle.HIGHEST_PROTOCOL)
+        self._inst = inst
+        self._kept = {id(task): i for i, task in enumerate(kept)}
+
+    def persistent_id(self, obj: Any):
+        if obj is self._inst:
+            return 'inst'
+        elif isinstance(obj, tasks.TaskNode):
+            return ('task', self._kept.get(id(obj)))
+        elif isinstance(obj, API):
+            return 'api'
+        # assets are shared, so they aren't copied into the spill file
+        asset = self._inst.assets.name_of(obj)
+        if asset is not None:
+            return ('asset', asset)
+        return None
+
+
+class _SpillUnpickler(pickle.Unpickler):
+
+    def __init__(self, f: IO[bytes], inst: BaseExper,
+                 kept: list[tasks.TaskNode]):
+        super().__init__(f)
+        self._inst = inst
+        self._kept = kept
+
+    def persistent_load(self, pid: Any):
+        if pid == 'inst':
+            return self._inst
+        elif pid == 'api':
+            return self._inst._api
+        elif pid[0] == 'asset':
+            return self._inst.assets[pid[1]]
+        _, i = pid
+        return None if i is None else self._kept[i]
+
+
+# number of profiles made at a time by a worker process
+profile_batch_size = 1000
+
+
 class NoSuchCondError(Exception):
     def __init__(self, condname: str):
         super().__init__(f'no such condition(s) "{condname}"')
@@ -79,17 +203,151 @@ class BadOutputFormatError(Exception):
         super().__init__(f'unknown output format "{fmt}"')
 
 
-class API:
+class BadProfileFormatError(Exception):
+    def __init__(self, fmt: str):
+        super().__init__(f'unknown profile format "{fmt}"')
+
+
+class UnserializableProfileError(Exception):
+    def __init__(self, fmt: str):
+        super().__init__(
+            f'profile format "{fmt}" requires Profile to implement'
+            ' save_data() and load_data()')
+
+
+class InstanceRegistry:
+    """The instances of the current run, indexed by state.
+
+    Besides the instances in memory, this keeps the final states
+    of ended instances spilled to disk, and counts how many
+    instances of the run are in each state, so run accounting
+    never has to go through every instance.
+    """
+
+    # sid: inst, for instances in memory
+    _insts: dict[str, BaseExper]
+    # state: {sid: inst}
+    _by_state: dict[State, dict[str, BaseExper]]
+    # sid: final state of ended instances spilled to disk
+    _spilled: dict[str, State]
+    _num_spilled: dict[State, int]
+    # state: number of instances in the run, whether in memory,
+    # spilled, or ended before the run was resumed
+    _counts: dict[State, int]
+    # sid: IDs of the sockets connected for the instance
+    _sockets: dict[str, set[str]]
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._insts = {}
+        self._by_state = {state: {} for state in State}
+        self._spilled = {}
+        self._num_spilled = dict.fromkeys(State, 0)
+        self._counts = dict.fromkeys(State, 0)
+        self._sockets = {}
+
+    def add(self, inst: BaseExper):
+        self._insts[inst.sid] = inst
+        self._by_state[inst.state][inst.sid] = inst
+        self._counts[inst.state] += 1
+
+    def state_changed(self, inst: BaseExper, old: State):
+        # NB: Dummy instances are never added
+        if inst.state == old or inst.sid not in self._insts:
+            return
+        del self._by_state[old][inst.sid]
+        self._by_state[inst.state][inst.sid] = inst
+        self._counts[old] -= 1
+        self._counts[inst.state] += 1
+
+    def seed(self, state: State, count: int):
+        """Count instances that ended before the run was resumed."""
+        self._counts[state] += count
+
+    def spill(self, sid: str):
+        inst = self._insts.pop(sid)
+        del self._by_state[inst.state][sid]
+        self._spilled[sid] = inst.state
+        self._num_spilled[inst.state] += 1
+
+    def restore(self, inst: BaseExper):
+        """Take back a spilled instance that has been reloaded."""
+        state = self._spilled.pop(inst.sid)
+        self._num_spilled[state] -= 1
+        self._insts[inst.sid] = inst
+        self._by_state[inst.state][inst.sid] = inst
+
+    def socket_connected(self, sid: str, sock: str):
+        self._sockets.setdefault(sid, set()).add(sock)
+
+    def socket_disconnected(self, sid: str, sock: str):
+        if (socks := self._sockets.get(sid)) is not None:
+            socks.discard(sock)
+            if not socks:
+                del self._sockets[sid]
+
+    def num_sockets(self, sid: str):
+        return len(self._sockets.get(sid, ()))
+
+    def num_connected(self):
+        """The number of instances with a socket connected."""
+        return len(self._sockets)
+
+    def is_spilled(self, sid: str):
+        return sid in self._spilled
+
+    def get(self, sid: str) -> Optional[BaseExper]:
+        return self._insts.get(sid)
+
+    def __getitem__(self, sid: str) -> BaseExper:
+        return self._insts[sid]
+
+    def __contains__(self, sid: str):
+        return sid in self._insts
+
+    def __len__(self):
+        return len(self._insts)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._insts)
+
+    def values(self):
+        return self._insts.values()
+
+    def in_state(self, state: State) -> list[BaseExper]:
+        """The instances in memory in the given state."""
+        return list(self._by_state[state].values())
+
+    def active(self) -> list[BaseExper]:
+        return self.in_state(State.ACTIVE)
+
+    def count(self, state: State) -> int:
+        return self._counts[state]
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        """Counts of the run's instances, by state."""
+        return {state.name: {'total': self._counts[state],
+                             'in_memory': len(self._by_state[state]),
+                             'spilled': self._num_spilled[state]}
+                for state in State}
+
+
+class API(commands.CommandTable):
 
     def __init__(self, inst: e.Experiment):
         self._inst = inst
 
+    @command(str)
     def soundcheck(self, resp: str) -> bool:
         return resp.strip().lower() == e.soundcheck_word
 
+    @command()
     def init_task(self):
         return self._inst.all_vars()
 
+    @command(Any)
     def next_page(self, resp: Any):
         if self._inst.task.next_tasks or \
            isinstance(self._inst.task, tasks.Consent):
@@ -100,9 +358,11 @@ class API:
             self._inst.next_task(resp)
         return self._inst.all_vars()
 
+    @command(Any)
     def get_feedback(self, resp: Any):
         return self._inst.task.get_feedback(resp)
 
+    @command(str, dict)
     def load_template(self, tplt: str, tplt_vars: dict[str, Any] = {}):
         return templates.render(tplt, tplt_vars)
 
@@ -117,19 +377,27 @@ class BaseExper:
     runs_path: ClassVar[Path]
     templates_path: ClassVar[Path]
     dls_path: ClassVar[Path]
-    _cond_paths: ClassVar[list[Path]]
+    profile_store: ClassVar[profilestore.ProfileStore]
     mode: ClassVar[Optional[ExperMode]] = None  # set on subclass
     target: ClassVar[Optional[str]] = None      # set on subclass
     run: ClassVar[Optional[str]] = None         # set on subclass
     record: ClassVar[Optional[Record]] = None   # set on subclass
     replicate: ClassVar[Optional[Record]]
     name: ClassVar[str]
-    profiles: ClassVar[list[profile.Profile]] = [] # mutated by subclass
+    profiles: ClassVar[profile.ProfilePool] = profile.ProfilePool() # mutated by subclass
+    assets: ClassVar[profile.AssetRegistry] = profile.AssetRegistry()
     num_profiles: ClassVar[int]                 # set on subclass
-    # sid: <Experiment subclass inst>
-    instances: ClassVar[dict[str, BaseExper]] = {} # mutated by subclass
+    instances: ClassVar[InstanceRegistry] = InstanceRegistry()
     running: ClassVar[bool]
     api_class: ClassVar[Type[API]] = API
+    # only set with the 'sqlite' output format
+    rundb: ClassVar[Optional[rundb.RunDB]] = None
+    spill_path: ClassVar[Path]
+    # Ended instances still in memory, least recently used first
+    # (sid: time of last use)
+    _ended: ClassVar[OrderedDict[str, float]] = OrderedDict()
+    # ended instances that couldn't be pickled, and so stay in memory
+    _unspillable: ClassVar[set[str]] = set()
 
     ## instance vars
     sid: str
@@ -139,10 +407,11 @@ class BaseExper:
     start_timestamp: str
     end_time: float
     task: tasks.Task
-    last_task: Optional[tasks.Task]
-    tasks_by_id: dict[int, tasks.Task]
+    last_task: Optional[tasks.TaskNode]
+    tasks_by_id: dict[int, tasks.TaskNode]
     state: State
     responses: dict[int, TaskResponse]
+    journal: Optional[journal.Journal]
     variables: dict[str, Any]
 
     def __init__(self, clientip: str, urlargs: MultiDict[str, str], sid: str):
@@ -162,6 +431,8 @@ class BaseExper:
         # (not necessarily the number the participant will complete)
         self.num_tasks_created = 0
         self.tasks_by_id = {}
+        # ID for the next task created, if it replaces a stub
+        self._reify_id = None
         #self.num_tasks_completed = 0
         self.task_cursor = 1
         # gets set to True if a Consent task is created
@@ -174,6 +445,11 @@ class BaseExper:
         self.pseudo_responses = [
             TaskResponse(self.sid, 'SID'),
         ]
+        # created once a profile is assigned
+        self.journal = None
+        # set if the profile has been returned to the pool
+        # because the participant went quiet
+        self.lease_lapsed = False
 
         self.clientip = clientip
         self.prolific_pid = None
@@ -188,21 +464,26 @@ class BaseExper:
 
         self._api = self.api_class(self)
 
-        @e.srv.socketio.on('call_api', namespace=f'/{self.sid}')
-        def sio_call(cmd: str, *args:list[Any]):
-            try:
-                f = getattr(self._api, cmd)
-                val = f(*args)
-            except:
-                tback = traceback.format_exc()
-                e.log.error(f'SID {self.sid[:4]} API \'{cmd}\' error: {tback}')
-                e.srv.dboard.api_error(tback)
-                return {'err': tback}
-            return {'val': val}
-
-        @e.srv.socketio.on_error(f'/{self.sid}')
-        def sio_inst_error(err):
-            e.log.error(f'socketio error:\n{traceback.format_exc()}')
+    def call_api(self, cmd: str, *args: Any):
+        try:
+            if not self._will_call_api():
+                # the instance has just ended; the client
+                # gets sent on to its final task
+                return {'val': self.all_vars()}
+            val = self._api.call(cmd, args)
+        except commands.CommandError as exc:
+            e.log.warning(f'SID {self.sid[:4]} API error: {exc}')
+            return {'err': str(exc)}
+        except:
+            tback = traceback.format_exc()
+            e.log.error(f'SID {self.sid[:4]} API \'{cmd}\' error: {tback}')
+            e.srv.dboard.api_error(tback)
+            return {'err': tback}
+        return {'val': val}
+
+    def _will_call_api(self) -> bool:
+        """Returns False if the call should not go ahead."""
+        return True
 
     @classmethod
     def init(cls, path: Path, is_reloading: bool):
@@ -216,8 +497,28 @@ class BaseExper:
         cls.runs_path.mkdir(exist_ok=True)
         cls.profiles_path.mkdir(exist_ok=True)
         cls.dls_path.mkdir(exist_ok=True)
+        cls.spill_path.mkdir(exist_ok=True)
+        if cls.cfg['output_format'] not in output_formats:
+            raise BadOutputFormatError(cls.cfg['output_format'])
+        if cls.cfg['profile_format'] not in profilestore.profile_formats:
+            raise BadProfileFormatError(cls.cfg['profile_format'])
+        # NB: Otherwise, every profile would be packed as empty data
+        if cls.cfg['profile_format'] == 'packed':
+            prof_class = cls.profile_mod().Profile
+            if prof_class.save_data is profile.Profile.save_data or \
+               prof_class.load_data is profile.Profile.load_data:
+                raise UnserializableProfileError(cls.cfg['profile_format'])
+        cls.profile_store = profilestore.open_store(
+            cls.profiles_path, cls.cfg['profile_format'])
+        if cls.rundb:
+            cls.rundb.close()
+        if cls.cfg['output_format'] == 'sqlite':
+            cls.rundb = rundb.RunDB(cls.runs_path / rundb.db_name)
+        else:
+            cls.rundb = None
 
-        cls._cond_paths = cls._read_cond_paths()
+        cls.assets = profile.AssetRegistry()
+        cls._declare_assets()
         conds = cls.cond_mod().conds
         e.log.info('conditions: ' + ', '.join([f"'{k}'" for k in conds.keys()]))
         cls.cond_size = round(cls.params_mod().n_profiles/len(conds))
@@ -228,9 +529,8 @@ class BaseExper:
         cls.num_profiles = len(conds)*cls.cond_size
         e.log.info(f'profiles per condition: {cls.cond_size}')
         e.log.info(f'total profiles: {cls.num_profiles}')
-        if not cls._cond_paths:
+        if not cls.profile_store.conds():
             cls.make_profiles()
-            cls._cond_paths = cls._read_cond_paths()
         else:
             e.log.info('found existing profiles; not creating')
         cls.running = False
@@ -239,7 +539,7 @@ class BaseExper:
     @classmethod
     def start(cls, mode: ExperMode, obj: Optional[str] = None, 
               conds: Optional[list[str]] = None):
-        cls.instances.clear()
+        cls.clear_instances()
         if conds:
             unknown_conds = [c for c in conds
                              if c not in cls.cond_mod().conds]
@@ -289,6 +589,14 @@ class BaseExper:
         """Overridden by bundle class"""
         pass
 
+    @classmethod
+    def _declare_assets(cls):
+        """Overridden by bundle class to add to cls.assets
+
+        NB: This runs before any profiles are created.
+        """
+        pass
+
     @classmethod
     def _setup_paths(cls):
         e.log.info(f'bundle path: {cls.dir_path}')
@@ -297,63 +605,119 @@ class BaseExper:
         cls.runs_path = cls.dir_path / cls.cfg['runs_dir']
         cls.templates_path = cls.dir_path / cls.cfg['templates_dir']
         cls.dls_path = cls.dir_path / cls.cfg['dls_dir']
-
-    @classmethod
-    def _read_cond_paths(cls):
-        return [p for p in cls.profiles_path.iterdir()
-                if p.is_dir() and p.stem[0] != '.']
+        cls.spill_path = cls.dir_path / cls.cfg['spill_dir']
 
     @classmethod
     def _load_profiles(cls):
+        """Index the profiles available for the run.
+
+        Profiles are only loaded once they are assigned; here,
+        each condition just takes one listing of its profiles
+        and one of its results.
+        """
         if cls.replicate:
-            rep_profs = cls.replicate.completed_profiles()
+            rep_index: Optional[dict[str, set[str]]] = \
+                cls.replicate.completion_index()
         else:
-            rep_profs = None
+            rep_index = None
 
-        e.log.info('loading profiles')
+        e.log.info('indexing profiles')
         cls.profiles.clear()
+        if cls.profile_store.virtual:
+            cls.profiles.loader = profile.regenerate
+        else:
+            cls.profiles.loader = cls.profile_mod().Profile.load
         assert cls.record is not None
-        for cond_path in cls._cond_paths:
-            condname = cond_path.name
+        have_results = cls.record.completion_index()
+        enabled = cls.cfg.get('enabled_profiles')
+        if enabled:
+            enabled = set(enabled)
+        num_completed = 0
+        for condname in cls.profile_store.conds():
             if cls.conds and condname not in cls.conds:
-                e.log.info(f'skipping unknown cond dir \'{condname}\'')
+                e.log.info(f'skipping unknown cond \'{condname}\'')
                 continue
-            run_cond_path = cls.record.run_path / condname
-            for prof_path in cond_path.iterdir():
-                profname = prof_path.name
-                if cls.cfg.get('enabled_profiles') and \
-                   profname not in cls.cfg['enabled_profiles']:
-                    continue
-                if profname.startswith('.') or not prof_path.is_file():
-                    continue
-                if cls.replicate and \
-                   f'{condname}/{profname}' not in rep_profs:
-                    continue
-                # only load profile if we don't have a result
-                # for that profile
-                #fullprofname = f'{cond_path.name}/{profname}'
-                if not (run_cond_path / profname).is_file():
-                    p = cls.profile_mod().Profile.load(
-                        condname, profname)
-                    cls.profiles.append(p)
-                else:
-                    e.log.info(f'results file exists for profile \'{condname}/{profname}\'; not loading')
-        random.shuffle(cls.profiles)
-        # the actual list of profiles will shrink
+            profnames = cls.profile_store.subjids(condname)
+            if enabled:
+                profnames = [p for p in profnames if p in enabled]
+            if rep_index is not None:
+                rep_profs = rep_index.get(condname, set())
+                profnames = [p for p in profnames if p in rep_profs]
+            # only index a profile if we don't have a result for it
+            done = have_results.get(condname, set())
+            avail = [p for p in profnames if p not in done]
+            cls.profiles.add_completed(condname, len(profnames) - len(avail))
+            num_completed += len(profnames) - len(avail)
+            random.shuffle(avail)
+            cls.profiles.add_keys(condname, avail)
+        if num_completed:
+            e.log.info(f'{num_completed} profiles already have results;' +
+                       ' not loading')
+            # so the run's completion count carries on from where it was
+            cls.instances.seed(State.COMPLETE, num_completed)
+        # the actual pool of profiles will shrink
         # as the experiment progresses
         cls.num_profiles = len(cls.profiles)
-        e.log.info(f'loaded {cls.num_profiles} profiles')
+        e.log.info(f'indexed {cls.num_profiles} profiles')
 
     @classmethod
     def make_profiles(cls):
         e.log.info('creating all profiles')
         cls.profiles_path.mkdir(exist_ok=True)
-        for cname, c in cls.cond_mod().conds.items():
+        cls.profile_store.reset()
+        if cls.profile_store.virtual:
+            cast(profilestore.VirtualProfileStore, cls.profile_store).create(
+                {cname: cls.cond_size for cname in cls.cond_mod().conds})
+            e.log.info(f'created {cls.cond_size} virtual profiles per condition')
+            return
+        # NB: Subject IDs are all generated here, so they are unique
+        # across batches
+        profile.subjids.clear()
+        batches: list[tuple[str, list[str], int]] = []
+        for cname in cls.cond_mod().conds:
             e.log.info(f'creating {cls.cond_size} profiles for condition \'{cname}\'')
-            (cls.profiles_path / cname).mkdir()
-            for i in range(cls.cond_size):
-                p = cls.profile_mod().Profile(c)
-                p.save()
+            if not cls.profile_store.packed:
+                (cls.profiles_path / cname).mkdir()
+            cond_subjids = profile.subjids.generate(cls.cond_size)
+            for i in range(0, len(cond_subjids), profile_batch_size):
+                batches.append((cname, cond_subjids[i:i + profile_batch_size],
+                                secrets.randbits(64)))
+        total = sum(len(batch[1]) for batch in batches)
+        made = 0
+        workers = min(cls.cfg['profile_workers'] or os.cpu_count() or 1,
+                      len(batches))
+        if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            e.log.info(f'creating profiles in {workers} processes')
+            # the writer shouldn't be holding any locks when we fork
+            e.srv.writer.flush()
+            with futures.ProcessPoolExecutor(
+                    workers,
+                    mp_context=multiprocessing.get_context('fork')) as pool:
+                batch_of = {pool.submit(profile.make_batch, *batch): batch
+                            for batch in batches}
+                pending = set(batch_of)
+                while pending:
+                    done, pending = futures.wait(pending, timeout=0)
+                    for fut in done:
+                        made += cls._save_batch(batch_of[fut], fut.result())
+                        e.srv.dboard.profiles_progress(made, total)
+                    if pending:
+                        # let the progress updates go out
+                        e.srv.socketio.sleep(0.1)
+        else:
+            for batch in batches:
+                made += cls._save_batch(batch, profile.make_batch(*batch))
+                e.srv.dboard.profiles_progress(made, total)
+                e.srv.socketio.sleep(0)
+        profile.subjids.clear()
+
+    @classmethod
+    def _save_batch(cls, batch: tuple[str, list[str], int],
+                    records: list[tuple[str, bytes]]):
+        # only packed profiles are left for us to write
+        if records:
+            cls.profile_store.write(batch[0], records)
+        return len(batch[1])
 
     @classmethod
     def cond_mod(cls):
@@ -370,120 +734,314 @@ class BaseExper:
 
     @classmethod
     def all_active(cls):
-        return [inst for inst in cls.instances.values()
-                if inst.state == State.ACTIVE]
+        return cls.instances.active()
+
+    @classmethod
+    def clear_instances(cls):
+        cls.instances.clear()
+        cls._ended.clear()
+        cls._unspillable.clear()
+        # NB: Spilled instances may still be queued for writing
+        e.srv.writer.flush()
+        for path in cls.spill_path.iterdir():
+            path.unlink()
+
+    @classmethod
+    def get_inst(cls, sid: Optional[str]) -> Optional[BaseExper]:
+        """Look up an instance, reloading it if it has been spilled."""
+        if sid is None:
+            return None
+        inst = cls.instances.get(sid)
+        if inst:
+            if sid in cls._ended:
+                cls._ended[sid] = time.monotonic()
+                cls._ended.move_to_end(sid)
+        elif cls.instances.is_spilled(sid):
+            inst = cls._rehydrate(sid)
+        return inst
+
+    @classmethod
+    def spill_ended(cls):
+        """Move ended instances out of memory.
+
+        Instances are written to disk once they have been ended
+        for the grace period, or sooner if there are more than
+        the configured number of ended instances in memory.
+        """
+        now = time.monotonic()
+        excess = len(cls._ended) - len(cls._unspillable) - \
+            cls.cfg['spill_cache_size']
+        due: list[str] = []
+        for sid, last_used in cls._ended.items():
+            if now - last_used < cls.cfg['spill_grace_secs'] and excess <= 0:
+                break
+            if sid not in cls._unspillable:
+                due.append(sid)
+                excess -= 1
+        for sid in due:
+            inst = cls.instances.get(sid)
+            if inst and not inst._spill():
+                # (it would only fail again)
+                cls._unspillable.add(sid)
+            else:
+                del cls._ended[sid]
+
+    def _spill(self) -> bool:
+        # the tasks the participant can still reach
+        kept: list[tasks.TaskNode] = []
+        task: Optional[tasks.TaskNode] = self.task
+        while task and task not in kept:
+            kept.append(task)
+            task = task.next_tasks[0] if len(task.next_tasks) == 1 else None
+        state = self.__dict__.copy()
+        del state['tasks_by_id']
+        buf = io.BytesIO()
+        try:
+            pickle.dump([type(task) for task in kept], buf)
+            _SpillPickler(buf, self, kept).dump(
+                (state, [task.__getstate__() for task in kept]))
+        except:
+            e.log.error(f'unable to spill sid {self.sid[:4]}:' +
+                        f' {traceback.format_exc()}')
+            return False
+        e.srv.writer.submit(writer.Replace(
+            self.spill_path / self.sid, buf.getvalue()))
+        e.srv.dboard.inst_spilled(self)
+        self.instances.spill(self.sid)
+        return True
+
+    @classmethod
+    def _rehydrate(cls, sid: str):
+        spill_path = cls.spill_path / sid
+        if not spill_path.is_file():
+            # it may still be in the write queue
+            e.srv.writer.flush()
+        with open(spill_path, 'rb') as f:
+            task_classes: list[Type[tasks.TaskNode]] = pickle.load(f)
+            kept = [task_cls.__new__(task_cls) for task_cls in task_classes]
+            inst = cls.__new__(cls)
+            inst._api = inst.api_class(inst)
+            state, task_states = _SpillUnpickler(f, inst, kept).load()
+        inst.__dict__.update(state)
+        for task, task_state in zip(kept, task_states):
+            task.__setstate__(task_state)
+        inst.tasks_by_id = {task.id: task for task in kept}
+        e.srv.writer.submit(writer.Delete(spill_path))
+        cls.instances.restore(inst)
+        cls._ended[sid] = time.monotonic()
+        e.log.info(f'reloaded spilled sid {sid[:4]}')
+        e.srv.dboard.inst_rehydrated(inst)
+        return inst
+
+    @classmethod
+    def memory_usage(cls, sample_size: int = 20):
+        """Approximate memory used by instances, by state."""
+        counts = cls.instances.snapshot()
+        usage: dict[str, dict[str, int]] = {}
+        for state in State:
+            insts = cls.instances.in_state(state)
+            # Sizing every instance would stall the server, so
+            # the total is extrapolated from a sample
+            sample = random.sample(insts, min(len(insts), sample_size))
+            sample_bytes = sum(sizeof.deep_sizeof(inst) for inst in sample)
+            usage[state.name] = {
+                'in_memory': len(insts),
+                'spilled': counts[state.name]['spilled'],
+                'bytes': sample_bytes*len(insts)//len(sample) if sample else 0
+            }
+        return usage
 
     @classmethod
     def new_inst(cls, ip: str, args: MultiDict[str, str], sid: str):
         inst = cls(ip, args, sid)
         inst._will_start()
+        cls.spill_ended()
         #session['sid'] = inst.sid
-        cls.instances[inst.sid] = inst
+        cls.instances.add(inst)
         e.log.info(f'new instance for sid {inst.sid[:4]}')
         e.srv.dboard.inst_created(inst)
         return inst
 
     @classmethod
     def collect_responses(cls, run: str):
+        """Gather the responses of a run for export.
+
+        Only the header (or first item) of each response file
+        is read here; responses get read one subject at a time
+        as the returned ResponseSet is iterated.
+        """
+        # make sure any queued writes for the run are on disk
+        e.srv.writer.flush()
+        if cls.rundb:
+            db = cls.rundb
+            return ResponseSet(
+                db.response_sids(run), db.response_extras(run),
+                [lambda: (TaskResponse(resp, task, ts, sid, cond, prof, **extra)
+                          for sid, cond, prof, ts, task, resp, extra
+                          in db.responses(run))])
         run_path = cls.runs_path / run
-        by_cond: dict[str, dict[str, list[TaskResponse]]] = {}
+        fmt = cls.results_format()
+        # cond: {sid: source}
+        by_cond: dict[str, dict[str, ResponseSource]] = {}
+        extras: dict[str, None] = {}
+        # Journals hold the responses of instances that haven't ended
+        # yet. A journal is always at least as recent as any response
+        # file for the same SID, so it takes precedence.
+        journal_path = run_path / 'journal'
+        if journal_path.is_dir():
+            for jpath in journal_path.iterdir():
+                if jpath.stem[0] == '.' or not jpath.is_file():
+                    continue
+                header, records = journal.replay(jpath)
+                if not header:
+                    continue
+                for rec in header['pseudo'] + list(records.values()):
+                    extras.update(dict.fromkeys(rec['extra']))
+                by_cond.setdefault(header['cond'], {})[header['sid']] = \
+                    partial(cls._read_journal, jpath)
         for cond in run_path.iterdir():
-            if cond.name == 'id-mapping' or not cond.is_dir():
+            if cond.name in special_run_dirs or not cond.is_dir():
                 continue
-            by_cond[cond.name] = {}
+            cond_sources = by_cond.setdefault(cond.name, {})
             for respath in cond.iterdir():
                 if respath.stem[0] == '.':
                     continue
-                if cls.cfg['output_format'] == 'csv':
+                if fmt == 'csv':
                     with open(respath, newline='') as f:
                         reader = csv.reader(f, lineterminator='\n')
-                        rows = list(reader)
-                        headers = rows[0]
-                        sid = rows[1][2]
-                        by_cond[cond.name][sid] = []
-                        # skip header row
-                        for row in rows[1:]:
-                            by_cond[cond.name][sid].append(
-                                TaskResponse(
-                                    row[2], row[1], row[0],
-                                    sid, cond.name, respath.stem,
-                                    **dict(zip(headers[3:], row[3:]))))
-                elif cls.cfg['output_format'] == 'json':
-                    # 'time', 'task', 'resp', + extra fields
-                    with open(respath) as f:
-                        items = json.load(f)
-                    sid = items[0]['resp']
-                    by_cond[cond.name][sid] = []
-                    for item in items:
-                        extras = item.copy()
-                        extras.pop('time')
-                        extras.pop('task')
-                        extras.pop('resp', None)
-                        by_cond[cond.name][sid].append(
-                            TaskResponse(
-                                item.get('resp'), item['task'], item['time'],
-                                sid, cond.name, respath.stem, **extras))
+                        headers = next(reader)
+                        sid = next(reader)[2]
+                    extras.update(dict.fromkeys(headers[3:]))
+                    reader_fn = cls._read_csv_responses
                 else:
-                    # XXX would probably be better to sanity-check this
-                    # when the program loads
-                    raise BadOutputFormatError(cls.cfg['output_format'])
-        return sum([by_cond[c][s]
-                    for c in sorted(by_cond.keys())
-                    for s in sorted(by_cond[c].keys())], [])
+                    sid = _first_json_item(respath)['resp']
+                    reader_fn = cls._read_json_responses
+                if sid not in cond_sources:
+                    cond_sources[sid] = partial(
+                        reader_fn, respath, sid, cond.name)
+        sids = [sid for c in by_cond.values() for sid in c]
+        return ResponseSet(
+            sids, list(extras),
+            [by_cond[c][s]
+             for c in sorted(by_cond.keys())
+             for s in sorted(by_cond[c].keys())])
+
+    @staticmethod
+    def _read_csv_responses(path: Path, sid: str, cond: str):
+        with open(path, newline='') as f:
+            reader = csv.reader(f, lineterminator='\n')
+            headers = next(reader)
+            for row in reader:
+                yield TaskResponse(
+                    row[2], row[1], row[0], sid, cond, path.stem,
+                    **dict(zip(headers[3:], row[3:])))
+
+    @staticmethod
+    def _read_json_responses(path: Path, sid: str, cond: str):
+        # 'time', 'task', 'resp', + extra fields
+        with open(path) as f:
+            items = json.load(f)
+        for item in items:
+            extras = item.copy()
+            extras.pop('time')
+            extras.pop('task')
+            extras.pop('resp', None)
+            yield TaskResponse(
+                item.get('resp'), item['task'], item['time'],
+                sid, cond, path.stem, **extras)
 
     @classmethod
-    def write_responses(cls, resps: list[TaskResponse], dest_path: Path):
-        if resps[0].sid:
-            all_sids = set(cast(str, r.sid) for r in resps)
-            min_uniq_len = 0
-            while len(set(sid[:(min_uniq_len := min_uniq_len + 1)]
-                          for sid in all_sids)) < len(all_sids):
-                pass
-            min_uniq_len = max(min_uniq_len, 4)
+    def _read_journal(cls, path: Path):
+        header, records = journal.replay(path)
+        cond, sid, prof = header['cond'], header['sid'], header['prof']
+        for rec in header['pseudo'] + \
+                [records[tid] for tid in sorted(records.keys())]:
+            yield cls._from_journal_record(rec, sid, cond, prof)
+
+    @staticmethod
+    def _from_journal_record(rec: dict[str, Any], sid: str,
+                             cond: str, prof: str):
+        return TaskResponse(
+            rec['resp'], rec['task'], rec['time'],
+            sid, cond, prof, **rec['extra'])
 
+    @classmethod
+    def write_responses(cls, resps: Union[ResponseSet, list[TaskResponse]],
+                        dest_path: Path):
         # newline='' must be set for the csv module
         with open(dest_path, 'w', newline='') as f:
-            if cls.cfg['output_format'] == 'csv':
-                writer = csv.writer(f, lineterminator='\n')
-                extras: set[str] = set()
-                # collect all extra response field names
-                for r in resps:
-                    for k in r.extra:
-                        extras.add(k)
-                headers = ['time', 'task', 'resp', *extras]
-                if resps[0].sid:
-                    headers = ['sid', 'cond', 'prof'] + headers
-                writer.writerow(headers)
-                for r in resps:
-                    # NB: None is written as the empty string
-                    data = [r.timestamp, r.task_name, r.response,
-                            *[r.extra.get(e) for e in extras]]
-                    if r.sid:
-                        data = [r.sid[:min_uniq_len], r.cond, r.prof] + data
-                    writer.writerow(data)
-            elif cls.cfg['output_format'] == 'json':
-                output: list[dict[str, Any]] = []
-                for r in resps:
-                    item = {'time': r.timestamp, 'task': r.task_name}
-                    if r.response is not None:
-                        item['resp'] = r.response
-                    item.update(r.extra)
-                    if r.sid:
-                        item['sid'] = r.sid[:min_uniq_len]
-                        item['cond'] = r.cond
-                        item['prof'] = r.prof
-                    output.append(item)
-                json.dump(output, f, indent=2)
-            else:
-                # XXX would probably be better to sanity-check this
-                # when the program loads
-                raise BadOutputFormatError(cls.cfg['output_format'])
+            cls.dump_responses(resps, f)
+
+    @classmethod
+    def results_format(cls):
+        """Format of response files and downloaded results."""
+        # the database gets exported as CSV
+        if cls.cfg['output_format'] == 'sqlite':
+            return 'csv'
+        return cls.cfg['output_format']
+
+    @classmethod
+    def dump_responses(cls, resps: Union[ResponseSet, list[TaskResponse]],
+                       f: IO[str]):
+        """Write responses to f as they are iterated."""
+        for _ in cls.stream_responses(resps, f):
+            pass
+
+    @classmethod
+    def stream_responses(cls, resps: Union[ResponseSet, list[TaskResponse]],
+                         f: IO[str]) -> Iterator[None]:
+        """Like dump_responses, but yields after each response is written,
+        so the caller can pass the output along as it is produced."""
+        if isinstance(resps, ResponseSet):
+            extras = resps.extras
+            sid_len = resps.sid_len
+        else:
+            extras = list(dict.fromkeys(k for r in resps for k in r.extra))
+            sid_len = min_unique_prefix(
+                [cast(str, r.sid) for r in resps if r.sid])
+
+        fmt = cls.results_format()
+        if fmt == 'csv':
+            csv_writer = csv.writer(f, lineterminator='\n')
+            headers = ['time', 'task', 'resp', *extras]
+            # NB: Either all responses have a SID, or none do
+            if sid_len:
+                headers = ['sid', 'cond', 'prof'] + headers
+            csv_writer.writerow(headers)
+            for r in resps:
+                # NB: None is written as the empty string
+                data = [r.timestamp, r.task_name, r.response,
+                        *[r.extra.get(e) for e in extras]]
+                if r.sid:
+                    data = [r.sid[:sid_len], r.cond, r.prof] + data
+                csv_writer.writerow(data)
+                yield
+        elif fmt == 'json':
+            # Same output as json.dump(<list>, f, indent=2), but
+            # written one item at a time
+            sep = '[\n  '
+            for r in resps:
+                item = {'time': r.timestamp, 'task': r.task_name}
+                if r.response is not None:
+                    item['resp'] = r.response
+                item.update(r.extra)
+                if r.sid:
+                    item['sid'] = r.sid[:sid_len]
+                    item['cond'] = r.cond
+                    item['prof'] = r.prof
+                # (newlines within strings are always escaped)
+                f.write(sep + json.dumps(item, indent=2).replace('\n', '\n  '))
+                sep = ',\n  '
+                yield
+            f.write('[]' if sep == '[\n  ' else '\n]')
+        else:
+            raise BadOutputFormatError(fmt)
 
     def create_tasks(self):
         """Overridden by the bundle class to create post-consent tasks."""
         pass
 
-    def nav_items(self) -> list[tuple[str, tasks.Task]]:
+    def nav_items(self) -> list[tuple[str, tasks.TaskNode]]:
         """May be overridden by the bundle class to add nav menu items."""
         if self.last_task:
             return [('First', self.first_task), ('Last', self.last_task)]
@@ -494,18 +1052,22 @@ class BaseExper:
         elapsed = self._elapsed_time()
         elapsed_min = int(elapsed//60)
         elapsed_sec = int(elapsed) % 60
+        prof = str(self.profile) if self.profile else 'unassigned'
+        if self.lease_lapsed:
+            prof += ' (lapsed)'
         return {
-            'profile': str(self.profile) if self.profile else 'unassigned',
+            'profile': prof,
             'task': self.task_cursor,
             'elapsed': f'{elapsed_min:02}:{elapsed_sec:02}'
         }
 
     def assign_profile(self):
-        self.profile = self.profiles.pop(0)
+        self.profile = self.profiles.claim()
         e.log.info(
             f'sid {self.sid[:4]} assigned profile: {self.profile}')
         self.create_tasks()
         self.variables['exp_num_tasks'] = self.num_tasks_created
+        self._open_journal()
 
     def _will_start(self):
         self.first_task = self.task
@@ -535,6 +1097,71 @@ class BaseExper:
             resp, self.task.template_name, **self.task.resp_extra)
         self.responses[self.task.id] = task_resp
         #self.task.did_store_resp(resp)
+        if self.profile:
+            self._journal_resp(self.task.id, task_resp)
+
+    @staticmethod
+    def _journal_record(task_id: Optional[int], resp: TaskResponse):
+        return {
+            'id': task_id, 'time': resp.timestamp, 'task': resp.task_name,
+            'resp': resp.response, 'extra': resp.extra
+        }
+
+    @staticmethod
+    def _db_row(seq: int, resp: TaskResponse) -> rundb.ResponseRow:
+        return (seq, resp.timestamp, resp.task_name,
+                resp.response, resp.extra)
+
+    def _db_rows(self):
+        _, pseudo = self._split_pii(self.pseudo_responses)
+        # pseudo-responses get negative sequence numbers
+        # so they sort before the task responses
+        return [self._db_row(i - len(pseudo), r)
+                for i, r in enumerate(pseudo)] + \
+            [self._db_row(tid, self.responses[tid])
+             for tid in sorted(self.responses.keys())
+             if self.responses[tid].task_name not in self.cfg['pii']]
+
+    def _open_journal(self):
+        if self.rundb:
+            # the database is its own journal
+            assert self.profile
+            self.rundb.begin_instance(
+                cast(str, self.run), self.sid, str(self.profile.cond),
+                self.profile.subjid, self._db_rows())
+            return
+        if not self.journal:
+            self.journal = journal.Journal(
+                cast(Record, self.record).journal_path / self.sid)
+        # NB: PII is never journaled; it only gets written
+        # to the ID mapping when the responses are compacted
+        _, pseudo = self._split_pii(self.pseudo_responses)
+        assert self.profile
+        header = {
+            'sid': self.sid,
+            'cond': str(self.profile.cond),
+            'prof': self.profile.subjid,
+            'pseudo': [self._journal_record(None, r) for r in pseudo]
+        }
+        # any responses made before the profile was assigned
+        # get written along with the header
+        self.journal.open(header, [
+            self._journal_record(tid, self.responses[tid])
+            for tid in sorted(self.responses.keys())])
+
+    def _journal_resp(self, task_id: int, resp: TaskResponse):
+        # NB: Once an instance has ended, its responses have been
+        # saved and its journal removed, and anything arriving late
+        # (e.g., after a timeout) must not start a new one
+        if self.state != State.ACTIVE:
+            return
+        if self.rundb:
+            self.rundb.save_response(
+                cast(str, self.run), self.sid, self._db_row(task_id, resp))
+        elif self.journal and self.journal.is_open:
+            self.journal.append(self._journal_record(task_id, resp))
+        else:
+            self._open_journal()
 
     def _elapsed_time(self):
         if self.state == State.ACTIVE:
@@ -543,15 +1170,20 @@ class BaseExper:
             return self.end_time - self.start_time
 
     def _save_pii(self, pii):
-        # dir might exist if resuming
-        self.record.id_mapping_path.mkdir(exist_ok=True)
-        pii_path = self.record.id_mapping_path / self.sid
+        if self.rundb:
+            self.rundb.save_pii(
+                cast(str, self.run), self.sid,
+                [('SESSION_ID', self.sid)] +
+                [(item.task_name, item.response) for item in pii])
+            return
+        # (the writer creates the dir, if needed)
+        pii_path = cast(Record, self.record).id_mapping_path / self.sid
         output = [{'key': 'SESSION_ID', 'val': self.sid}]
         for item in pii:
             record = {'key': item.task_name, 'val': item.response}
             output.append(record)
-        with open(pii_path, 'w') as f:
-            json.dump(output, f, indent=2)
+        e.srv.writer.submit(
+            manifest.SavePII(pii_path, json.dumps(output, indent=2)))
 
     def _response_save_path(self):
         if self.profile:
@@ -559,25 +1191,48 @@ class BaseExper:
             return cond_path / (self.profile.subjid 
                 + resp_file_suffixes.get(self.state, ''))
         else:
-            # XXX this relies on cfg['output_format'] being set to a valid value
             return cast(Record, self.record).run_path.with_suffix(
-                '.' + self.cfg['output_format'])
+                '.' + self.results_format())
 
-    def _save_responses(self):
-        resp_path = self._response_save_path()
-        actual_resps = [self.responses[tid]
-                        for tid in sorted(self.responses.keys())]
-        all_resps = self.pseudo_responses + actual_resps
+    def _split_pii(self, all_resps: list[TaskResponse]):
         def splitter(pii_resps, resp: TaskResponse):
             if resp.task_name in self.cfg['pii']:
                 pii_resps[0].append(resp)
             else:
                 pii_resps[1].append(resp)
             return pii_resps
+        pii: list[TaskResponse]
+        resps: list[TaskResponse]
         pii, resps = reduce(splitter, all_resps, [[], []])
+        return pii, resps
+
+    def _save_responses(self):
+        """Compact the instance's responses into its response file."""
+        resp_path = self._response_save_path()
+        actual_resps = [self.responses[tid]
+                        for tid in sorted(self.responses.keys())]
+        pii, resps = self._split_pii(self.pseudo_responses + actual_resps)
         if pii:
             self._save_pii(pii)
-        self.write_responses(resps, resp_path)
+        if self.rundb and self.profile:
+            self.rundb.end_instance(
+                cast(str, self.run), self.sid, self.state.name,
+                self._db_rows())
+            return
+        output = io.StringIO()
+        self.dump_responses(resps, output)
+        # NB: The file gets written in the background by the write queue
+        if self.profile:
+            e.srv.writer.submit(
+                manifest.SaveResult(resp_path, output.getvalue()))
+        else:
+            # (a profile-less tool session's file sits beside the
+            # run folder, so it isn't counted in the run's manifest)
+            e.srv.writer.submit(writer.Replace(resp_path, output.getvalue()))
+        # The response file now holds everything in the journal.
+        # If more responses arrive, a fresh journal gets started.
+        if self.journal:
+            self.journal.remove()
 
     def terminate(self):
         if self.state != State.ACTIVE:
@@ -585,13 +1240,20 @@ class BaseExper:
         e.log.info(f'sid {self.sid[:4]} terminated')
         self.task.replace_next_task(tasks.Terminated(self))
         self.end(State.TERMINATED)
-        if self.profile:
-            self.profiles.insert(0, self.profile)
 
     def end(self, state: State):
         # called for normal completion, timeout, nonconsent, or termination
         self.end_time = time.monotonic()
+        old_state = self.state
         self.state = state
+        self.instances.state_changed(self, old_state)
+        self._ended[self.sid] = self.end_time
+        # (a profile whose lease has lapsed is already back in the pool)
+        if self.profile and not self.lease_lapsed:
+            if state == State.COMPLETE:
+                self.profiles.complete(self.profile)
+            else:
+                self.profiles.release(self.profile)
         e.srv.dboard.inst_updated(self)
         if self.profile:
             e.log.info(f'saving responses for sid {self.sid[:4]}')
@@ -602,13 +1264,17 @@ class Record:
     replicate: Union[str, None]
     run_path: Path
     id_mapping_path: Path
+    journal_path: Path
 
     def __init__(self, experclass: Type[e.Experiment], fromsaved: Optional[str] = None):
         self.experclass = experclass
         fromsaved = cast(str, fromsaved or experclass.run)
         saved_path = experclass.runs_path / fromsaved
         md_path = saved_path / 'metadata'
-        if md_path.is_file():
+        if experclass.rundb:
+            self.start_time = fromsaved
+            self.replicate = experclass.rundb.replicate_of(fromsaved)
+        elif md_path.is_file():
             schema = strictyaml.Map({
                 'replicate': strictyaml.EmptyNone() | strictyaml.Str(),
             })
@@ -622,34 +1288,43 @@ class Record:
             self.replicate = None
         self.run_path = experclass.runs_path / self.start_time
         self.id_mapping_path = self.run_path / 'id-mapping'
-
-    def completed_profiles(self) -> list[str]:
-        # list of strings of form 'cond/prof'
-        profiles: list[str] = []
-        bad_suffixes = resp_file_suffixes.values()
-        for cond_path in self.run_path.iterdir():
-            if cond_path.is_dir():
-                for prof_path in cond_path.iterdir():
-                    prof = prof_path.name
-                    if not (prof.startswith('.') or \
-                            any(prof.endswith(sfx) for sfx in bad_suffixes)):
-                        profiles.append(f'{cond_path.name}/{prof}')
-        return profiles
+        self.journal_path = self.run_path / 'journal'
+
+    def completion_index(self) -> dict[str, set[str]]:
+        """Names of the profiles completed in the run, by condition."""
+        index: dict[str, set[str]] = {}
+        if self.experclass.rundb:
+            for name in self.experclass.rundb.completed_profiles(
+                    self.run_path.name):
+                cond, prof = name.split('/', 1)
+                index.setdefault(cond, set()).add(prof)
+        elif self.run_path.is_dir():
+            for cond, states in manifest.index_results(self.run_path).items():
+                index[cond] = states.get('COMPLETE', set())
+        return index
+
+    def completed_profiles(self) -> set[str]:
+        # set of strings of form 'cond/prof'
+        return {f'{cond}/{prof}'
+                for cond, profs in self.completion_index().items()
+                for prof in profs}
 
     def save(self):
         # Only the metadata is saved here; the data for each
         # individual subject is saved by the experiment class
+        if self.experclass.rundb:
+            self.experclass.rundb.save_run(self.run_path.name, self.replicate)
+            return
 
         # create run directory (it will already exist if resuming)
-        self.run_path.mkdir(exist_ok=True)
         for cname, c in self.experclass.cond_mod().conds.items():
-            (self.run_path / cname).mkdir(exist_ok=True)
+            e.srv.writer.submit(writer.Mkdir(self.run_path / cname))
 
         md_path = self.run_path / 'metadata'
-        with open(md_path, 'w') as f:
-            fields = {}
-            # if self.time_end:
-            #     fields['time_end'] = self.time_end
-            fields['replicate'] = self.replicate or ''
-            print(strictyaml.as_document(fields).as_yaml(), file=f)
+        fields = {}
+        # if self.time_end:
+        #     fields['time_end'] = self.time_end
+        fields['replicate'] = self.replicate or ''
+        e.srv.writer.submit(writer.Replace(
+            md_path, strictyaml.as_document(fields).as_yaml() + '\n'))
 
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import json
+
+from pathlib import Path
+from typing import Any, Optional
+
+import expert as e
+from . import writer
+
+# A journal is an append-only record of the responses made by
+# a single instance. Each line is a JSON object. The first line
+# is a header identifying the instance; every following line
+# is a response record keyed by task ID. When a task is revisited
+# (e.g., in tool mode), a new record with the same ID is appended,
+# and overwrites the earlier one when the journal is replayed.
+# Journals are compacted into regular response files when an
+# instance ends.
+# All writes go through the server's write queue.
+
+
+class Journal:
+
+    path: Path
+    is_open: bool
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.is_open = False
+
+    def open(self, header: dict[str, Any], records: list[dict[str, Any]]):
+        """Start a new journal with the given header and initial records."""
+        lines = [json.dumps(header)] + [json.dumps(rec) for rec in records]
+        e.srv.writer.submit(writer.Replace(self.path, '\n'.join(lines) + '\n'))
+        self.is_open = True
+
+    def append(self, record: dict[str, Any]):
+        e.srv.writer.submit(writer.Append(self.path, json.dumps(record) + '\n'))
+
+    def remove(self):
+        e.srv.writer.submit(writer.Delete(self.path))
+        self.is_open = False
+
+
+def replay(path: Path) -> tuple[dict[str, Any], dict[int, dict[str, Any]]]:
+    """Read a journal, returning its header and the latest record
+    for each task ID."""
+    header: Optional[dict[str, Any]] = None
+    records: dict[int, dict[str, Any]] = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                # a partially-written final line, if the
+                # server died in the middle of an append
+                break
+            if header is None:
+                header = item
+            else:
+                records[item['id']] = item
+    return header or {}, records
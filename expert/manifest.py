@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import json
+import os
+
+from pathlib import Path
+from typing import Optional, TypedDict
+
+import expert as e
+from . import writer, timestamp
+
+# A run's manifest summarizes its results, so the dashboard doesn't
+# have to list every response file of every run. Manifests are kept
+# in a hidden folder in the runs folder, and are updated by the write
+# queue whenever a response file or ID mapping is saved. Each one
+# records the mtimes of its run's directories as of the last update;
+# if these no longer match (e.g., because files were removed by hand),
+# the run gets rescanned.
+
+manifests_dir = '.manifests'
+
+
+# cond: {state name: names of profiles whose instance ended in it}
+ResultIndex = dict[str, dict[str, set[str]]]
+
+
+class RunManifest(TypedDict):
+    # cond: {state name: number of response files}
+    counts: dict[str, dict[str, int]]
+    has_pii: bool
+    modified: str
+    # directory name ('.' for the run itself): mtime in ns
+    mtimes: dict[str, int]
+
+
+def manifest_path(run_path: Path):
+    return run_path.parent / manifests_dir / f'{run_path.name}.json'
+
+
+def _suffix_states() -> dict[str, str]:
+    # avoid a circular import
+    from .experiment import resp_file_suffixes
+    return {sfx: state.name for state, sfx in resp_file_suffixes.items()}
+
+
+def split_resp_name(resp_name: str,
+                    suffix_states: Optional[dict[str, str]] = None
+                    ) -> tuple[str, str]:
+    """Profile name and name of the state an instance ended in,
+    given the name of its response file."""
+    # NB: Every suffix is of the form -<state>
+    prof, sep, state = resp_name.rpartition('-')
+    if sep:
+        state = (suffix_states or _suffix_states()).get(sep + state)
+        if state:
+            return prof, state
+    return resp_name, 'COMPLETE'
+
+
+def state_of(resp_name: str):
+    return split_resp_name(resp_name)[1]
+
+
+def dir_mtimes(run_path: Path) -> dict[str, int]:
+    mtimes = {'.': run_path.stat().st_mtime_ns}
+    with os.scandir(run_path) as it:
+        for entry in it:
+            # NB: Journals come and go without affecting the counts
+            if entry.is_dir() and entry.name[0] != '.' and \
+               entry.name != 'journal':
+                mtimes[entry.name] = entry.stat().st_mtime_ns
+    return mtimes
+
+
+def index_results(run_path: Path) -> ResultIndex:
+    """Index a run's response files, with one listing
+    of each condition folder."""
+    from .experiment import special_run_dirs
+    index: ResultIndex = {}
+    suffix_states = _suffix_states()
+    with os.scandir(run_path) as it:
+        conds = [entry for entry in it
+                 if entry.is_dir() and entry.name[0] != '.' and
+                 entry.name not in special_run_dirs]
+    for cond in conds:
+        with os.scandir(cond.path) as it:
+            names = [resp.name for resp in it
+                     if resp.name[0] != '.' and resp.is_file()]
+        # NB: Usually, most of these are the results
+        # of completed instances, which have no suffix
+        complete = {name for name in names if '-' not in name}
+        cond_index = index[cond.name] = \
+            {'COMPLETE': complete} if complete else {}
+        for name in names:
+            if '-' in name:
+                prof, state = split_resp_name(name, suffix_states)
+                cond_index.setdefault(state, set()).add(prof)
+    return index
+
+
+def scan(run_path: Path) -> RunManifest:
+    counts = {cond: {state: len(profs) for state, profs in states.items()}
+              for cond, states in index_results(run_path).items()}
+    return {
+        'counts': counts,
+        'has_pii': (run_path / 'id-mapping').is_dir(),
+        'modified': timestamp.make_timestamp(),
+        'mtimes': dir_mtimes(run_path)
+    }
+
+
+def load(run_path: Path) -> Optional[RunManifest]:
+    try:
+        with open(manifest_path(run_path)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def is_current(run_path: Path, manifest: RunManifest):
+    return manifest['mtimes'] == dir_mtimes(run_path)
+
+
+def read(run_path: Path) -> RunManifest:
+    """Get the manifest of a run, rescanning the run if needed."""
+    manifest = load(run_path)
+    if manifest is None or not is_current(run_path, manifest):
+        e.log.info(f'rescanning run \'{run_path.name}\'')
+        manifest = scan(run_path)
+        # The rescan is repeated by the writer, in case
+        # anything is still queued for the run
+        e.srv.writer.submit(Rescan(run_path))
+    return manifest
+
+
+def _write(batch: writer.Batch, run_path: Path, manifest: RunManifest):
+    # the mtimes are taken after everything in the batch has landed
+    manifest['modified'] = timestamp.make_timestamp()
+    manifest['mtimes'] = dir_mtimes(run_path)
+    writer.Replace(manifest_path(run_path),
+                   json.dumps(manifest, indent=2)).apply(batch)
+
+
+def _batch_manifest(batch: writer.Batch, run_path: Path,
+                    rescan: bool = False) -> RunManifest:
+    """Manifest of a run, updated in memory during a batch
+    and saved when the batch is committed."""
+    key = ('manifest', run_path)
+    manifest = batch.state.get(key)
+    if manifest is None:
+        manifest = None if rescan else load(run_path)
+        if manifest is None or not is_current(run_path, manifest):
+            manifest = scan(run_path)
+        batch.state[key] = manifest
+        batch.on_commit(lambda: _write(batch, run_path, manifest))
+    elif rescan:
+        manifest.update(scan(run_path))
+    return manifest
+
+
+class SaveResult(writer.Replace):
+    """Replace a response file, counting it in its run's manifest."""
+
+    def apply(self, batch: writer.Batch):
+        # <run>/<cond>/<response file>
+        run_path = self.path.parent.parent
+        manifest = _batch_manifest(batch, run_path)
+        is_new = not self.path.exists()
+        super().apply(batch)
+        if is_new:
+            counts = manifest['counts'].setdefault(self.path.parent.name, {})
+            state = state_of(self.path.name)
+            counts[state] = counts.get(state, 0) + 1
+
+
+class SavePII(writer.Replace):
+    """Replace an ID mapping file, flagging its run as having PII."""
+
+    def apply(self, batch: writer.Batch):
+        # <run>/id-mapping/<sid>
+        run_path = self.path.parent.parent
+        manifest = _batch_manifest(batch, run_path)
+        super().apply(batch)
+        manifest['has_pii'] = True
+
+
+class Rescan(writer.WriteOp):
+
+    def apply(self, batch: writer.Batch):
+        if self.path.is_dir():
+            _batch_manifest(batch, self.path, rescan=True)
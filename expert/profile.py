@@ -1,11 +1,118 @@
 
 import random
 
+from collections import OrderedDict, deque
+from collections.abc import Mapping
 from functools import cached_property
+from typing import Any, Callable, Iterator, Optional
 
 import expert as e
 
 
+class SubjidRegistry:
+    """Subject IDs handed out so far, so no two profiles share one."""
+
+    taken: set[str]
+    # IDs generated ahead of time (e.g., by the parent of a worker
+    # process), which are handed out before any new ones are made
+    reserved: deque[str]
+
+    def __init__(self):
+        self.taken = set()
+        self.reserved = deque()
+
+    def clear(self):
+        self.taken.clear()
+        self.reserved.clear()
+
+    def generate(self, count: int, rng: Optional[random.Random] = None,
+                 length: Optional[int] = None,
+                 symbols: Optional[str] = None) -> list[str]:
+        choices = (rng or random).choices
+        length = length or e.experclass.cfg['subjid_length']
+        symbols = symbols or e.experclass.cfg['subjid_symbols']
+        subjids: list[str] = []
+        while len(subjids) < count:
+            subjid = ''.join(choices(symbols, k=length))
+            if subjid not in self.taken:
+                self.taken.add(subjid)
+                subjids.append(subjid)
+        return subjids
+
+    def new(self) -> str:
+        if self.reserved:
+            return self.reserved.popleft()
+        return self.generate(1)[0]
+
+
+subjids = SubjidRegistry()
+
+
+class FrozenDict(Mapping):
+    """Read-only dict, for frozen assets."""
+
+    __slots__ = ('_data',)
+
+    def __init__(self, *args, **kwargs):
+        self._data = dict(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'FrozenDict({self._data!r})'
+
+
+def freeze(obj: Any) -> Any:
+    """Copy obj with its dicts, lists and sets made immutable."""
+    if isinstance(obj, Mapping):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        return tuple(freeze(v) for v in obj)
+    elif isinstance(obj, (set, frozenset)):
+        return frozenset(freeze(v) for v in obj)
+    return obj
+
+
+class AssetRegistry:
+    """Data shared by all the profiles of a bundle, such as parsed
+    stimulus lists.
+
+    Bundles add their assets once per load, in their experiment
+    class's _declare_assets(). Assets are frozen, so profiles
+    can hold references to them rather than copies.
+    """
+
+    _assets: dict[str, Any]
+    # id of asset: name
+    _names: dict[int, str]
+
+    def __init__(self):
+        self._assets = {}
+        self._names = {}
+
+    def add(self, name: str, value: Any) -> Any:
+        frozen = freeze(value)
+        self._assets[name] = frozen
+        self._names[id(frozen)] = name
+        return frozen
+
+    def name_of(self, obj: Any) -> Optional[str]:
+        return self._names.get(id(obj))
+
+    def __getitem__(self, name: str) -> Any:
+        return self._assets[name]
+
+    def __contains__(self, name: str):
+        return name in self._assets
+
+
 class Profile:
     subjid: str
 
@@ -20,22 +127,204 @@ class Profile:
     def __str__(self):
         return self.fqname
 
-    # abstract; subclass customizes inst with data
-    # loaded from file
+    # subclass customizes inst with data loaded from file,
+    # either here or in load_data()
     @classmethod
     def load(cls, cond_str: str, subjid: str):
         inst = super().__new__(cls)
         inst.subjid = subjid
         inst.cond = e.experclass.cond_mod().conds[cond_str]
+        store = e.experclass.profile_store
+        # NB: Subclasses that read their own files
+        # don't implement load_data()
+        if store.packed or cls.load_data is not Profile.load_data:
+            inst.load_data(store.read(cond_str, subjid))
         return inst
 
     def save(self):
+        data = self.save_data()
+        if data is not None:
+            e.experclass.profile_store.write(
+                str(self.cond), [(self.subjid, data)])
+
+    # abstract; needed for the packed profile format
+    def save_data(self) -> Optional[bytes]:
+        """Serialize the profile's data."""
+        return None
+
+    def load_data(self, data: memoryview):
+        """Restore the profile's data from what save_data() returned.
+
+        NB: data is a view into the store, so anything kept
+        from it must be copied (e.g., by decoding it).
+        """
         pass
 
     def make_subjid(self) -> str:
-        while True:
-            subjid = ''
-            for _ in range(e.experclass.cfg['subjid_length']):
-                subjid += random.choice(e.experclass.cfg['subjid_symbols'])
-            if subjid not in [p.subjid for p in e.experclass.profiles]:
-                return subjid
+        return subjids.new()
+
+
+def make_batch(cond_str: str, batch_subjids: list[str],
+               seed: int) -> list[tuple[str, bytes]]:
+    """Create profiles with the given subject IDs.
+
+    This runs in a worker process when profiles are made in parallel;
+    seeding makes each batch independent of which process runs it.
+    Profiles are saved as they are made, except with the packed
+    format, where their data is returned for the caller to write.
+    """
+    state = random.getstate()
+    random.seed(seed)
+    subjids.reserved.extend(batch_subjids)
+    cond = e.experclass.cond_mod().conds[cond_str]
+    packed = e.experclass.profile_store.packed
+    records: list[tuple[str, bytes]] = []
+    try:
+        for _ in batch_subjids:
+            prof = e.experclass.profile_mod().Profile(cond)
+            if packed:
+                records.append((prof.subjid, prof.save_data() or b''))
+            else:
+                prof.save()
+    finally:
+        subjids.reserved.clear()
+        # NB: Batches made in the server process (when profiles
+        # aren't made in parallel) mustn't reseed everyone else
+        random.setstate(state)
+    return records
+
+
+def regenerate(cond_str: str, subjid: str) -> Profile:
+    """Recreate a virtual profile from its seed.
+
+    The profile is made the same way as when it was created,
+    with the random module seeded from the profile's name.
+    """
+    state = random.getstate()
+    random.seed(e.experclass.profile_store.seed_of(cond_str, subjid))
+    subjids.reserved.append(subjid)
+    try:
+        return e.experclass.profile_mod().Profile(
+            e.experclass.cond_mod().conds[cond_str])
+    finally:
+        # in case the profile failed before taking its subject ID
+        subjids.reserved.clear()
+        # NB: Other users of random shouldn't notice
+        random.setstate(state)
+
+
+class ProfilePool:
+    """Profiles available to be assigned, kept per condition.
+
+    Profiles are claimed from the condition with the fewest
+    completed plus currently claimed profiles, so the conditions
+    stay balanced even if participants drop out of some more
+    often than others. A released profile goes to the front
+    of its condition's queue.
+
+    Profiles can be added by key alone, in which case they are
+    only loaded (with the loader) when claimed.
+    """
+
+    # cond: {subjid: profile, or None if not loaded yet},
+    # in the order they will be claimed
+    _free: dict[str, OrderedDict[str, Optional[Profile]]]
+    _claimed: dict[str, int]
+    _completed: dict[str, int]
+    loader: Optional[Callable[[str, str], Profile]]
+
+    def __init__(self):
+        self._free = {}
+        self._claimed = {}
+        self._completed = {}
+        self.loader = None
+
+    def clear(self):
+        self._free.clear()
+        self._claimed.clear()
+        self._completed.clear()
+
+    def _cond(self, cond: str):
+        if cond not in self._free:
+            self._free[cond] = OrderedDict()
+            self._claimed[cond] = 0
+            self._completed[cond] = 0
+        return self._free[cond]
+
+    def add(self, prof: Profile):
+        self._cond(str(prof.cond))[prof.subjid] = prof
+
+    def add_keys(self, cond: str, subjids: list[str]):
+        """Add profiles that get loaded when claimed."""
+        free = self._cond(cond)
+        for subjid in subjids:
+            free[subjid] = None
+
+    def add_completed(self, cond: str, count: int = 1):
+        """Count profiles of a condition completed before loading."""
+        self._cond(cond)
+        self._completed[cond] += count
+
+    def claim(self) -> Optional[Profile]:
+        # NB: There are only ever a handful of conditions
+        avail = [cond for cond, free in self._free.items() if free]
+        if not avail:
+            return None
+        least = min(self._completed[c] + self._claimed[c] for c in avail)
+        cond = random.choice(
+            [c for c in avail
+             if self._completed[c] + self._claimed[c] == least])
+        free = self._free[cond]
+        subjid, prof = next(iter(free.items()))
+        if prof is None:
+            assert self.loader is not None
+            # NB: If this fails, the profile stays in the pool
+            prof = self.loader(cond, subjid)
+        del free[subjid]
+        self._claimed[cond] += 1
+        return prof
+
+    def release(self, prof: Profile):
+        """Return a claimed profile whose participant didn't finish."""
+        cond = str(prof.cond)
+        free = self._cond(cond)
+        free[prof.subjid] = prof
+        free.move_to_end(prof.subjid, last=False)
+        self._claimed[cond] = max(self._claimed[cond] - 1, 0)
+
+    def reclaim(self, prof: Profile) -> bool:
+        """Claim a released profile again, if it is still free."""
+        cond = str(prof.cond)
+        free = self._free.get(cond)
+        if free is None or prof.subjid not in free:
+            return False
+        del free[prof.subjid]
+        self._claimed[cond] += 1
+        return True
+
+    def complete(self, prof: Profile):
+        cond = str(prof.cond)
+        self._cond(cond)
+        self._claimed[cond] = max(self._claimed[cond] - 1, 0)
+        self._completed[cond] += 1
+
+    def depths(self) -> dict[str, dict[str, int]]:
+        return {cond: {'free': len(free),
+                       'claimed': self._claimed[cond],
+                       'completed': self._completed[cond]}
+                for cond, free in sorted(self._free.items())}
+
+    def has_subjid(self, subjid: str):
+        return any(subjid in free for free in self._free.values())
+
+    def __len__(self):
+        return sum(len(free) for free in self._free.values())
+
+    def __bool__(self):
+        return any(self._free.values())
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the free profiles' names (cond/subjid)."""
+        for cond, free in self._free.items():
+            for subjid in free:
+                yield f'{cond}/{subjid}'
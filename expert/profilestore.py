@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import random
+import secrets
+import zipfile
+
+from pathlib import Path
+from typing import Any, ClassVar, Iterable, Optional
+
+import expert as e
+from . import profile
+
+# Profiles are either stored as one file per profile, in a folder
+# per condition ('files' format), or as one data file per condition,
+# <cond>.pack, holding every profile's serialized data back to back,
+# plus an index, <cond>.idx, with a line per profile giving its
+# subject ID and the offset and size of its data ('packed' format).
+# Packed data files are read through mmap, so loading a profile
+# only slices its record out of the mapping. With the 'virtual'
+# format, nothing is stored but a master seed and the number
+# of profiles per condition: the subject IDs are derived from the
+# master seed, and each profile is made again whenever it is loaded,
+# with the random module seeded from its name.
+
+profile_formats = ['files', 'packed', 'virtual']
+
+pack_suffix = '.pack'
+index_suffix = '.idx'
+virtual_name = 'virtual.json'
+
+# (subjid, serialized data)
+Record = tuple[str, bytes]
+
+
+class ProfileStore:
+    """Profiles stored as one file per profile."""
+
+    packed: ClassVar[bool] = False
+    virtual: ClassVar[bool] = False
+    path: Path
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def reset(self):
+        """Forget anything cached about the stored profiles."""
+        pass
+
+    def conds(self) -> list[str]:
+        with os.scandir(self.path) as it:
+            return [entry.name for entry in it
+                    if entry.name[0] != '.' and entry.is_dir()]
+
+    def subjids(self, cond: str) -> list[str]:
+        with os.scandir(self.path / cond) as it:
+            return [entry.name for entry in it
+                    if entry.name[0] != '.' and entry.is_file()]
+
+    def read(self, cond: str, subjid: str) -> memoryview:
+        with open(self.path / cond / subjid, 'rb') as f:
+            return memoryview(f.read())
+
+    def write(self, cond: str, records: Iterable[Record]):
+        cond_path = self.path / cond
+        cond_path.mkdir(exist_ok=True)
+        for subjid, data in records:
+            with open(cond_path / subjid, 'wb') as f:
+                f.write(data)
+
+    def zip_profiles(self, zf: zipfile.ZipFile, root: str):
+        for cond in self.conds():
+            for subjid in self.subjids(cond):
+                zf.write(self.path / cond / subjid, f'{root}/{cond}/{subjid}')
+                yield
+
+
+class PackedProfileStore(ProfileStore):
+    """Profiles stored as one data file plus index per condition."""
+
+    packed: ClassVar[bool] = True
+    # cond: {subjid: (offset, size)}
+    _index: dict[str, dict[str, tuple[int, int]]]
+    _maps: dict[str, mmap.mmap]
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self._index = {}
+        self._maps = {}
+
+    def reset(self):
+        self._index.clear()
+        # NB: A mapping stays open until any slices of it
+        # that are still around have been released
+        self._maps.clear()
+
+    def conds(self) -> list[str]:
+        with os.scandir(self.path) as it:
+            return [entry.name[:-len(index_suffix)] for entry in it
+                    if entry.name[0] != '.' and
+                    entry.name.endswith(index_suffix) and entry.is_file()]
+
+    def _cond_index(self, cond: str):
+        index = self._index.get(cond)
+        if index is None:
+            index = self._index[cond] = {}
+            with open(self.path / f'{cond}{index_suffix}') as f:
+                for line in f:
+                    subjid, offset, size = line.split()
+                    index[subjid] = (int(offset), int(size))
+        return index
+
+    def subjids(self, cond: str) -> list[str]:
+        return list(self._cond_index(cond))
+
+    def _map(self, cond: str):
+        m = self._maps.get(cond)
+        if m is None:
+            with open(self.path / f'{cond}{pack_suffix}', 'rb') as f:
+                m = self._maps[cond] = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ)
+        return m
+
+    def read(self, cond: str, subjid: str) -> memoryview:
+        offset, size = self._cond_index(cond)[subjid]
+        if not size:
+            # NB: Empty files can't be mapped
+            return memoryview(b'')
+        return memoryview(self._map(cond))[offset:offset + size]
+
+    def write(self, cond: str, records: Iterable[Record]):
+        """Append records to a condition's data file and index."""
+        self.path.mkdir(exist_ok=True)
+        lines: list[str] = []
+        with open(self.path / f'{cond}{pack_suffix}', 'ab') as f:
+            offset = f.tell()
+            for subjid, data in records:
+                f.write(data)
+                lines.append(f'{subjid} {offset} {len(data)}\n')
+                offset += len(data)
+        # NB: The index is only extended once the data is in place
+        with open(self.path / f'{cond}{index_suffix}', 'a') as f:
+            f.writelines(lines)
+        # the data file may have grown past the end of the mapping
+        self._index.pop(cond, None)
+        self._maps.pop(cond, None)
+
+    def zip_profiles(self, zf: zipfile.ZipFile, root: str):
+        # NB: The download has the same layout as with the files format
+        for cond in self.conds():
+            for subjid in self.subjids(cond):
+                zf.writestr(f'{root}/{cond}/{subjid}',
+                            self.read(cond, subjid).tobytes())
+                yield
+
+
+class VirtualProfileStore(ProfileStore):
+    """Profiles made again from their seeds whenever they are loaded."""
+
+    virtual: ClassVar[bool] = True
+    # {'seed', 'subjid_length', 'subjid_symbols', 'conds': {cond: count}}
+    _spec: Optional[dict[str, Any]]
+    # cond: subject IDs
+    _subjids: dict[str, list[str]]
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self._spec = None
+        self._subjids = {}
+
+    def reset(self):
+        self._spec = None
+        self._subjids.clear()
+
+    def _get_spec(self):
+        if self._spec is None:
+            try:
+                with open(self.path / virtual_name) as f:
+                    self._spec = json.load(f)
+            except FileNotFoundError:
+                return None
+        return self._spec
+
+    def create(self, counts: dict[str, int]):
+        """Start a new set of profiles with a new master seed."""
+        self.reset()
+        spec = {
+            'seed': secrets.randbits(64),
+            'subjid_length': e.experclass.cfg['subjid_length'],
+            'subjid_symbols': e.experclass.cfg['subjid_symbols'],
+            'conds': counts
+        }
+        self.path.mkdir(exist_ok=True)
+        with open(self.path / virtual_name, 'w') as f:
+            json.dump(spec, f, indent=2)
+
+    def conds(self) -> list[str]:
+        spec = self._get_spec()
+        return list(spec['conds']) if spec else []
+
+    def subjids(self, cond: str) -> list[str]:
+        if not self._subjids:
+            spec = self._get_spec()
+            assert spec is not None
+            # NB: Every condition's IDs come from the same stream,
+            # so they are unique across conditions
+            rng = random.Random(spec['seed'])
+            registry = profile.SubjidRegistry()
+            for cname, count in spec['conds'].items():
+                self._subjids[cname] = registry.generate(
+                    count, rng, spec['subjid_length'], spec['subjid_symbols'])
+        return self._subjids[cond]
+
+    def seed_of(self, cond: str, subjid: str) -> str:
+        spec = self._get_spec()
+        assert spec is not None
+        return f'{spec["seed"]}/{cond}/{subjid}'
+
+    def read(self, cond: str, subjid: str) -> memoryview:
+        return memoryview(profile.regenerate(cond, subjid).save_data() or b'')
+
+    def write(self, cond: str, records: Iterable[Record]):
+        # there is nothing to store
+        pass
+
+    def zip_profiles(self, zf: zipfile.ZipFile, root: str):
+        zf.write(self.path / virtual_name, f'{root}/{virtual_name}')
+        yield
+        # NB: Profiles can only be expanded if they can be serialized
+        if e.experclass.profile_mod().Profile.save_data is \
+           profile.Profile.save_data:
+            return
+        for cond in self.conds():
+            for subjid in self.subjids(cond):
+                zf.writestr(f'{root}/{cond}/{subjid}',
+                            self.read(cond, subjid).tobytes())
+                yield
+
+
+def open_store(path: Path, fmt: str) -> ProfileStore:
+    if fmt == 'packed':
+        return PackedProfileStore(path)
+    elif fmt == 'virtual':
+        return VirtualProfileStore(path)
+    return ProfileStore(path)
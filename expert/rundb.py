@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import csv
+import json
+import sqlite3
+
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import strictyaml
+
+import expert as e
+from . import writer
+
+# With the 'sqlite' output format, all runs of a bundle are stored
+# in a single database in the runs folder, rather than as a tree
+# of per-subject files. Responses are written as they arrive, so
+# the database also plays the role of the response journal.
+
+db_name = 'runs.sqlite'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    replicate TEXT
+);
+CREATE TABLE IF NOT EXISTS instances (
+    run TEXT NOT NULL,
+    sid TEXT NOT NULL,
+    cond TEXT NOT NULL,
+    prof TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (run, sid)
+);
+CREATE INDEX IF NOT EXISTS instances_cond ON instances (run, cond, state);
+CREATE INDEX IF NOT EXISTS instances_prof ON instances (run, prof);
+CREATE INDEX IF NOT EXISTS instances_sid ON instances (sid);
+CREATE TABLE IF NOT EXISTS responses (
+    run TEXT NOT NULL,
+    sid TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    task TEXT NOT NULL,
+    resp TEXT,
+    extra TEXT NOT NULL,
+    PRIMARY KEY (run, sid, seq)
+);
+CREATE TABLE IF NOT EXISTS pii (
+    run TEXT NOT NULL,
+    sid TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    val TEXT,
+    PRIMARY KEY (run, sid, seq)
+);
+'''
+
+upsert_response = '''
+INSERT OR REPLACE INTO responses (run, sid, seq, time, task, resp, extra)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+incomplete_states = ['TIMED_OUT', 'TERMINATED', 'RETURNED']
+
+# row as stored: (seq, time, task, resp, extra)
+ResponseRow = tuple[int, str, str, Any, dict[str, Any]]
+
+
+def connect(path: Path):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+
+def _encode(row: ResponseRow):
+    seq, ts, task, resp, extra = row
+    return (seq, ts, task, json.dumps(resp), json.dumps(extra))
+
+
+class RunDB:
+    """Database holding the runs, instances, responses and PII
+    of a bundle.
+
+    Writes are submitted to the server's write queue; reads use
+    a separate connection, which WAL mode allows to proceed
+    while the writer is busy.
+    """
+
+    path: Path
+    _conn: sqlite3.Connection
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn = connect(path)
+        self._conn.executescript(schema)
+
+    def close(self):
+        self._conn.close()
+
+    def _submit(self, *statements: tuple[str, tuple[Any, ...]]):
+        e.srv.writer.submit(writer.DBWrite(self.path, list(statements)))
+
+    def save_run(self, run: str, replicate: Optional[str]):
+        self._submit(('INSERT OR REPLACE INTO runs (id, replicate)' +
+                      ' VALUES (?, ?)', (run, replicate)))
+
+    def begin_instance(self, run: str, sid: str, cond: str, prof: str,
+                       rows: list[ResponseRow]):
+        self._submit(
+            ('INSERT OR REPLACE INTO instances (run, sid, cond, prof, state)' +
+             ' VALUES (?, ?, ?, ?, ?)', (run, sid, cond, prof, 'ACTIVE')),
+            *[(upsert_response, (run, sid) + _encode(row)) for row in rows])
+
+    def save_response(self, run: str, sid: str, row: ResponseRow):
+        self._submit((upsert_response, (run, sid) + _encode(row)))
+
+    def end_instance(self, run: str, sid: str, state: str,
+                     rows: list[ResponseRow]):
+        self._submit(
+            ('UPDATE instances SET state = ? WHERE run = ? AND sid = ?',
+             (state, run, sid)),
+            ('DELETE FROM responses WHERE run = ? AND sid = ?', (run, sid)),
+            *[(upsert_response, (run, sid) + _encode(row)) for row in rows])
+
+    def save_pii(self, run: str, sid: str, pii: list[tuple[str, Any]]):
+        self._submit(
+            ('DELETE FROM pii WHERE run = ? AND sid = ?', (run, sid)),
+            *[('INSERT INTO pii (run, sid, seq, key, val) VALUES (?, ?, ?, ?, ?)',
+               (run, sid, i, key, json.dumps(val)))
+              for i, (key, val) in enumerate(pii)])
+
+    def delete_pii(self, run: str):
+        self._submit(('DELETE FROM pii WHERE run = ?', (run,)))
+
+    def run_exists(self, run: str):
+        return self._conn.execute(
+            'SELECT 1 FROM runs WHERE id = ?', (run,)).fetchone() is not None
+
+    def replicate_of(self, run: str) -> Optional[str]:
+        row = self._conn.execute(
+            'SELECT replicate FROM runs WHERE id = ?', (run,)).fetchone()
+        return row[0] if row else None
+
+    def runs(self):
+        counts = {
+            run: {'id': run, 'num_complete': 0,
+                  'num_incomplete': 0, 'has_pii': False}
+            for run, in self._conn.execute('SELECT id FROM runs')}
+        for run, state, n in self._conn.execute(
+                'SELECT run, state, count(*) FROM instances' +
+                ' GROUP BY run, state'):
+            if run not in counts:
+                continue
+            if state == 'COMPLETE':
+                counts[run]['num_complete'] += n
+            elif state in incomplete_states:
+                counts[run]['num_incomplete'] += n
+        for run, in self._conn.execute('SELECT DISTINCT run FROM pii'):
+            if run in counts:
+                counts[run]['has_pii'] = True
+        return list(counts.values())
+
+    def completed_profiles(self, run: str) -> list[str]:
+        return [f'{cond}/{prof}' for cond, prof in self._conn.execute(
+            'SELECT cond, prof FROM instances' +
+            ' WHERE run = ? AND state = ?', (run, 'COMPLETE'))]
+
+    def responses(self, run: str) -> Iterator[
+            tuple[str, str, str, str, str, Any, dict[str, Any]]]:
+        """Yield (sid, cond, prof, time, task, resp, extra) for every
+        response in a run, ordered by condition, then SID."""
+        for sid, cond, prof, ts, task, resp, extra in self._conn.execute(
+                'SELECT i.sid, i.cond, i.prof, r.time, r.task, r.resp, r.extra' +
+                ' FROM instances i JOIN responses r' +
+                ' ON r.run = i.run AND r.sid = i.sid' +
+                ' WHERE i.run = ? ORDER BY i.cond, i.sid, r.seq', (run,)):
+            yield sid, cond, prof, ts, task, json.loads(resp), json.loads(extra)
+
+    def response_sids(self, run: str) -> list[str]:
+        return [sid for sid, in self._conn.execute(
+            'SELECT sid FROM instances WHERE run = ?', (run,))]
+
+    def response_extras(self, run: str) -> list[str]:
+        """Names of all the extra response fields in a run."""
+        return [key for key, in self._conn.execute(
+            'SELECT DISTINCT j.key FROM responses r, json_each(r.extra) j' +
+            ' WHERE r.run = ?', (run,))]
+
+    def pii(self, run: str) -> dict[str, list[dict[str, Any]]]:
+        by_sid: dict[str, list[dict[str, Any]]] = {}
+        for sid, key, val in self._conn.execute(
+                'SELECT sid, key, val FROM pii WHERE run = ?' +
+                ' ORDER BY sid, seq', (run,)):
+            by_sid.setdefault(sid, []).append(
+                {'key': key, 'val': json.loads(val)})
+        return by_sid
+
+    def import_run(self, run_path: Path, fmt: str):
+        """Import a run directory written in the 'csv' or 'json'
+        output format.
+
+        NB: This writes directly rather than through the write queue,
+        so it must not be used while the server is writing to
+        the same database.
+        """
+        # avoid a circular import
+        from .experiment import resp_file_suffixes, special_run_dirs
+
+        run = run_path.name
+        replicate = None
+        md_path = run_path / 'metadata'
+        if md_path.is_file():
+            md_schema = strictyaml.Map({
+                'replicate': strictyaml.EmptyNone() | strictyaml.Str(),
+            })
+            with open(md_path) as f:
+                replicate = strictyaml.load(f.read(), md_schema).data.get(
+                    'replicate')
+        suffix_states = {sfx: state.name
+                         for state, sfx in resp_file_suffixes.items()}
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO runs (id, replicate) VALUES (?, ?)',
+                (run, replicate))
+            for cond_path in sorted(run_path.iterdir()):
+                if cond_path.name in special_run_dirs or \
+                   not cond_path.is_dir() or cond_path.stem[0] == '.':
+                    continue
+                for resp_path in sorted(cond_path.iterdir()):
+                    if resp_path.stem[0] == '.' or not resp_path.is_file():
+                        continue
+                    prof, state = resp_path.name, 'COMPLETE'
+                    for sfx, sfx_state in suffix_states.items():
+                        if prof.endswith(sfx):
+                            prof, state = prof[:-len(sfx)], sfx_state
+                            break
+                    rows = list(_read_resp_file(resp_path, fmt))
+                    if not rows:
+                        continue
+                    # the SID pseudo-response always comes first
+                    sid = rows[0][3]
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO instances' +
+                        ' (run, sid, cond, prof, state) VALUES (?, ?, ?, ?, ?)',
+                        (run, sid, cond_path.name, prof, state))
+                    self._conn.executemany(
+                        upsert_response,
+                        [(run, sid) + _encode(row) for row in rows])
+            id_mapping_path = run_path / 'id-mapping'
+            if id_mapping_path.is_dir():
+                for pii_path in id_mapping_path.iterdir():
+                    if pii_path.stem[0] == '.' or not pii_path.is_file():
+                        continue
+                    with open(pii_path) as f:
+                        items = json.load(f)
+                    self._conn.executemany(
+                        'INSERT OR REPLACE INTO pii (run, sid, seq, key, val)' +
+                        ' VALUES (?, ?, ?, ?, ?)',
+                        [(run, pii_path.name, i, item['key'],
+                          json.dumps(item['val']))
+                         for i, item in enumerate(items)])
+
+
+def _read_resp_file(path: Path, fmt: str) -> Iterator[ResponseRow]:
+    if fmt == 'csv':
+        with open(path, newline='') as f:
+            reader = csv.reader(f, lineterminator='\n')
+            headers = next(reader)
+            for i, row in enumerate(reader):
+                yield (i, row[0], row[1], row[2],
+                       dict(zip(headers[3:], row[3:])))
+    else:
+        with open(path) as f:
+            items = json.load(f)
+        for i, item in enumerate(items):
+            extra = item.copy()
+            ts = extra.pop('time')
+            task = extra.pop('task')
+            resp = extra.pop('resp', None)
+            yield i, ts, task, resp, extra
@@ -1,5 +1,6 @@
 
 import argparse
+import atexit
 import importlib
 import importlib.util
 import json
@@ -26,7 +27,7 @@ from flask_socketio import SocketIO
 
 import expert as e
 
-from . import experiment, exper, tool, dashboard, templates, user
+from . import experiment, exper, tool, dashboard, templates, user, writer
 
 
 class BundleLoadError(Exception):
@@ -58,6 +59,7 @@ class Server:
     bundles_path: Path
     socketio: SocketIO
     dboard: dashboard.Dashboard
+    writer: writer.Writer
     logfile: str
     session_manager: Optional[user.SessionManager] = None
 
@@ -106,6 +108,12 @@ class Server:
 
         templates.set_server_variables(self)
 
+        self.writer = writer.Writer(
+            self.cfg['write_queue_size'], self.cfg['fsync_policy'],
+            self.cfg['write_batch_max'])
+        # make sure nothing queued is lost when the process exits
+        atexit.register(self.writer.close)
+
         self._init_socketio()
 
         self.dboard = dashboard.Dashboard(self)
@@ -204,6 +212,40 @@ class Server:
         def sio_error(err):
             e.log.error(f'socketio error: {err}')
 
+        # All participants share one namespace; calls are routed
+        # to the instance of the session's SID
+        ns = '/' + self.cfg['url_prefix']
+
+        @self.socketio.on('connect', namespace=ns)
+        def sio_inst_connect(auth=None):
+            inst = self._sio_inst()
+            if not inst:
+                return False
+            e.experclass.instances.socket_connected(inst.sid, request.sid)
+
+        @self.socketio.on('disconnect', namespace=ns)
+        def sio_inst_disconnect(*args):
+            sid = session.get('sid')
+            if e.experclass and isinstance(sid, str):
+                e.experclass.instances.socket_disconnected(sid, request.sid)
+
+        @self.socketio.on('call_api', namespace=ns)
+        def sio_inst_call(cmd: str, *args: list[Any]):
+            inst = self._sio_inst()
+            if not inst:
+                return {'err': 'no session'}
+            return inst.call_api(cmd, *args)
+
+        @self.socketio.on_error(ns)
+        def sio_inst_error(err):
+            e.log.error(f'socketio error:\n{traceback.format_exc()}')
+
+    def _sio_inst(self) -> Optional[experiment.BaseExper]:
+        sid = session.get('sid')
+        if not e.experclass or not isinstance(sid, str):
+            return None
+        return e.experclass.get_inst(sid)
+
     def _add_routes(self):
         first_request_setup_complete = False
 
@@ -286,7 +328,7 @@ class Server:
                 if not (isinstance(sid, str) or sid is None):
                     e.log.warn('found SID with invalid type')
                     sid = None
-                inst = e.experclass.instances.get(sid)
+                inst = e.experclass.get_inst(sid)
                 if not inst:
                     if e.experclass.running:
                         # XXX But the sid doesn't get stored in the cookie session
@@ -409,6 +451,7 @@ class Server:
                 and not p.stem.startswith('.')]
 
     def unload_bundle(self):
+        self.writer.flush()
         for m in e.bundle_mods:
             qualmod = f'{e.bundle_name}.{m}'
             if qualmod in sys.modules:
@@ -417,9 +460,10 @@ class Server:
         if e.bundle_name in sys.modules:
             e.log.info(f'unloading module {e.bundle_name}')
             del sys.modules[e.bundle_name]
-            # NB: instances is an attribute of BaseExper that experclass
-            # mutates
-            experiment.BaseExper.instances.clear()
+            # NB: instances (and the spill bookkeeping) are attributes
+            # of BaseExper that experclass mutates
+            if e.experclass:
+                e.experclass.clear_instances()
         e.bundle_name = None
         e.bundle_mods = []
         e.experclass = None
@@ -0,0 +1,27 @@
+import gc
+import sys
+import types
+
+from typing import Any
+
+# objects shared between instances, which shouldn't count
+# towards the size of any one of them
+_shared_types = (
+    type, types.ModuleType, types.FunctionType, types.MethodType,
+    types.BuiltinFunctionType, types.CodeType
+)
+
+
+def deep_sizeof(obj: Any) -> int:
+    """Approximate memory used by obj and everything it refers to."""
+    seen: set[int] = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        o = pending.pop()
+        if id(o) in seen or isinstance(o, _shared_types):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        pending.extend(gc.get_referents(o))
+    return size
@@ -3,10 +3,12 @@ import { V as View, e as elt, D as Dialog, C as Controller, a as ConfirmDialog,
 class InstList extends View {
     cols;
     cellClasses;
-    numRows;
     numCols;
+    filters = {};
+    oldestSeq = null;
     _eventSeps;
     _sepText;
+    _timing = new Map();
     constructor(ctrlr) {
         super(elt('inst-data'), ctrlr);
         this.cols = [
@@ -17,7 +19,6 @@ class InstList extends View {
             'dboard-profile', 'dboard-state', 'dboard-task',
             'dboard-started', 'dboard-elapsed'
         ];
-        this.numRows = 0;
         this.numCols = this.cellClasses.length;
         this._eventSeps = {
             new_run: 'start',
@@ -38,25 +39,26 @@ class InstList extends View {
             reload: bundle => `Bundle '${bundle}' reloaded`,
             profiles: () => 'Profiles rebuilt',
             unload: bundle => `Bundle '${bundle}' unloaded`,
+            unknown: () => 'UNKNOWN EVENT',
             error: (tback, div) => {
                 div.addEventListener('click', async () => await this.ctrlr.tracebackDlg.show(tback));
                 return 'Error';
             }
         };
     }
-    newRow() {
+    newRow(seq, row, parent = this.node) {
         const divs = [];
         for (let i = 0; i < this.numCols; i++) {
             divs.push(document.createElement('div'));
-            this.node.append(divs[i]);
+            parent.append(divs[i]);
             divs[i].classList.add(this.cellClasses[i], 'dboard-item');
         }
-        divs[0].textContent = `${this.numRows + 1}`;
-        divs[1].dataset.index = `${this.numRows++}`;
-        return divs;
+        divs[0].textContent = `${row + 1}`;
+        divs[1].dataset.seq = `${seq}`;
+        return divs.slice(1);
     }
-    getRow(index) {
-        const indexDiv = this.node.querySelector(`div[data-index="${index}"]`);
+    getRow(seq) {
+        const indexDiv = this.node.querySelector(`div[data-seq="${seq}"]`);
         if (indexDiv) {
             const divs = [indexDiv];
             for (let i = 2; i < this.numCols; i++) {
@@ -66,45 +68,104 @@ class InstList extends View {
         }
         return [];
     }
-    setRow(index, fields) {
-        this.cols.map(name => fields[name]);
-        const divs = this.getRow(index);
+    setRow(seq, fields) {
+        const divs = this.getRow(seq);
+        if (divs.length) {
+            this._setCells(seq, divs, fields);
+        }
+    }
+    _setCells(seq, divs, fields) {
         for (const [k, v] of Object.entries(fields)) {
             const i = this.cols.indexOf(k);
-            divs[i].textContent = v;
+            if (i >= 0) {
+                divs[i].textContent = v;
+            }
+        }
+        if (fields.elapsed_secs !== undefined) {
+            this._timing.set(seq, {
+                start: Date.now() - fields.elapsed_secs * 1000,
+                div: divs[this.cols.indexOf('elapsed')]
+            });
+        }
+        else if (fields.state && fields.state !== 'ACTIVE') {
+            this._timing.delete(seq);
+        }
+    }
+    tickElapsed() {
+        const now = Date.now();
+        for (const { start, div } of this._timing.values()) {
+            const secs = Math.floor((now - start) / 1000);
+            const mins = String(Math.floor(secs / 60)).padStart(2, '0');
+            div.textContent = `${mins}:${String(secs % 60).padStart(2, '0')}`;
         }
     }
-    addInst(inst) {
-        this.newRow();
-        this.setRow(this.numRows - 1, inst);
+    addItem(item) {
+        if (this.matches(item)) {
+            this._addItem(item, this.node);
+        }
     }
-    addSeparator(sepType, data) {
+    _addItem(item, parent) {
+        if (item.tag === 'inst') {
+            const divs = this.newRow(item.seq, item.row, parent);
+            this._setCells(item.seq, divs, item.data);
+        }
+        else {
+            this.addSeparator(this._eventSeps[item.tag] ?? 'unknown', item.data, parent);
+        }
+    }
+    addSeparator(sepType, data, parent = this.node) {
         const div = document.createElement('div');
         div.textContent = this._sepText[sepType](data, div);
         div.className = `dboard-${sepType}-sep`;
-        this.node.append(div);
+        parent.append(div);
+    }
+    matches(item) {
+        const f = this.filters;
+        if (f.tag && !f.tag.includes(item.tag)) {
+            return false;
+        }
+        if (!(f.state || f.cond || f.profile || f.sid)) {
+            return true;
+        }
+        if (item.tag !== 'inst') {
+            return false;
+        }
+        const inst = item.data;
+        const profile = inst.profile.split(' ')[0];
+        const [cond, subjid] = profile.split('/');
+        return (!f.state || inst.state === f.state) &&
+            (!f.cond || cond === f.cond) &&
+            (!f.profile || f.profile === profile || f.profile === subjid) &&
+            (!f.sid || inst.sid.startsWith(f.sid.slice(0, inst.sid.length)));
     }
     clear() {
         this.node.replaceChildren();
-        this.numRows = 0;
-    }
-    update(items) {
-        for (let i = 0; i < items.length; i++) {
-            const item = items[i];
-            if (item.tag === 'inst') {
-                this.newRow();
-                this.setRow(this.numRows - 1, item.data);
-            }
-            else {
-                const sepType = this._eventSeps[item.tag];
-                if (sepType) {
-                    this.addSeparator(sepType, item.data);
-                }
-                else {
-                    this.addSeparator('unknown', 'UNKNOWN EVENT');
-                }
-            }
+        this.oldestSeq = null;
+        this._timing.clear();
+    }
+    update(items, more) {
+        this.clear();
+        for (const item of items) {
+            this._addItem(item, this.node);
+        }
+        this._setOldest(items, more);
+    }
+    prepend(items, more) {
+        const frag = document.createDocumentFragment();
+        for (const item of items) {
+            this._addItem(item, frag);
         }
+        const scroller = this.node.parentElement;
+        const height = scroller.scrollHeight;
+        this.node.prepend(frag);
+        scroller.scrollTop += scroller.scrollHeight - height;
+        this._setOldest(items, more);
+    }
+    _setOldest(items, more) {
+        if (items.length) {
+            this.oldestSeq = items[0].seq;
+        }
+        elt('load-earlier-btn').hidden = !more;
     }
 }
 
@@ -400,6 +461,10 @@ var cfg = {
 	simultaneous_chunk_uploads: simultaneous_chunk_uploads
 };
 
+const statusPollMs = 15000;
+// number of the slowest participant API commands shown
+const slowestCmdsShown = 4;
+const elapsedTickMs = 1000;
 class APIError extends Error {
 }
 class Dashboard extends Controller {
@@ -418,6 +483,7 @@ class Dashboard extends Controller {
     vars;
     instList;
     uploader = new Uploader(this);
+    _statusTimer = null;
     constructor() {
         super();
         const btns = {
@@ -426,6 +492,7 @@ class Dashboard extends Controller {
             'new-run': async () => await this.newRun(),
             'reload': async () => await this.reloadBundle(),
             'profiles': async () => await this.rebuildProfiles(),
+            'compact': async () => await this.compactResponses(),
             'download': async () => {
                 const ok = await this.runsDlg.show('Download Results', 'Download');
                 if (ok) {
@@ -466,30 +533,35 @@ class Dashboard extends Controller {
     }
     _initSocket(ns) {
         super._initSocket(ns);
-        this._socket.on('new_instance', (inst) => this.instList.addInst(inst));
-        this._socket.on('update_instance', (index, inst) => {
-            this.instList.setRow(index, inst);
-            if (inst.state === 'COMPLETE') {
-                this.completed++;
+        this._socket.on('new_instance', (item) => this.instList.addItem(item));
+        this._socket.on('update_instances', (changes) => {
+            let completed = 0;
+            for (const [seq, fields] of changes) {
+                this.instList.setRow(seq, fields);
+                if (fields.state === 'COMPLETE') {
+                    completed++;
+                }
+            }
+            if (completed) {
+                this.completed += completed;
                 this.updateRunInfo();
             }
         });
-        this._socket.on('update_active_instances', (insts) => {
-            for (const [index, inst] of insts) {
-                this.instList.setRow(index, inst);
-            }
+        this._socket.on('profiles_progress', (made, total) => {
+            elt('pool-info').textContent =
+                `creating profiles: ${made}/${total}`;
         });
         this._socket.on('run_complete', () => {
-            this.instList.addSeparator('end', this.run);
+            this.instList.addItem({ tag: 'run_complete', data: this.run });
             this.run = null;
             this.completed = 0;
             this.updateRunInfo();
         });
         this._socket.on('page_load_error', (tback) => {
-            this.instList.addSeparator('error', tback);
+            this.instList.addItem({ tag: 'page_load_error', data: tback });
         });
         this._socket.on('api_error', (tback) => {
-            this.instList.addSeparator('error', tback);
+            this.instList.addItem({ tag: 'api_error', data: tback });
         });
     }
     async _initViews() {
@@ -504,6 +576,15 @@ class Dashboard extends Controller {
         this.confirmDlg = await new ConfirmDialog(this).init();
         this.msgDlg = await new MessageDialog(this).init();
         this.instList = new InstList(this);
+        window.setInterval(() => this.instList.tickElapsed(), elapsedTickMs);
+        elt('load-earlier-btn').addEventListener('click', async () => await this.loadEarlierEvents());
+        elt('filter-btn').addEventListener('click', async () => await this.filterEvents(this.readFilters()));
+        elt('filter-clear-btn').addEventListener('click', async () => {
+            for (const input of elt('inst-filters').querySelectorAll('input, select')) {
+                input.value = '';
+            }
+            await this.filterEvents({});
+        });
         for (const [name, info] of Object.entries(this.toolbarBtns)) {
             info.element.addEventListener('click', async () => {
                 info.element.disabled = true;
@@ -523,7 +604,7 @@ class Dashboard extends Controller {
         if (!this._didInitViews) {
             await this._initViews();
         }
-        const data = await this.api('dboard_init');
+        const data = await this.api('dboard_init', [this.instList.filters]);
         if (this.vars &&
             this.vars['exp_version'] !== data.vars['exp_version']) {
             await this.errorOverlay.makeVisible();
@@ -531,11 +612,14 @@ class Dashboard extends Controller {
         this.vars = data.vars;
         this.bundle = this.vars['exp_app_name'];
         this._onBundleUpdate();
-        this.instList.clear();
-        this.instList.update(data.list_items);
+        this.instList.update(data.list_items, data.more_items);
         this.run = data.run_info.run;
         this.completed = this.vars['exp_completed_profiles'];
         this.updateRunInfo();
+        await this.updateStatus();
+        if (this._statusTimer === null) {
+            this._statusTimer = window.setInterval(() => this.updateStatus(), statusPollMs);
+        }
         console.log(`initializing; bundle: ${this.vars['exp_app_name']};` +
             ` run: ${this.run}`);
     }
@@ -547,6 +631,12 @@ class Dashboard extends Controller {
         this.toolbarBtns['load'].element.disabled = true;
         this.toolbarBtns['download-log'].element.disabled = true;
         this._onBundleUpdate();
+        if (this._statusTimer !== null) {
+            window.clearInterval(this._statusTimer);
+            this._statusTimer = null;
+        }
+        elt('pool-info').textContent = '';
+        elt('mem-info').textContent = '';
     }
     async api(cmd, params = [], showTraceback = true) {
         try {
@@ -571,12 +661,16 @@ class Dashboard extends Controller {
             btns.forEach(name => {
                 this.toolbarBtns[name].element.disabled = false;
             });
+            // only tool mode sessions last long enough to need it
+            this.toolbarBtns['compact'].element.disabled =
+                !this.vars['exp_tool_mode'];
         }
         else {
             elt('bundle-name').textContent = '<None>';
             btns.forEach(name => {
                 this.toolbarBtns[name].element.disabled = true;
             });
+            this.toolbarBtns['compact'].element.disabled = true;
         }
     }
     async loadBundle() {
@@ -593,11 +687,11 @@ class Dashboard extends Controller {
                 if (tback) {
                     await this.tracebackDlg.show(tback);
                     if (this.bundle) {
-                        this.instList.addSeparator('unload', this.bundle);
+                        this.instList.addItem({ tag: 'bundle_unload', data: this.bundle });
                     }
                 }
                 else {
-                    this.instList.addSeparator('load', this.bundlesDlg.bundle);
+                    this.instList.addItem({ tag: 'bundle_load', data: this.bundlesDlg.bundle });
                 }
                 this.vars = vars;
                 this.bundle = vars['exp_app_name'];
@@ -615,7 +709,7 @@ class Dashboard extends Controller {
                 this.run = info.run;
                 this.completed = 0;
                 this.updateRunInfo();
-                this.instList.addSeparator('start', this.run);
+                this.instList.addItem({ tag: 'new_run', data: this.run });
             }
             else {
                 await this.tracebackDlg.show(err);
@@ -624,7 +718,7 @@ class Dashboard extends Controller {
     }
     async stopRun() {
         await this.api('stop_run');
-        this.instList.addSeparator('stop', this.run);
+        this.instList.addItem({ tag: 'run_stop', data: this.run });
         this.run = null;
         this.completed = 0;
         this.updateRunInfo();
@@ -636,11 +730,11 @@ class Dashboard extends Controller {
             }
             const { vars, err } = await this.api('reload_bundle', [toolMode]);
             if (!err) {
-                this.instList.addSeparator('reload', this.bundle);
+                this.instList.addItem({ tag: 'bundle_reload', data: this.bundle });
             }
             else {
                 await this.tracebackDlg.show(err);
-                this.instList.addSeparator('unload', this.bundle);
+                this.instList.addItem({ tag: 'bundle_unload', data: this.bundle });
                 this.bundle = null;
                 this._onBundleUpdate();
             }
@@ -652,7 +746,7 @@ class Dashboard extends Controller {
     }
     async unloadBundle() {
         this.vars = (await this.api('unload_bundle')).vars;
-        this.instList.addSeparator('unload', this.bundle);
+        this.instList.addItem({ tag: 'bundle_unload', data: this.bundle });
         this.bundle = null;
         this._onBundleUpdate();
     }
@@ -663,11 +757,12 @@ class Dashboard extends Controller {
             }
             const { vars, err } = await this.api('rebuild_profiles');
             if (!err) {
-                this.instList.addSeparator('profiles');
+                this.instList.addItem({ tag: 'profiles_rebuild', data: '' });
+                await this.updatePoolInfo();
             }
             else {
                 await this.tracebackDlg.show(err);
-                this.instList.addSeparator('unload', this.bundle);
+                this.instList.addItem({ tag: 'bundle_unload', data: this.bundle });
                 this.bundle = null;
                 this._onBundleUpdate();
             }
@@ -677,6 +772,10 @@ class Dashboard extends Controller {
             return true;
         }
     }
+    async compactResponses() {
+        // write out the journaled responses of all active sessions
+        await this.api('compact_responses');
+    }
     download(what, run = null) {
         const anchor = document.createElement('a');
         anchor.href = `${this.vars['exp_dashboard_path']}/download/${what}`;
@@ -689,6 +788,34 @@ class Dashboard extends Controller {
         anchor.click();
         document.body.removeChild(anchor);
     }
+    readFilters() {
+        const value = (name) => elt(`filter-${name}`).value.trim();
+        const filters = {};
+        if (value('tag')) {
+            filters.tag = value('tag').split(',');
+        }
+        for (const name of ['state', 'cond', 'profile', 'sid']) {
+            if (value(name)) {
+                filters[name] = value(name);
+            }
+        }
+        if (value('since')) {
+            filters.since = Date.parse(value('since')) / 1000;
+        }
+        return filters;
+    }
+    async filterEvents(filters) {
+        const { items, more } = await this.api('get_events', [null, filters]);
+        this.instList.filters = filters;
+        this.instList.update(items, more);
+    }
+    async loadEarlierEvents() {
+        const btn = elt('load-earlier-btn');
+        btn.disabled = true;
+        const { items, more } = await this.api('get_events', [this.instList.oldestSeq, this.instList.filters]);
+        this.instList.prepend(items, more);
+        btn.disabled = false;
+    }
     updateRunInfo() {
         const runInfo = elt('run-info');
         if (this.run) {
@@ -698,6 +825,49 @@ class Dashboard extends Controller {
             runInfo.textContent = '<None>';
         }
     }
+    async updateStatus() {
+        await this.updatePoolInfo();
+        await this.updateMemInfo();
+        await this.updateLatencyInfo();
+    }
+    async updatePoolInfo() {
+        const poolInfo = elt('pool-info');
+        const depths = await this.api('profile_pool', [], false);
+        if (!depths || !Object.keys(depths).length) {
+            poolInfo.textContent = '<None>';
+            return;
+        }
+        poolInfo.textContent = Object.entries(depths).map(([cond, d]) => `${cond} ${d.free} free/${d.claimed} out/${d.completed} done`).join(', ');
+    }
+    async updateMemInfo() {
+        const memInfo = elt('mem-info');
+        const usage = await this.api('memory_usage', [], false);
+        if (!usage) {
+            memInfo.textContent = '<None>';
+            return;
+        }
+        const parts = [];
+        for (const [state, u] of Object.entries(usage)) {
+            if (!u.in_memory && !u.spilled) {
+                continue;
+            }
+            let part = `${state} ${u.in_memory}`;
+            if (u.spilled) {
+                part += ` (+${u.spilled} on disk)`;
+            }
+            parts.push(`${part}: ${(u.bytes / 1024).toFixed(1)} KiB`);
+        }
+        memInfo.textContent = parts.length ? parts.join(', ') : '<None>';
+    }
+    async updateLatencyInfo() {
+        const apiInfo = elt('api-info');
+        const { participant } = await this.api('api_latency', [], false);
+        const ms = (t) => t < 10 ? t.toFixed(1) : t.toFixed(0);
+        const slowest = Object.entries(participant)
+            .sort(([, a], [, b]) => b.p95 - a.p95)
+            .slice(0, slowestCmdsShown);
+        apiInfo.textContent = slowest.length ? slowest.map(([cmd, l]) => `${cmd} x${l.count} ${ms(l.p50)}/${ms(l.p95)}/${ms(l.p99)} ms`).join(', ') : '<None>';
+    }
 }
 await new Dashboard().init(cfg.dashboard_code);
 
@@ -4,7 +4,6 @@ import './dialog.js';
 document.getElementById('exp-task-wrapper').scrollTo(0, 0);
 window.scrollTo(0, 0);
 const vars = document.getElementById('exp-vars').dataset;
-const sid = vars.exp_sid;
 let task;
 if ('task_script' in vars) {
     let jspath, taskScript = vars.task_script;
@@ -31,6 +30,6 @@ else {
         }
     }(vars);
 }
-await task.init(sid);
+await task.init(vars.exp_api_ns);
 await task.reset();
 //# sourceMappingURL=task_loader.js.map
@@ -1,8 +1,13 @@
 
 from __future__ import annotations
 
+import weakref
+
+from collections.abc import Mapping, MutableMapping
 from dataclasses import dataclass, field
-from typing import ClassVar, Any, Optional
+from itertools import chain
+from types import MappingProxyType
+from typing import ClassVar, Any, Optional, Iterator, cast
 
 from flask import current_app as app
 
@@ -20,76 +25,126 @@ from . import view, experiment
 # the next task to move to is selected by taking the response
 # from the previous task as an index into the next_tasks list.
 
+# With the 'lazy_tasks' option, then() and then_all() add TaskStub
+# placeholders to the tree instead, each holding the TaskDesc of
+# the task it stands for. A stub gets its ID when it is added,
+# just as a task would, but the task itself is only created once
+# navigation reaches it.
+
+# The template, variables and timeout a task is created with make
+# up its TaskDef. Defs are interned, so participants who are shown
+# the same page share a single one; each Task only holds its place
+# in the tree, plus any variables set on it after creation.
+
 @dataclass(frozen=True)
 class TaskDesc:
     args: list[Any] = field(default_factory=list)
     kwargs: dict[str, Any] = field(default_factory=dict)
 
 
-class Task(view.View):
-
-    template: ClassVar[str] = ''
-
-    inst: e.Experiment
-    sid: str
+@dataclass(frozen=True, eq=False)
+class TaskDef:
     template_name: str
-    variables: dict[str, Any]
-    prev_task: Optional[Task]
-    next_tasks: list[Task]
+    variables: Mapping[str, Any]
     timeout_secs: Optional[int]
-    resp_extra: dict[str, Any]
-    id: int
 
-    @classmethod
-    def new(cls, inst: e.Experiment, *posargs: Any, **kwargs: Any):
-        if isinstance(posargs[0], type) and issubclass(posargs[0], Task):
-            cls = posargs[0]
-            posargs = posargs[1:]
-        else:
-            cls = Task
-        return cls(inst, *posargs, **kwargs)
+    def __reduce__(self):
+        # (mapping proxies can't be pickled; this also re-interns)
+        return (task_def, (self.template_name, dict(self.variables),
+                           self.timeout_secs))
 
-    @classmethod
-    def reify(cls, inst: e.Experiment, desc: TaskDesc):
-        return cls.new(inst, *desc.args, **desc.kwargs)
 
-    def __init__(self, inst: e.Experiment, template: str | None = None, 
-            variables: dict[str, Any] | None = None, timeout_secs: int | None = None):
-        super().__init__(template=template, variables=variables)
-        self.inst = inst
-        self.sid = inst.sid
-        self.variables['task_type'] = self.template_name
-        self.prev_task = None
-        self.next_tasks = []
-        self.timeout_secs = timeout_secs
-        # extra fields to be added to each participant response
-        self.resp_extra = {}
-        self.inst.num_tasks_created += 1
-        # default ID for the very first task;
-        # will get changed if this task becomes one of
-        # 'next_tasks' for another task;
-        # the ID determines the order task results are saved
-        self.id = self.inst.num_tasks_created
-        self.inst.tasks_by_id[self.id] = self
+_task_defs: weakref.WeakValueDictionary[Any, TaskDef] = \
+    weakref.WeakValueDictionary()
+# marks variable values that are keyed by identity
+_unhashable = object()
 
-    def get_feedback(self, response: Any):
-        pass
 
-    def template_filename(self):
-        return 'task_' + super().template_filename()
+def _def_key(val: Any):
+    try:
+        hash(val)
+        # (so, e.g., 1 and True are told apart)
+        return (type(val), val)
+    except TypeError:
+        # NB: The def holds on to the value, so its id can't be reused
+        # while the def is in the table
+        return (_unhashable, id(val))
 
-    def render_vars(self):
-        all_vars = self.inst.variables.copy()
-        all_vars.update(super().render_vars())
+
+def task_def(template_name: str, variables: dict[str, Any],
+             timeout_secs: Optional[int]) -> TaskDef:
+    """Get the shared TaskDef with the given contents."""
+    key = (template_name, timeout_secs,
+           frozenset((name, _def_key(val)) for name, val in variables.items()))
+    tdef = _task_defs.get(key)
+    if tdef is None:
+        tdef = _task_defs[key] = TaskDef(
+            template_name, MappingProxyType(variables), timeout_secs)
+    return tdef
+
+
+class TaskVariables(MutableMapping[str, Any]):
+    """A task's variables: those of its def, overlaid with any
+    set on the task itself."""
+
+    __slots__ = ('_task',)
+
+    def __init__(self, task: Task):
+        self._task = task
+
+    def __getitem__(self, name: str):
+        local = self._task._vars
+        if local and name in local:
+            return local[name]
+        return self._task.taskdef.variables[name]
+
+    def __setitem__(self, name: str, val: Any):
+        if self._task._vars is None:
+            self._task._vars = {}
+        self._task._vars[name] = val
+
+    def __delitem__(self, name: str):
+        # NB: Only variables set on the task can be removed
+        if not self._task._vars:
+            raise KeyError(name)
+        del self._task._vars[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.copy())
+
+    def __len__(self):
+        return len(self.copy())
+
+    def copy(self) -> dict[str, Any]:
+        all_vars = dict(self._task.taskdef.variables)
+        all_vars.update(self._task._vars or {})
         return all_vars
 
+
+class TaskNode:
+    """Common part of tasks and task stubs: their place in the tree."""
+
+    __slots__ = ()
+
+    inst: e.Experiment
+    prev_task: Optional[TaskNode]
+    # NB: A tuple, so that a task with no next tasks
+    # doesn't need a container of its own
+    next_tasks: tuple[TaskNode, ...]
+    id: int
+
     def then(self, *posargs: Any, **kwargs: Any):
-        if isinstance(posargs[0], Task):
+        if isinstance(posargs[0], TaskNode):
             task = posargs[0]
+        elif self.inst.cfg['lazy_tasks']:
+            task = TaskStub(self.inst, TaskDesc(list(posargs), kwargs))
         else:
-            task = self.new(self.inst, *posargs, **kwargs)
+            task = Task.new(self.inst, *posargs, **kwargs)
+        return self._link(task)
+
+    def _link(self, task: TaskNode):
         task.prev_task = self
-        self.next_tasks.append(task)
+        self.next_tasks += (task,)
         if len(self.next_tasks) > 1:
             self.inst.last_task = None
         else:
@@ -101,7 +156,10 @@ class Task(view.View):
         cursor = self
         for task in task_descriptors:
             #if isinstance(task, (list, tuple)):
-            if isinstance(task, TaskDesc):
+            if isinstance(task, TaskDesc) and self.inst.cfg['lazy_tasks']:
+                # (the stub can share the descriptor)
+                cursor = cursor._link(TaskStub(self.inst, task))
+            elif isinstance(task, TaskDesc):
                 cursor = cursor.then(*task.args, **task.kwargs)
                 #if isinstance(task[-1], dict):
                 #    cursor = cursor.then(*task[:-1], **task[-1])
@@ -114,7 +172,161 @@ class Task(view.View):
     def was_added(self):
         pass
 
-    def next_task(self, response: Optional[experiment.TaskResponse] = None) -> Optional[Task]:
+    def __getstate__(self):
+        state = dict(getattr(self, '__dict__', {}))
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name != '__weakref__' and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state: dict[str, Any]):
+        for name, val in state.items():
+            object.__setattr__(self, name, val)
+
+
+class TaskStub(TaskNode):
+    """Placeholder for a task that hasn't been reached yet."""
+
+    # NB: A long experiment may have many stubs per participant
+    __slots__ = ('inst', 'desc', 'prev_task', 'next_tasks', 'id')
+
+    desc: TaskDesc
+
+    def __init__(self, inst: e.Experiment, desc: TaskDesc):
+        self.inst = inst
+        self.desc = desc
+        self.prev_task = None
+        self.next_tasks = ()
+        inst.num_tasks_created += 1
+        self.id = inst.num_tasks_created
+        inst.tasks_by_id[self.id] = self
+        cls = desc.args[0] if desc.args else None
+        if isinstance(cls, type) and issubclass(cls, Task):
+            cls.was_described(inst)
+
+    def reify(self) -> Task:
+        """Create the task, and put it in the stub's place."""
+        # the task takes over the stub's ID
+        self.inst._reify_id = self.id
+        try:
+            task = Task.reify(self.inst, self.desc)
+        finally:
+            self.inst._reify_id = None
+        task.prev_task = self.prev_task
+        task.next_tasks = self.next_tasks
+        for next_task in task.next_tasks:
+            next_task.prev_task = task
+        if self.prev_task:
+            self.prev_task.next_tasks = tuple(
+                task if sibling is self else sibling
+                for sibling in self.prev_task.next_tasks)
+        if self.inst.last_task is self:
+            self.inst.last_task = task
+        task.was_added()
+        return task
+
+
+def reached(task: TaskNode) -> Task:
+    """The task for a node navigation has arrived at."""
+    return task.reify() if isinstance(task, TaskStub) else cast(Task, task)
+
+
+class Task(view.View, TaskNode):
+
+    template: ClassVar[str] = ''
+
+    __slots__ = ('inst', 'prev_task', 'next_tasks', 'id',
+                 'taskdef', '_vars', '_resp_extra')
+
+    taskdef: TaskDef
+    # variables set after the task was created
+    _vars: Optional[dict[str, Any]]
+    _resp_extra: Optional[dict[str, Any]]
+
+    @classmethod
+    def new(cls, inst: e.Experiment, *posargs: Any, **kwargs: Any):
+        if isinstance(posargs[0], type) and issubclass(posargs[0], Task):
+            cls = posargs[0]
+            posargs = posargs[1:]
+        else:
+            cls = Task
+        return cls(inst, *posargs, **kwargs)
+
+    @classmethod
+    def reify(cls, inst: e.Experiment, desc: TaskDesc):
+        return cls.new(inst, *desc.args, **desc.kwargs)
+
+    def __init__(self, inst: e.Experiment, template: str | None = None, 
+            variables: dict[str, Any] | None = None, timeout_secs: int | None = None):
+        # NB: View.__init__() isn't called; the template name
+        # and variables are kept in the def
+        template_name = template or self.template
+        all_vars = variables.copy() if variables else {}
+        all_vars['task_type'] = template_name
+        self.taskdef = task_def(template_name, all_vars, timeout_secs)
+        self._vars = None
+        self._resp_extra = None
+        self.inst = inst
+        self.prev_task = None
+        self.next_tasks = ()
+        if self.inst._reify_id is not None:
+            # standing in for a stub, which already has an ID
+            self.id = self.inst._reify_id
+            self.inst._reify_id = None
+        else:
+            self.inst.num_tasks_created += 1
+            # default ID for the very first task;
+            # will get changed if this task becomes one of
+            # 'next_tasks' for another task;
+            # the ID determines the order task results are saved
+            self.id = self.inst.num_tasks_created
+        self.inst.tasks_by_id[self.id] = self
+
+    @classmethod
+    def was_described(cls, inst: e.Experiment):
+        """Called when a stub for a task of this class is added."""
+        pass
+
+    @property
+    def sid(self):
+        return self.inst.sid
+
+    @property
+    def template_name(self):
+        return self.taskdef.template_name
+
+    @property
+    def timeout_secs(self):
+        return self.taskdef.timeout_secs
+
+    @property
+    def variables(self) -> MutableMapping[str, Any]:
+        return TaskVariables(self)
+
+    @property
+    def resp_extra(self) -> dict[str, Any]:
+        """Extra fields to be added to each participant response."""
+        if self._resp_extra is None:
+            self._resp_extra = {}
+        return self._resp_extra
+
+    @resp_extra.setter
+    def resp_extra(self, resp_extra: dict[str, Any]):
+        self._resp_extra = resp_extra
+
+    def get_feedback(self, response: Any):
+        pass
+
+    def template_filename(self):
+        return 'task_' + super().template_filename()
+
+    def render_vars(self):
+        all_vars = self.inst.variables.copy()
+        all_vars.update(super().render_vars())
+        return all_vars
+
+    def next_task(self, response: Optional[experiment.TaskResponse] = None) -> Optional[TaskNode]:
         if len(self.next_tasks) > 1:
             # response is an instance of experiment.TaskResponse
             # response.response is by default treated as an index
@@ -124,8 +336,8 @@ class Task(view.View):
         else:
             return self.next_tasks[0]
 
-    def replace_next_task(self, task: Task):
-        self.next_tasks[:] = [task]
+    def replace_next_task(self, task: TaskNode):
+        self.next_tasks = (task,)
 
     def dummy_resp(self):
         return None
@@ -157,6 +369,10 @@ class Consent(NoProgbarTask):
         super().__init__(*args, **kwargs)
         self.inst.has_consent_task = True
 
+    @classmethod
+    def was_described(cls, inst: e.Experiment):
+        inst.has_consent_task = True
+
     def next_task(self, resp):
         if resp == 'consent_declined':
             app.logger.info(f'sid {self.inst.sid[:4]} declined consent')
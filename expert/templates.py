@@ -50,6 +50,8 @@ def set_server_variables(srv: server.Server):
     variables['exp_img'] = f'/{pfx}/img'
     variables['exp_css'] = f'/{pfx}/css'
     variables['exp_js'] = f'/{pfx}/js'
+    # socket.io namespace for participants' API calls
+    variables['exp_api_ns'] = pfx
 
 def set_bundle_variables(experclass: Type[e.Experiment]):
     pfx = e.srv.cfg['url_prefix']
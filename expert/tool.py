@@ -1,21 +1,25 @@
 
-from typing import ClassVar, Type
+from typing import Any, ClassVar, Type
 
 import expert as e
 from .experiment import BaseExper, API
-from .tasks import Task
+from .tasks import TaskNode, reached
+from .commands import command
 
 class ToolAPI(API):
 
+    @command(Any)
     def prev_page(self, resp):
         if self._inst.task.prev_task:
             self._inst.prev_task(resp)
         return self._inst.all_vars()
 
+    @command(str, Any)
     def goto(self, task_label, resp):
         self._inst.go_to(task_label, resp)
         return self._inst.all_vars()
 
+    @command((int, str), Any)
     def goto_id(self, task_id, resp):
         self._inst.go_to_id(task_id, resp)
         return self._inst.all_vars()
@@ -44,6 +48,12 @@ class Tool(BaseExper):
     #         self.go_to_id(task_id, resp)
     #         return self.all_vars()
 
+    @classmethod
+    def compact_all(cls):
+        for inst in cls.all_active():
+            if inst.journal and inst.journal.is_open:
+                inst._save_responses()
+
     def _will_start(self):
         super()._will_start()
         self.variables['exp_nav_items'] = [
@@ -53,13 +63,18 @@ class Tool(BaseExper):
         super()._store_resp(resp)
         self.task.variables['exp_resp'] = resp
 
-    def _nav(self, resp, dest_task: Task):
+    def _nav(self, resp, dest_task: TaskNode):
         self._store_resp(resp)
-        self.task = dest_task
-        self.task_cursor = dest_task.id
+        self.task = reached(dest_task)
+        self.task_cursor = self.task.id
         self._update_vars()
-        #if self.profile:
-        self._save_responses()
+        # NB: With a profile, the response has already been journaled,
+        # and the response file only gets written when the instance
+        # ends or when compaction is requested from the dashboard.
+        # Without one, there is no journal, and the file gets
+        # rewritten on every nav.
+        if not self.profile:
+            self._save_responses()
         e.srv.dboard.inst_updated(self)
 
     def prev_task(self, resp):
@@ -9,6 +9,9 @@ from . import templates
 
 class View:
 
+    # NB: Lets Task instances do without a __dict__
+    __slots__ = ()
+
     template: ClassVar[str] = ''
 
     template_name: str
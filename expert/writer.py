@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import abc
+import os
+import sqlite3
+import traceback
+
+from pathlib import Path
+from typing import Any, Callable, IO, Literal, Optional
+
+from eventlet import patcher, tpool
+
+import expert as e
+
+# NB: The writer must run on a real OS thread, even if the
+# standard library has been monkey-patched by eventlet;
+# otherwise, its blocking file I/O would stall the hub.
+threading = patcher.original('threading')
+queue = patcher.original('queue')
+
+FsyncPolicy = Literal['none', 'per-batch', 'per-write']
+fsync_policies = ['none', 'per-batch', 'per-write']
+
+
+class BadFsyncPolicyError(Exception):
+    def __init__(self, policy: str):
+        super().__init__(f'unknown fsync policy "{policy}"')
+
+
+class WriteOp(abc.ABC):
+
+    path: Path
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    @abc.abstractmethod
+    def apply(self, batch: Batch):
+        ...
+
+
+class Mkdir(WriteOp):
+
+    def apply(self, batch: Batch):
+        self.path.mkdir(parents=True, exist_ok=True)
+
+
+class Append(WriteOp):
+
+    data: str
+
+    def __init__(self, path: Path, data: str):
+        super().__init__(path)
+        self.data = data
+
+    def apply(self, batch: Batch):
+        f = batch.handle(self.path)
+        f.write(self.data)
+        if batch.policy == 'per-write':
+            batch.sync(f)
+
+
+class Replace(WriteOp):
+    """Atomically replace the contents of a file."""
+
+    data: str | bytes
+
+    def __init__(self, path: Path, data: str | bytes):
+        super().__init__(path)
+        self.data = data
+
+    def apply(self, batch: Batch):
+        batch.close(self.path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f'.{self.path.name}.tmp')
+        # newline='' must be set for csv output
+        with (open(tmp_path, 'wb') if isinstance(self.data, bytes)
+              else open(tmp_path, 'w', newline='')) as f:
+            f.write(self.data)
+            if batch.policy != 'none':
+                # the data must be on disk before the rename,
+                # or a crash could leave an empty file behind
+                batch.sync(f)
+        os.replace(tmp_path, self.path)
+
+
+class Delete(WriteOp):
+
+    def apply(self, batch: Batch):
+        batch.close(self.path)
+        self.path.unlink(missing_ok=True)
+
+
+class DBWrite(WriteOp):
+    """Execute a sequence of SQL statements against an SQLite database."""
+
+    statements: list[tuple[str, tuple[Any, ...]]]
+
+    def __init__(self, path: Path, statements: list[tuple[str, tuple[Any, ...]]]):
+        super().__init__(path)
+        self.statements = statements
+
+    def apply(self, batch: Batch):
+        conn = batch.db(self.path)
+        for sql, params in self.statements:
+            conn.execute(sql, params)
+        if batch.policy == 'per-write':
+            conn.commit()
+
+
+class Barrier(WriteOp):
+
+    def __init__(self):
+        self.done = threading.Event()
+
+    def apply(self, batch: Batch):
+        # everything queued before the barrier is committed first
+        try:
+            batch.commit()
+        finally:
+            self.done.set()
+
+
+class Batch:
+    """A group of write operations committed together.
+
+    Files appended to during the batch are held open, and are
+    flushed (and synced, depending on the fsync policy) once
+    when the batch is committed.
+    """
+
+    policy: FsyncPolicy
+    _handles: dict[Path, IO[Any]]
+    _dbs: dict[Path, sqlite3.Connection]
+    _used_dbs: set[Path]
+    # scratch space for operations that accumulate state over a batch
+    state: dict[Any, Any]
+    _on_commit: list[Callable[[], None]]
+
+    def __init__(self, policy: FsyncPolicy, dbs: dict[Path, sqlite3.Connection]):
+        self.policy = policy
+        self._handles = {}
+        # database connections are kept open across batches
+        self._dbs = dbs
+        self._used_dbs = set()
+        self.state = {}
+        self._on_commit = []
+
+    def on_commit(self, fn: Callable[[], None]):
+        """Call fn once everything else in the batch has been written."""
+        self._on_commit.append(fn)
+
+    def handle(self, path: Path):
+        f = self._handles.get(path)
+        if not f:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            f = self._handles[path] = open(path, 'a')
+        return f
+
+    def db(self, path: Path):
+        conn = self._dbs.get(path)
+        if not conn:
+            conn = self._dbs[path] = sqlite3.connect(path)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Each transaction gets synced unless the policy is 'none';
+            # with 'per-batch', a whole batch is a single transaction.
+            conn.execute('PRAGMA synchronous=' +
+                         ('OFF' if self.policy == 'none' else 'FULL'))
+        self._used_dbs.add(path)
+        return conn
+
+    def sync(self, f: IO[Any]):
+        f.flush()
+        os.fsync(f.fileno())
+
+    def close(self, path: Path):
+        f = self._handles.pop(path, None)
+        if f:
+            if self.policy == 'per-batch':
+                self.sync(f)
+            f.close()
+
+    def commit(self):
+        for path in list(self._handles.keys()):
+            self.close(path)
+        for path in self._used_dbs:
+            self._dbs[path].commit()
+        self._used_dbs.clear()
+        on_commit, self._on_commit = self._on_commit, []
+        for fn in on_commit:
+            fn()
+        self.state.clear()
+
+
+class Writer:
+    """Write-behind queue for persistent data.
+
+    Operations are applied in submission order by a dedicated
+    writer thread, which drains whatever has accumulated in the
+    queue as a single batch.
+    """
+
+    policy: FsyncPolicy
+    max_batch: int
+    _queue: queue.Queue[Optional[WriteOp]]
+    _thread: Any
+    # only ever touched by the writer thread
+    _dbs: dict[Path, sqlite3.Connection]
+
+    def __init__(self, queue_size: int, policy: str, max_batch: int):
+        if policy not in fsync_policies:
+            raise BadFsyncPolicyError(policy)
+        self.policy = policy  # type: ignore
+        self.max_batch = max_batch
+        # NB: When the queue is full, submitting waits until
+        # the writer catches up (see _put)
+        self._queue = queue.Queue(queue_size)
+        self._dbs = {}
+        self._thread = threading.Thread(
+            target=self._run, name='expert-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, op: WriteOp):
+        self._put(op)
+
+    def _put(self, op: Optional[WriteOp]):
+        try:
+            self._queue.put_nowait(op)
+        except queue.Full:
+            # NB: The queue is a real one, so a blocking put would
+            # stall the hub along with every green thread; as in
+            # flush, an OS thread from eventlet's pool does the
+            # waiting while this green thread yields
+            tpool.execute(self._queue.put, op)
+
+    def flush(self):
+        """Wait until everything submitted so far has been written."""
+        if not self._thread.is_alive():
+            return
+        barrier = Barrier()
+        self._put(barrier)
+        # NB: Waiting on the (real) event here would block the hub,
+        # and every green thread with it, until the writer caught up;
+        # instead, an OS thread from eventlet's pool waits on it
+        # while this green thread yields
+        tpool.execute(barrier.done.wait)
+
+    def close(self):
+        if not self._thread.is_alive():
+            return
+        e.log.info('flushing write queue')
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            ops = [self._queue.get()]
+            while len(ops) < self.max_batch:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = Batch(self.policy, self._dbs)
+            for op in ops:
+                if op is None:
+                    self._apply(batch.commit)
+                    for conn in self._dbs.values():
+                        conn.close()
+                    return
+                self._apply(op.apply, batch)
+            self._apply(batch.commit)
+
+    def _apply(self, fn, *args):
+        try:
+            fn(*args)
+        except:
+            e.log.error(f'write queue error: {traceback.format_exc()}')